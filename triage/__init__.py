@@ -0,0 +1 @@
+"""Helper modules for the Regenschirmfreunde triage dashboard."""
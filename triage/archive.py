@@ -0,0 +1,276 @@
+"""
+Compaction of old assignment history out of the hot event log.
+
+The event log keeps every click forever, and full_log() reads all of it.
+This job moves every closed segment whose newest event is older than
+TRIAGE_HOT_DAYS (default 90) days out of events/:
+
+    archive/raw/events-<first seq>.jsonl.gz   the segment itself, gzipped (audit)
+    archive/daily/<YYYY-MM>.json.gz           consults per day and MA (AM/PM,
+                                              setting) of that month
+    archive/index.json                        archived segments plus running
+                                              totals per MA, read by the dashboard
+
+Only segments covered by snapshot.json are touched, so the folded state
+and a restart never need them again. Every summary file records the last
+sequence number folded into it and skips anything at or below it, and the
+hot segment is deleted last, so an interrupted run can simply be repeated.
+Hot storage and the full log view thus stay bounded by the window,
+however long the service runs.
+
+    python -m triage.archive [--days N] [--dry-run] [team ...]
+    python -m triage_dashboard compact [team ...]    (same, default window)
+
+Benchmark over simulated years of history:
+    python -m triage.archive --simulate 3
+"""
+
+import argparse
+import datetime
+import gzip
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from triage.events import TENANTS_STATE_DIR, EventStore, TriageState, read_segment, write_json_atomic
+
+HOT_DAYS = int(os.environ.get("TRIAGE_HOT_DAYS", "90"))
+ARCHIVE_DIR = "archive"
+INDEX_FILE = "index.json"
+
+
+def summarize(events, days=None):
+    """Fold go/batch events into {day: {MA: {"consults", "AM", "PM", "settings"}}}"""
+    days = {} if days is None else days
+    for event in events:
+        if event["type"] == "go":
+            items = [{"ma": event["ma"], "setting": event.get("setting")}]
+        elif event["type"] == "batch":
+            items = event["assignments"]
+        else:
+            continue
+        per_ma = days.setdefault(event["ts"][:10], {})
+        for item in items:
+            row = per_ma.setdefault(item["ma"], {"consults": 0, "AM": 0, "PM": 0, "settings": {}})
+            row["consults"] += 1
+            if event.get("period") in ("AM", "PM"):
+                row[event["period"]] += 1
+            if item.get("setting"):
+                row["settings"][item["setting"]] = row["settings"].get(item["setting"], 0) + 1
+    return days
+
+
+def _write_gzip_atomic(path, data):
+    tmp = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp, "wb") as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileobj.fileno())
+    os.replace(tmp, path)
+
+
+def read_month(path):
+    """One monthly summary file (empty if it does not exist yet)"""
+    try:
+        with gzip.open(path, "rb") as fh:
+            return json.loads(fh.read())
+    except FileNotFoundError:
+        return {"through_seq": 0, "days": {}}
+
+
+def read_index(root):
+    """Archive index of a team's state directory (empty if nothing is archived)"""
+    try:
+        with open(Path(root) / ARCHIVE_DIR / INDEX_FILE, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {"through_seq": 0, "segments": [], "totals": {}, "first_day": None, "last_day": None}
+
+
+def daily_history(root, month):
+    """{day: {MA: counts}} of one archived month ("YYYY-MM")"""
+    return read_month(Path(root) / ARCHIVE_DIR / "daily" / f"{month}.json.gz")["days"]
+
+
+def eligible_segments(root, cutoff_day):
+    """Oldest closed segments covered by the snapshot whose events all predate cutoff_day"""
+    root = Path(root)
+    try:
+        with open(root / "snapshot.json", encoding="utf-8") as fh:
+            snapshot_seq = json.load(fh)["seq"]
+    except (OSError, ValueError):
+        return []
+    segments = sorted((root / "events").glob("events-*.jsonl"))
+    chosen = []
+    for path, following in zip(segments, segments[1:]):  # never the open (last) segment
+        last_seq = int(following.stem.split("-")[1]) - 1
+        events = read_segment(path)
+        if last_seq > snapshot_seq or (events and events[-1]["ts"][:10] >= cutoff_day):
+            break  # keep the log contiguous: stop at the first segment that must stay
+        chosen.append((path, events))
+    return chosen
+
+
+def compact(root, hot_days=HOT_DAYS, today=None, dry_run=False):
+    """Archive one team's old segments; returns a summary of what was moved"""
+    root = Path(root)
+    today = today or datetime.date.today()
+    cutoff_day = (today - datetime.timedelta(days=hot_days)).isoformat()
+    chosen = eligible_segments(root, cutoff_day)
+    moved_bytes = sum(path.stat().st_size for path, _ in chosen)
+    result = {"segments": len(chosen), "events": sum(len(events) for _, events in chosen),
+              "hot_bytes_freed": moved_bytes, "cutoff_day": cutoff_day}
+    if dry_run or not chosen:
+        return result
+
+    archive = root / ARCHIVE_DIR
+    (archive / "raw").mkdir(parents=True, exist_ok=True)
+    (archive / "daily").mkdir(parents=True, exist_ok=True)
+    index = read_index(root)
+
+    # 1. Raw segments, byte for byte, for audit
+    for path, _ in chosen:
+        _write_gzip_atomic(archive / "raw" / (path.name + ".gz"), path.read_bytes())
+
+    # 2. Daily summaries, merged per month; each file skips what it already holds
+    by_month = {}
+    for _, events in chosen:
+        for event in events:
+            by_month.setdefault(event["ts"][:7], []).append(event)
+    for month, events in sorted(by_month.items()):
+        path = archive / "daily" / f"{month}.json.gz"
+        summary = read_month(path)
+        fresh = [event for event in events if event["seq"] > summary["through_seq"]]
+        if not fresh:
+            continue
+        summarize(fresh, summary["days"])
+        summary["through_seq"] = fresh[-1]["seq"]
+        _write_gzip_atomic(path, json.dumps(summary, ensure_ascii=False, separators=(",", ":")).encode())
+
+    # 3. Index with running totals (only events past its own through_seq count)
+    last_seq = chosen[-1][1][-1]["seq"] if chosen[-1][1] else index["through_seq"]
+    if last_seq > index["through_seq"]:
+        counted = summarize(event for _, events in chosen for event in events
+                            if event["seq"] > index["through_seq"])
+        for per_ma in counted.values():
+            for ma, row in per_ma.items():
+                index["totals"][ma] = index["totals"].get(ma, 0) + row["consults"]
+        days = sorted(counted)
+        if days:
+            index["first_day"] = index["first_day"] or days[0]
+            index["last_day"] = days[-1]
+        names = {segment["name"] for segment in index["segments"]}
+        index["segments"] += [{"name": path.name, "events": len(events),
+                               "first_seq": events[0]["seq"] if events else None,
+                               "last_seq": events[-1]["seq"] if events else None}
+                              for path, events in chosen if path.name not in names]
+        index["through_seq"] = last_seq
+        write_json_atomic(archive / INDEX_FILE, index)
+
+    # 4. Only now the hot copies go
+    for path, _ in chosen:
+        path.unlink()
+    result["archive_bytes"] = sum(p.stat().st_size for p in archive.rglob("*") if p.is_file())
+    return result
+
+
+def _simulate(root, years, consults_per_day=12, seed=0):
+    """Write `years` of GO history as segments of 200 events plus snapshot"""
+    rng = random.Random(seed)
+    members = ["BA", "AN", "JU", "VE", "CA", "SA", "PG"]
+    state = TriageState()
+    events_dir = Path(root) / "events"
+    events_dir.mkdir(parents=True, exist_ok=True)
+    segment = None
+    start = datetime.date.today() - datetime.timedelta(days=int(years * 365))
+    seq = 0
+
+    def emit(event):
+        nonlocal seq, segment
+        seq += 1
+        event["seq"] = seq
+        if segment is None or (seq - 1) % 200 == 0:
+            if segment is not None:
+                segment.close()
+                write_json_atomic(Path(root) / "snapshot.json", state.to_dict())
+            segment = open(events_dir / f"events-{seq:012d}.jsonl", "w", encoding="utf-8")
+        state.apply(event)
+        segment.write(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    emit({"type": "roster", "members": members, "ts": f"{start.isoformat()}T07:00:00"})
+    for offset in range(int(years * 365) + 1):
+        day = (start + datetime.timedelta(days=offset)).isoformat()
+        for i in range(consults_per_day):
+            period = "AM" if i < consults_per_day // 2 else "PM"
+            emit({"type": "go", "ma": state.queue[0], "period": period,
+                  "setting": rng.choice(["stationär", "ambulant"]),
+                  "ts": f"{day}T{8 + i % 9:02d}:00:00"})
+    segment.close()
+    write_json_atomic(Path(root) / "snapshot.json", state.to_dict())
+    return seq
+
+
+def _timed_full_log(root):
+    store = EventStore(root, group_commit=False)
+    start = time.perf_counter()
+    rows = len(store.full_log())
+    elapsed = (time.perf_counter() - start) * 1000
+    store.close()
+    return rows, elapsed
+
+
+def _benchmark(years):
+    with tempfile.TemporaryDirectory() as tmp:
+        events = _simulate(tmp, years)
+        hot_before = sum(p.stat().st_size for p in Path(tmp, "events").glob("*.jsonl"))
+        rows_before, ms_before = _timed_full_log(tmp)
+        start = time.perf_counter()
+        result = compact(tmp)
+        compact_ms = (time.perf_counter() - start) * 1000
+        hot_after = sum(p.stat().st_size for p in Path(tmp, "events").glob("*.jsonl"))
+        rows_after, ms_after = _timed_full_log(tmp)
+        index = read_index(tmp)
+        archived = sum(index["totals"].values())
+        if archived + rows_after != rows_before:
+            raise AssertionError(f"{archived} archived + {rows_after} hot != {rows_before} consults")
+        # A second run finds nothing new and changes no totals
+        if compact(tmp)["segments"] or read_index(tmp)["totals"] != index["totals"]:
+            raise AssertionError("compaction is not idempotent")
+    return events, hot_before, hot_after, rows_before, rows_after, ms_before, ms_after, compact_ms, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="archive old event segments into daily summaries")
+    parser.add_argument("teams", nargs="*", help="teams to compact (default: all with state)")
+    parser.add_argument("--days", type=int, default=HOT_DAYS, help="days of raw history kept hot")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be archived")
+    parser.add_argument("--simulate", type=float, metavar="YEARS",
+                        help="benchmark on simulated history instead of compacting")
+    args = parser.parse_args(argv)
+
+    if args.simulate:
+        (events, hot_before, hot_after, rows_before, rows_after, ms_before, ms_after,
+         compact_ms, result) = _benchmark(args.simulate)
+        print(f"{args.simulate:g} years, {events} events: compacted {result['segments']} segments "
+              f"in {compact_ms:.0f} ms")
+        print(f"hot log {hot_before / 1024:.0f} KB -> {hot_after / 1024:.0f} KB, "
+              f"archive {result['archive_bytes'] / 1024:.0f} KB")
+        print(f"full log {rows_before} rows in {ms_before:.0f} ms -> {rows_after} rows in {ms_after:.0f} ms")
+        return 0
+
+    teams = args.teams or (sorted(p.name for p in TENANTS_STATE_DIR.iterdir() if p.is_dir())
+                           if TENANTS_STATE_DIR.exists() else [])
+    for team in teams:
+        result = compact(TENANTS_STATE_DIR / team, args.days, dry_run=args.dry_run)
+        action = "would archive" if args.dry_run else "archived"
+        print(f"{team}: {action} {result['segments']} segments / {result['events']} events "
+              f"before {result['cutoff_day']}, {result['hot_bytes_freed'] / 1024:.0f} KB hot")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+Offline precompilation of the data/ assets.
+
+    python -m triage_dashboard build-assets [team ...]
+
+writes, per team, into build/assets/<team>/ (TRIAGE_BUILD_DIR):
+    avatars/<MA>-400.webp, avatars/<MA>-60.webp   square photos for the
+                                                   big avatar and the mini list
+    sops/<name>-<frame>-<width>.webp               SOP page previews (1200 px) and
+                                                   page-strip thumbnails (160 px)
+    roster.pkl                                     typed roster rows
+    quiz.pkl                                       quiz bank indexed by question id
+    manifest.json                                  per output: source size/mtime/
+                                                   SHA-256 and output SHA-256
+
+At startup a tenant only reads manifest.json. An entry is used when its
+source file still has the recorded size and mtime and the output still
+matches its hash; anything else is stale and processed live as before.
+
+Images reach the browser by URL, not inline: StaticImages copies each
+image (prebuilt or live) once to static/img/<sha256>.<ext>, which
+Streamlit serves under app/static/ (enableStaticServing). The `?v=` query
+makes tornado answer with a ten-year max-age, and as the name is the
+content hash a changed photo simply gets a new URL. A browser thus
+downloads every image version once instead of with every rerun, and the
+rerun messages stay small. static/img/ can be deleted at any time, it is
+refilled on demand. TRIAGE_INLINE_IMAGES=1 goes back to data: URIs (e.g.
+behind a proxy that does not pass app/static/).
+"""
+
+import base64
+import hashlib
+import io
+import json
+import os
+import pickle
+import sys
+import time
+from pathlib import Path
+
+from triage.sops import SOP_SIZES, render_page
+
+BUILD_DIR = Path(os.environ.get("TRIAGE_BUILD_DIR", "build/assets"))
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+AVATAR_SIZES = {"avatar": 400, "mini": 60}  # 2x the CSS size for sharp retina displays
+QUIZ_FILE = "quiz_bank.json"
+STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+STATIC_URL = "app/static"
+IMAGES_DIR = "img"
+INLINE_IMAGES = os.environ.get("TRIAGE_INLINE_IMAGES", "") == "1"
+# Streamlit serves other extensions as text/plain
+STATIC_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp", "image/gif": ".gif"}
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp",
+              ".tif": "image/tiff", ".tiff": "image/tiff"}
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def mime_type(path):
+    return MIME_TYPES.get(Path(path).suffix.lower(), "application/octet-stream")
+
+
+def index_quiz_bank(levels):
+    """Quiz levels plus lookups by question id"""
+    by_id = {}
+    correct = {}
+    for level_key, level in levels.items():
+        for position, question in enumerate(level["questions"]):
+            by_id[question["id"]] = (level_key, position)
+            correct[question["id"]] = question["correct"]
+    return {"levels": levels, "by_id": by_id, "correct": correct}
+
+
+def read_quiz_bank(path):
+    with open(path, encoding="utf-8") as fh:
+        return index_quiz_bank(json.load(fh))
+
+
+def avatar_webp(path, size):
+    """Square, centre-cropped WebP thumbnail of a photo"""
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as image:
+        thumb = ImageOps.fit(image.convert("RGBA"), (size, size), Image.LANCZOS)
+    out = io.BytesIO()
+    thumb.save(out, "WEBP", quality=85, method=6)
+    return out.getvalue()
+
+
+def data_uri(data, mime):
+    return f"data:{mime};base64,{base64.b64encode(data).decode()}"
+
+
+class StaticImages:
+    """Content-addressed image files under static/img/ (browser-cacheable URLs)"""
+
+    def __init__(self, root=STATIC_DIR / IMAGES_DIR, inline=INLINE_IMAGES):
+        self.root = Path(root)
+        self.inline = inline
+        self.published = 0
+        self.published_bytes = 0
+        self.inlined = 0
+
+    def url(self, data, mime):
+        """URL of the image bytes, publishing them on first use (data: URI as fallback)"""
+        extension = STATIC_EXTENSIONS.get(mime)
+        if extension and not self.inline:
+            digest = sha256(data)[:20]
+            name = f"{digest}{extension}"
+            path = self.root / name
+            try:
+                if not path.exists():
+                    self.root.mkdir(parents=True, exist_ok=True)
+                    tmp = path.with_name(f".{name}.{os.getpid()}.tmp")
+                    tmp.write_bytes(data)
+                    os.replace(tmp, path)  # other workers may publish the same file
+                    self.published += 1
+                    self.published_bytes += len(data)
+                return f"{STATIC_URL}/{IMAGES_DIR}/{name}?v={digest}"
+            except OSError:  # read-only checkout
+                pass
+        self.inlined += 1
+        return data_uri(data, mime)
+
+    def stats(self):
+        return {"published": self.published, "published_kb": round(self.published_bytes / 1024, 1),
+                "inlined": self.inlined}
+
+
+class AssetManifest:
+    """Read side of one team's build directory"""
+
+    def __init__(self, root):
+        self.root = Path(root) if root else None
+        self.hits = 0
+        self.stale = 0
+        try:
+            if self.root is None:
+                raise FileNotFoundError  # live processing only (used by the builder)
+            with open(self.root / MANIFEST_FILE, encoding="utf-8") as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            manifest = {}
+        self.entries = manifest.get("entries", {}) if manifest.get("version") == MANIFEST_VERSION else {}
+
+    def _fresh(self, entry, source):
+        try:
+            stat = Path(source).stat()
+        except OSError:
+            return False
+        return (entry["source"] == str(source) and entry["source_size"] == stat.st_size
+                and entry["source_mtime_ns"] == stat.st_mtime_ns)
+
+    def read(self, name, source):
+        """(bytes, mime) of a prebuilt output, or None if missing or stale"""
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        if self._fresh(entry, source):
+            try:
+                data = (self.root / entry["output"]).read_bytes()
+            except OSError:
+                data = None
+            if data is not None and sha256(data) == entry["sha256"]:
+                self.hits += 1
+                return data, entry["mime"]
+        self.stale += 1
+        return None
+
+    def load(self, name, source):
+        """Unpickled prebuilt object, or None if missing or stale"""
+        found = self.read(name, source)
+        return pickle.loads(found[0]) if found else None
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "stale": self.stale}
+
+
+class AssetBuilder:
+    """Write side: collects outputs and writes the manifest last"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.entries = {}
+
+    def add(self, name, source, output, data, mime):
+        source = Path(source)
+        stat = source.stat()
+        target = self.root / output
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+        self.entries[name] = {
+            "source": str(source),
+            "source_size": stat.st_size,
+            "source_mtime_ns": stat.st_mtime_ns,
+            "source_sha256": sha256(source.read_bytes()),
+            "output": output,
+            "sha256": sha256(data),
+            "bytes": len(data),
+            "mime": mime,
+        }
+
+    def add_pickle(self, name, source, output, obj):
+        self.add(name, source, output, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL),
+                 "application/x-python-pickle")
+
+    def write_manifest(self):
+        manifest = {"version": MANIFEST_VERSION, "built": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "entries": self.entries}
+        tmp = self.root / (MANIFEST_FILE + ".tmp")
+        tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, self.root / MANIFEST_FILE)
+
+
+def build_tenant(tenant, root):
+    """Precompile one team's assets, returns the number of outputs"""
+    builder = AssetBuilder(root)
+    roster_source = tenant.roster_source()
+    if tenant.roster is not None and not tenant.errors and roster_source:
+        builder.add_pickle("roster", roster_source, "roster.pkl", tenant.roster.as_dicts())
+    for ma in (tenant.roster.ma_codes() if tenant.roster is not None else []):
+        photo = tenant.photo_path(ma)
+        if photo:
+            for kind, size in AVATAR_SIZES.items():
+                builder.add(f"{kind}:{ma}", photo, f"avatars/{ma}-{size}.webp",
+                            avatar_webp(photo, size), "image/webp")
+    for sop in tenant.sop_files():
+        for filename, frame in sop["pages"]:
+            source = tenant.data_dir / filename
+            for kind, width in SOP_SIZES.items():
+                builder.add(f"{kind}:{filename}#{frame}", source,
+                            f"sops/{source.stem}-{frame}-{width}.webp",
+                            render_page(source, frame, width), "image/webp")
+    quiz_source = tenant.quiz_source()
+    if quiz_source:
+        builder.add_pickle("quiz", quiz_source, "quiz.pkl", read_quiz_bank(quiz_source))
+    builder.write_manifest()
+    return len(builder.entries)
+
+
+def main(teams=()):
+    """CLI: build assets for the given teams (default: all)"""
+    from triage.tenancy import Tenant, list_teams, team_data_dir
+
+    for team in teams or list_teams():
+        start = time.perf_counter()
+        root = BUILD_DIR / team
+        count = build_tenant(Tenant(team, team_data_dir(team), assets=False), root)
+        size = sum(p.stat().st_size for p in root.rglob("*") if p.is_file())
+        print(f"{team}: {count} outputs, {size / 1024:.0f} KB in {root} "
+              f"({(time.perf_counter() - start) * 1000:.0f} ms)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,193 @@
+"""
+Lightweight triage core: roster records and rotation queue in pure Python.
+
+The roster is a seven-row CSV, so it is read with the csv module into
+compact namedtuple records instead of a DataFrame. Nothing in here imports
+pandas; the dashboard only imports it when a log or statistics table is
+actually switched on.
+
+Import-time check (fails if pandas sneaks back into the startup path):
+    python -m triage.core
+"""
+
+import csv
+import statistics
+import subprocess
+import sys
+from collections import deque, namedtuple
+from pathlib import Path
+
+DEMO_ROSTER = [{
+    "name": "DEMO",
+    "kuerzel": "DEMO",
+    "anstellungs_prozent": 100,
+    "stationaer_anteil": 50,
+    "verfuegbar": True,
+}]
+OVERVIEW_COLUMNS = ['MA', 'name', 'anstellungs_prozent', 'stationaer_anteil', 'verfuegbar']
+IMPORT_BUDGET_MS = 150
+SETTINGS = ("stationaer", "ambulant")
+
+
+def deep_sizeof(obj, _seen=None):
+    """Approximate memory footprint of nested builtin containers"""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, _seen) + deep_sizeof(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(v, _seen) for v in obj)
+    elif hasattr(obj, "memory_bytes"):
+        size += obj.memory_bytes()
+    return size
+
+
+def convert_cell(value):
+    """Infer bool/int/float from a CSV cell the way read_csv would"""
+    if value in ("True", "False"):
+        return value == "True"
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+class Roster:
+    """Immutable list of employee records with lookup by MA code"""
+
+    __slots__ = ("columns", "records", "_by_ma")
+
+    def __init__(self, rows):
+        columns = list(rows[0]) if rows else []
+        if "MA" not in columns:
+            columns.append("MA")
+        record_type = namedtuple("Employee", columns, rename=True)
+        self.columns = columns
+        self.records = tuple(record_type(*[row.get(c) for c in columns])
+                             for row in rows)
+        self._by_ma = {record.MA: record for record in self.records}
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, ma_code):
+        return ma_code in self._by_ma
+
+    def get(self, ma_code):
+        return self._by_ma.get(ma_code)
+
+    def ma_codes(self):
+        return [record.MA for record in self.records]
+
+    def as_dicts(self, columns=None):
+        """Rows as plain dicts (for st.table / st.dataframe)"""
+        index = {c: i for i, c in enumerate(self.columns)}
+        columns = [c for c in (columns or self.columns) if c in index]
+        return [{c: record[index[c]] for c in columns} for record in self.records]
+
+    def memory_bytes(self):
+        return sum(sys.getsizeof(record) + sum(sys.getsizeof(v) for v in record)
+                   for record in self.records)
+
+
+def load_roster(data_dir):
+    """Read employees.csv (or employees.xlsx), returning (Roster or None, list of error messages)"""
+    emp_file = Path(data_dir) / "employees.csv"
+    xlsx_file = emp_file.with_suffix(".xlsx")
+    errors = []
+    if not emp_file.exists() and xlsx_file.exists():
+        # Workbook fallback, served from its cached snapshot after the first parse
+        from triage.workbooks import load_workbook
+        try:
+            rows = load_workbook(xlsx_file).records()
+        except Exception as e:
+            errors.append(f"❌ Fehler bim Lade vo employees.xlsx: {e}")
+            errors.append("⚠️ Demo-Modus aktiviert")
+            rows = [dict(row) for row in DEMO_ROSTER]
+    elif not emp_file.exists():
+        errors.append(f"❌ {emp_file} nöd gfunde – bitte Datei hinzuefüege.")
+        errors.append("⚠️ Demo-Modus: App startet ohni Mitarbeiterdaten. Upload de CSV für volli Funktionalität.")
+        rows = [dict(row) for row in DEMO_ROSTER]
+    else:
+        try:
+            with emp_file.open(newline="", encoding="utf-8") as fh:
+                rows = [{key: convert_cell(value) for key, value in row.items()}
+                        for row in csv.DictReader(fh)]
+        except Exception as e:
+            errors.append(f"❌ Fehler bim Lade vo employees.csv: {e}")
+            errors.append("⚠️ Demo-Modus aktiviert")
+            rows = [dict(row) for row in DEMO_ROSTER]
+    # Use 'name' column as the MA identifier (contains the actual abbreviations like CA, BA, etc.)
+    for id_column in ("name", "kuerzel"):
+        if rows and id_column in rows[0]:
+            for row in rows:
+                row["MA"] = row[id_column]
+            return Roster(rows), errors
+    errors.append("CSV-Datei muess entweder 'name' oder 'kuerzel' Spalte ha")
+    return None, errors
+
+
+def rotation_queue(session_queue, available):
+    """Session queue restricted to available MAs, reset if nobody is left"""
+    available_set = set(available)
+    queue = [ma for ma in session_queue if ma in available_set]
+    if not queue:
+        queue = list(available)
+    return queue
+
+
+def assign_batch(queue, consults):
+    """Distribute consults round-robin over the queue in one pass.
+
+    Returns a list of (consult, MA) pairs in input order; the queue itself
+    moves on when the batch event is applied (triage.events). The input
+    queue is not modified.
+    """
+    if not queue:
+        return []
+    return [(consult, queue[i % len(queue)]) for i, consult in enumerate(consults)]
+
+
+def daily_load(entries, day):
+    """Consults per MA among log entries of one day (YYYY-MM-DD)"""
+    load = {}
+    for entry in entries:
+        if entry.get("Zeit", "").startswith(day):
+            load[entry["MA"]] = load.get(entry["MA"], 0) + 1
+    return load
+
+
+def measure_import(runs=7):
+    """Median cold import time (ms) of the triage modules plus roster load"""
+    code = (
+        "import time; t = time.perf_counter(); "
+        "import triage.tenancy, triage.session_store, triage.core as c; "
+        "c.load_roster('data'); "
+        "import sys; print((time.perf_counter() - t) * 1000, 'pandas' in sys.modules)"
+    )
+    root = Path(__file__).resolve().parent.parent
+    timings = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=root,
+                             capture_output=True, text=True, check=True).stdout.split()
+        if out[1] == "True":
+            raise AssertionError("pandas was imported on the fast-start path")
+        timings.append(float(out[0]))
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    median_ms = measure_import()
+    print(f"core import + roster load: {median_ms:.1f} ms (budget {IMPORT_BUDGET_MS} ms)")
+    sys.exit(0 if median_ms <= IMPORT_BUDGET_MS else 1)
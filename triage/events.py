@@ -0,0 +1,706 @@
+"""
+Event-sourced triage state with periodic snapshots.
+
+Every GO, NO, batch, attendance toggle and roster change is appended to an
+event log. The rotation queue, today's attendance and the recent assignment
+log are derived by folding those events (`apply`). Every SNAPSHOT_EVERY
+events the folded state is written to snapshot.json and a new log segment
+is started, so a restart only replays the events after the last snapshot.
+
+Writes are write-behind: append() folds the event into the in-memory state
+and hands the serialized line to a GroupCommitWriter (triage.persist),
+which writes and fsyncs it together with the other events of the same few
+milliseconds. Snapshots and segment rotation go through the same writer,
+so the files change in exactly the order the events happened.
+
+With TRIAGE_SHARED_STATE=1 several worker processes (triage.workers) use
+the same files: appends, snapshots and the once-per-day ledger run under
+an exclusive file lock, after the process has folded the events the other
+workers appended since it last looked, so every worker assigns the next
+sequence number and sees the same next MA. Each rerun calls refresh(),
+which costs one fstat() when nobody else wrote anything.
+
+The first run of a day appends a "ledger" event (triage.fairness) that
+settles the previous day into per-MA credits and seeds the day's queue
+from them.
+
+Buttons submit commands rather than raw events: every rendered
+recommendation carries a token tied to the queue version it was rendered
+from and the session that rendered it. A token is executed at most once;
+repeats (double taps, delayed reruns) are answered from a bounded cache of
+recent tokens, and tokens from an older queue version are rejected as
+stale. Two tablets pressing GO on the same screen therefore get "applied"
+and "stale", never a "duplicate" that would swallow the second consult.
+Attendance toggles count as queue changes too, so a GO rendered before its
+MA was marked absent fails.
+
+Burst-click stress test (fails if a token is ever executed twice), threads
+of one process and then worker processes sharing one log:
+    python -m triage.events [--processes 4]
+
+Layout per team (under data/state/tenants/<team>/):
+    snapshot.json                  folded state at sequence number N
+    events/events-<first seq>.jsonl append-only segments, one event per line
+    writer.lock                    file lock of the worker processes (shared state)
+"""
+
+import atexit
+import datetime
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+
+from triage.core import deep_sizeof
+from triage.fairness import day_event
+from triage.persist import SHARED_STATE, GroupCommitWriter, ImmediateWriter, SharedLock
+from triage.tenancy import STATE_DIR
+
+TENANTS_STATE_DIR = STATE_DIR / "tenants"
+SNAPSHOT_EVERY = int(os.environ.get("TRIAGE_SNAPSHOT_EVERY", "200"))
+RECENT_LOG_ENTRIES = int(os.environ.get("TRIAGE_RECENT_LOG", "500"))
+RECENT_COMMANDS = int(os.environ.get("TRIAGE_RECENT_COMMANDS", "1024"))
+EVENT_TYPES = ("roster", "go", "skip", "batch", "attendance", "ledger")
+# Events that change who is up next; each one makes older command tokens stale
+QUEUE_EVENTS = ("roster", "go", "skip", "batch", "attendance", "ledger")
+SHARED_POLL_SECONDS = float(os.environ.get("TRIAGE_SHARED_POLL_MS", "250")) / 1000
+
+
+def log_entry(event, ma, setting=None):
+    """Assignment log row for an assignment event"""
+    entry = {
+        "Zeit": event["ts"][:16].replace("T", " "),
+        "MA": ma,
+        "Period": event.get("period", ""),
+    }
+    if setting is not None or "batch" in event:
+        entry["Setting"] = setting or ""
+    if "batch" in event:
+        entry["Batch"] = event["batch"]
+    return entry
+
+
+def move_to_end(queue, ma):
+    if ma in queue:
+        queue.remove(ma)
+        queue.append(ma)
+
+
+class TriageState:
+    """Folded state: rotation queue, attendance of the day, recent log, fairness ledger"""
+
+    def __init__(self):
+        self.seq = 0
+        self.members = []
+        self.queue = []
+        self.attendance_day = None
+        self.attendance = {}
+        self.recent = deque(maxlen=RECENT_LOG_ENTRIES)
+        self.assignments = 0
+        self.queue_version = 0
+        self.commands = OrderedDict()  # recent command token -> seq of its event
+        self.credits = {}  # MA -> consults owed (+) or received in excess (-)
+        self.ledger_day = None
+        self.day_counts = {}  # consults per MA since the ledger day was opened
+
+    def present(self, ma, period, default=True, day=None):
+        """Attendance of an MA for AM/PM today, falling back to the roster default"""
+        day = day or datetime.date.today().isoformat()
+        if self.attendance_day != day:
+            return default
+        return self.attendance.get(ma, {}).get(period, default)
+
+    def apply(self, event):
+        """Fold one event into the state"""
+        kind = event["type"]
+        if kind == "roster":
+            members = list(event["members"])
+            member_set = set(members)
+            self.queue = [ma for ma in self.queue if ma in member_set]
+            self.queue += [ma for ma in members if ma not in self.queue]
+            self.members = members
+        elif kind == "go":
+            move_to_end(self.queue, event["ma"])
+            self._log(log_entry(event, event["ma"], event.get("setting")))
+            self._count(event["ma"])
+        elif kind == "skip":
+            move_to_end(self.queue, event["ma"])
+        elif kind == "batch":
+            # Everyone moves behind the others in the order of their last consult
+            last_position = {}
+            for i, item in enumerate(event["assignments"]):
+                last_position[item["ma"]] = i
+                self._log(log_entry(event, item["ma"], item.get("setting")))
+                self._count(item["ma"])
+            for ma in sorted(last_position, key=last_position.get):
+                move_to_end(self.queue, ma)
+        elif kind == "attendance":
+            day = event["ts"][:10]
+            if self.attendance_day != day:
+                self.attendance_day = day
+                self.attendance = {}
+            self.attendance.setdefault(event["ma"], {})[event["period"]] = event["present"]
+        elif kind == "ledger":
+            seeded = set(event["queue"])
+            self.queue = list(event["queue"]) + [ma for ma in self.queue if ma not in seeded]
+            self.credits = dict(event["credits"])
+            self.ledger_day = event["day"]
+            self.day_counts = {}
+        if kind in QUEUE_EVENTS:
+            self.queue_version += 1
+        if "command" in event:
+            self.commands[event["command"]] = event["seq"]
+            if len(self.commands) > RECENT_COMMANDS:
+                self.commands.popitem(last=False)
+        self.seq = event["seq"]
+
+    def command_token(self, action, subject=""):
+        """Token for a button rendered from the current queue version"""
+        return f"{self.queue_version}:{action}:{subject}"
+
+    def _log(self, entry):
+        self.recent.append(entry)
+        self.assignments += 1
+
+    def _count(self, ma):
+        self.day_counts[ma] = self.day_counts.get(ma, 0) + 1
+
+    def to_dict(self):
+        return {
+            "seq": self.seq,
+            "members": self.members,
+            "queue": self.queue,
+            "attendance_day": self.attendance_day,
+            "attendance": self.attendance,
+            "recent": list(self.recent),
+            "assignments": self.assignments,
+            "queue_version": self.queue_version,
+            "commands": list(self.commands.items()),
+            "credits": self.credits,
+            "ledger_day": self.ledger_day,
+            "day_counts": self.day_counts,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.seq = data["seq"]
+        state.members = data["members"]
+        state.queue = data["queue"]
+        state.attendance_day = data["attendance_day"]
+        state.attendance = data["attendance"]
+        state.recent.extend(data["recent"])
+        state.assignments = data["assignments"]
+        state.queue_version = data.get("queue_version", 0)
+        state.commands.update(data.get("commands", []))
+        state.credits = data.get("credits", {})
+        state.ledger_day = data.get("ledger_day")
+        state.day_counts = data.get("day_counts", {})
+        return state
+
+
+def scan_segment(path, after_seq=0):
+    """(events with seq > after_seq, complete lines that could not be parsed) of one segment.
+
+    A damaged line in the middle is skipped, the events after it still count;
+    only a torn last line (no newline yet) ends the scan.
+    """
+    events = []
+    skipped = 0
+    with open(path, "rb") as fh:
+        for line in fh:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                event = json.loads(line)
+                seq = event["seq"]
+            except (ValueError, TypeError, KeyError):
+                skipped += 1
+                continue
+            if seq > after_seq:
+                events.append(event)
+    return events, skipped
+
+
+def read_segment(path, after_seq=0):
+    """Events of one segment with seq > after_seq (unreadable lines are skipped)"""
+    return scan_segment(path, after_seq)[0]
+
+
+def truncate_torn_tail(path):
+    """Cut a partially written last line left behind by a crash"""
+    with open(path, "rb+") as fh:
+        data = fh.read()
+        if data and not data.endswith(b"\n"):
+            fh.truncate(data.rfind(b"\n") + 1)
+
+
+def write_json_atomic(path, data):
+    """Replace a file with JSON (`data` may already be the serialized text)"""
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        if isinstance(data, str):
+            fh.write(data)
+        else:
+            json.dump(data, fh, ensure_ascii=False, separators=(",", ":"))
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+class EventStore:
+    """Append-only event log of one team plus its folded state"""
+
+    def __init__(self, root, snapshot_every=SNAPSHOT_EVERY, group_commit=True, shared=SHARED_STATE):
+        self.root = Path(root)
+        self.events_dir = self.root / "events"
+        self.snapshot_path = self.root / "snapshot.json"
+        self.snapshot_every = snapshot_every
+        self.shared = shared
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)  # notified after every event
+        self.events_dir.mkdir(parents=True, exist_ok=True)
+        self.exclusive = SharedLock(self.lock, self.root / "writer.lock" if shared else None)
+        self.skipped = 0  # unreadable lines passed over on recovery and while catching up
+        with self.exclusive:
+            self.state, self.replayed, self.load_ms = self._recover()
+            self.snapshot_seq = self.state.seq - self.replayed
+            # Only touched by the writer from here on, in shared state under the file lock
+            self._segment = self._open_segment()
+            self._read_offset = os.fstat(self._segment.fileno()).st_size
+            self._seen_snapshot = self._snapshot_id()
+        self.exclusive.on_acquire = self._catch_up
+        self.foreign = 0  # events appended by other worker processes
+        self._size = (-1, 0)  # (seq, bytes) of the last memory estimate
+        # Writer thread: the group being committed, how many of its records a
+        # snapshot already made durable, and the segment size to cut back to
+        self._retry, self._done, self._mark = None, 0, 0
+        writer = GroupCommitWriter if group_commit else ImmediateWriter
+        self.writer = writer(self._commit, name=f"events-{self.root.name}")
+
+    # ---- recovery ----
+    def segments(self):
+        """Segment files sorted by their first sequence number"""
+        return sorted(self.events_dir.glob("events-*.jsonl"))
+
+    def _recover(self):
+        start = time.perf_counter()
+        state = TriageState()
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path, encoding="utf-8") as fh:
+                state = TriageState.from_dict(json.load(fh))
+        replayed = 0
+        for path in self._segments_after(state.seq):
+            events, skipped = scan_segment(path, state.seq)
+            self.skipped += skipped
+            for event in events:
+                state.apply(event)
+                replayed += 1
+        return state, replayed, (time.perf_counter() - start) * 1000
+
+    def _segments_after(self, seq):
+        """Segments that may hold events with a sequence number above seq"""
+        segments = self.segments()
+        firsts = [int(p.stem.split("-")[1]) for p in segments]
+        return [path for i, path in enumerate(segments)
+                if i + 1 == len(segments) or firsts[i + 1] > seq + 1]
+
+    def _open_segment(self):
+        segments = self.segments()
+        if segments and int(segments[-1].stem.split("-")[1]) > self.snapshot_seq:
+            path = segments[-1]
+            truncate_torn_tail(path)
+        else:
+            path = self.events_dir / f"events-{self.state.seq + 1:012d}.jsonl"
+        return open(path, "a", encoding="utf-8")
+
+    def _snapshot_id(self):
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    # ---- shared state ----
+    def _catch_up(self):
+        """Fold the events other workers appended since this process last looked"""
+        current = Path(self._segment.name)
+        snapshot_id = self._snapshot_id()
+        if (os.fstat(self._segment.fileno()).st_size == self._read_offset
+                and snapshot_id == self._seen_snapshot):
+            return 0
+        # A new snapshot id means its segment exists already (_rotate creates it first)
+        self._seen_snapshot = snapshot_id
+        folded = 0
+        for path in self.segments():
+            if path < current:
+                continue
+            if path != current:  # another worker took a snapshot and started a segment
+                self._segment.close()
+                self._segment = open(path, "a", encoding="utf-8")
+                current, self._read_offset = path, 0
+                self.snapshot_seq = int(path.stem.split("-")[1]) - 1
+            with open(path, "rb") as fh:
+                fh.seek(self._read_offset)
+                for line in fh:
+                    if not line.endswith(b"\n"):
+                        break  # still being written
+                    self._read_offset += len(line)
+                    try:
+                        event = json.loads(line)
+                        seq = event["seq"]
+                    except (ValueError, TypeError, KeyError):
+                        self.skipped += 1  # a damaged line must not stop the other workers' events
+                        continue
+                    if seq > self.state.seq:
+                        self.state.apply(event)
+                        folded += 1
+        if folded:
+            self.foreign += folded
+            self.changed.notify_all()
+        return folded
+
+    def refresh(self):
+        """Shared state: catch up with the other workers, one fstat() if nobody wrote"""
+        if not self.shared:
+            return 0
+        with self.lock:
+            return self._catch_up()
+
+    # ---- writing ----
+    def _rotate(self, seq, text):
+        """Make the current segment durable, start the next one, then replace the snapshot"""
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+        segment = open(self.events_dir / f"events-{seq + 1:012d}.jsonl", "a", encoding="utf-8")
+        write_json_atomic(self.snapshot_path, text)
+        self._segment.close()
+        self._segment = segment
+
+    def _commit(self, records):
+        """Writer thread: write a group of records in order, one fsync per segment"""
+        if self.shared:
+            # The lines were written under the file lock already, only the fsync is left
+            with self.lock:
+                fd = os.dup(self._segment.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            return
+        if self._retry is records:
+            self._rollback()  # the writer retries the group that failed last time
+        else:
+            self._retry, self._done = records, 0
+            self._mark = os.fstat(self._segment.fileno()).st_size
+        for index in range(self._done, len(records)):
+            kind, seq, text = records[index]
+            if kind == "event":
+                self._segment.write(text)
+            else:
+                self._rotate(seq, text)
+                # Everything up to here is durable and covered by the new snapshot
+                self._done, self._mark = index + 1, 0
+        self._segment.flush()
+        os.fsync(self._segment.fileno())
+        self._retry = None
+
+    def _rollback(self):
+        """Cut what a failed commit wrote after the mark, so its retry does not duplicate lines"""
+        path = self._segment.name
+        try:
+            self._segment.close()  # writes or drops what is still buffered, before the cut
+        except OSError:
+            pass
+        os.truncate(path, self._mark)
+        self._segment = open(path, "a", encoding="utf-8")
+
+    def append(self, event):
+        """Fold an event into the state, queue it for disk and return it"""
+        if event["type"] not in EVENT_TYPES:
+            raise ValueError(f"unknown event type {event['type']!r}")
+        with self.exclusive:
+            event = dict(event, seq=self.state.seq + 1,
+                         ts=datetime.datetime.now().isoformat(timespec="seconds"))
+            line = json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n"
+            self.state.apply(event)
+            if self.shared:
+                self._segment.write(line)
+                self._segment.flush()  # visible to the other workers from here on
+                self._read_offset = os.fstat(self._segment.fileno()).st_size
+                self.writer.submit(("sync", event["seq"], None))
+            else:
+                self.writer.submit(("event", event["seq"], line))
+            if self.state.seq - self.snapshot_seq >= self.snapshot_every:
+                self.snapshot()
+            self.changed.notify_all()
+            return event
+
+    def execute(self, token, event):
+        """Append an event for a command token at most once.
+
+        Returns (status, seq) with status "applied", "duplicate" (token was
+        already executed, seq of its event) or "stale" (rendered from an
+        older queue version; nothing is appended).
+        """
+        with self.exclusive:
+            seq = self.state.commands.get(token)
+            if seq is not None:
+                return "duplicate", seq
+            if int(token.split(":", 1)[0]) != self.state.queue_version:
+                return "stale", None
+            return "applied", self.append(dict(event, command=token))["seq"]
+
+    def snapshot(self):
+        """Queue the folded state as snapshot; the writer then starts a new segment"""
+        with self.exclusive:
+            # Serialized now, the state keeps changing while the record is queued
+            text = json.dumps(self.state.to_dict(), ensure_ascii=False, separators=(",", ":"))
+            if self.shared:
+                self._rotate(self.state.seq, text)
+                self._read_offset = 0
+                self._seen_snapshot = self._snapshot_id()
+            else:
+                self.writer.submit(("snapshot", self.state.seq, text))
+            self.snapshot_seq = self.state.seq
+
+    def flush(self, timeout=None):
+        """Wait until every event appended so far is on disk"""
+        return self.writer.flush(timeout)
+
+    def close(self):
+        self.writer.close()
+
+    def memory_bytes(self):
+        """Size of the folded state, re-measured only after new events"""
+        with self.lock:
+            if self._size[0] != self.state.seq:
+                self._size = (self.state.seq, deep_sizeof(vars(self.state)))
+            return self._size[1]
+
+    def sync_roster(self, members):
+        """Record a roster change if the member list differs from the state"""
+        self.refresh()
+        if list(members) == self.state.members:
+            return  # the common case takes no file lock
+        with self.exclusive:
+            if list(members) != self.state.members:
+                self.append({"type": "roster", "members": list(members)})
+
+    def open_day(self, inputs, day=None):
+        """Settle the ledger and seed the queue, once per day (first caller wins)"""
+        day = day or datetime.date.today().isoformat()
+        self.refresh()
+        if self.state.ledger_day == day:
+            return
+        with self.exclusive:
+            if self.state.ledger_day != day:
+                self.append(day_event(self.state, inputs, day))
+
+    # ---- reading ----
+    def wait_for_change(self, seq, timeout=None):
+        """Block until the state moved past `seq`; False on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.changed:
+            while True:
+                self.refresh()  # other workers do not notify this process
+                if self.state.seq != seq:
+                    return True
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                if self.shared:
+                    remaining = min(remaining or SHARED_POLL_SECONDS, SHARED_POLL_SECONDS)
+                self.changed.wait(remaining)
+
+    def iter_events(self):
+        """All events of the hot segments (older ones are in archive/, see triage.archive)"""
+        self.flush()
+        for path in self.segments():
+            try:
+                events = read_segment(path)
+            except FileNotFoundError:
+                continue  # archived meanwhile (triage.archive), it is in the daily summaries
+            yield from events
+
+    def full_log(self):
+        """Complete assignment log, read from disk"""
+        replay = TriageState()
+        replay.recent = deque()
+        for event in self.iter_events():
+            if event["type"] in ("go", "batch"):
+                replay.apply(event)
+        return list(replay.recent)
+
+    def stats(self):
+        return {
+            "seq": self.state.seq,
+            "snapshot_seq": self.snapshot_seq,
+            "replayed_on_load": self.replayed,
+            "load_ms": round(self.load_ms, 2),
+            "segments": len(self.segments()),
+            "shared": self.shared,
+            "foreign_events": self.foreign,
+            "skipped_lines": self.skipped,
+            "lock_waits": self.exclusive.waits,
+            "writer": self.writer.stats(),
+        }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(team):
+    """Process-wide EventStore of a team (one writer per log file)"""
+    with _stores_lock:
+        store = _stores.get(team)
+        if store is None:
+            store = _stores[team] = EventStore(TENANTS_STATE_DIR / team)
+            atexit.register(store.close)  # flush queued events on shutdown
+        return store
+
+
+def team_memory_bytes(team):
+    """Memory of the team's open EventStore (0 if none is open)"""
+    with _stores_lock:
+        store = _stores.get(team)
+    return store.memory_bytes() if store else 0
+
+
+def release_team(team):
+    """Flush and drop the team's EventStore; the next open_store() reloads it"""
+    with _stores_lock:
+        store = _stores.pop(team, None)
+    if store is not None:
+        atexit.unregister(store.close)
+        store.close()
+
+
+def _stress(rounds=200, burst=8, threads=4):
+    """Fire bursts of identical GO commands from several threads"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = EventStore(tmp)
+        store.sync_roster([f"M{i:02d}" for i in range(7)])
+        statuses = []
+        start = time.perf_counter()
+        for _ in range(rounds):
+            # Every thread taps the button rendered from the same queue version
+            head = store.state.queue[0]
+            token = store.state.command_token("go", head)
+            event = {"type": "go", "ma": head, "period": "AM"}
+            workers = [threading.Thread(target=lambda: statuses.extend(
+                store.execute(token, event)[0] for _ in range(burst))) for _ in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        elapsed = time.perf_counter() - start
+        applied = statuses.count("applied")
+        if applied != rounds or store.state.assignments != rounds:
+            raise AssertionError(f"{applied} commands applied for {rounds} tokens")
+        # Retries are answered from the token cache without touching the disk
+        token = store.state.command_token("go", store.state.queue[0])
+        store.execute(token, {"type": "go", "ma": store.state.queue[0], "period": "AM"})
+        start = time.perf_counter()
+        for _ in range(10000):
+            store.execute(token, {"type": "go", "ma": "-", "period": "AM"})
+        retry_us = (time.perf_counter() - start) * 100
+        # The same button in two sessions: the second one is stale, not a duplicate
+        head = store.state.queue[0]
+        first, second = (store.state.command_token("go", f"{head}:{session}") for session in "ab")
+        outcomes = [store.execute(token, {"type": "go", "ma": head, "period": "AM"})[0]
+                    for token in (first, second, first)]
+        if outcomes != ["applied", "stale", "duplicate"]:
+            raise AssertionError(f"two sessions on one screen: {outcomes}")
+        # A GO rendered before its MA was marked absent must not go through
+        head = store.state.queue[0]
+        token = store.state.command_token("go", head)
+        store.append({"type": "attendance", "ma": head, "period": "AM", "present": False})
+        if store.execute(token, {"type": "go", "ma": head, "period": "AM"})[0] != "stale":
+            raise AssertionError("GO token survived an attendance change")
+        store.close()
+        # A damaged line in the middle of a segment: the events after it survive a
+        # restart and the next append continues after the highest sequence number
+        segment = store.segments()[-1]
+        lines = segment.read_bytes().splitlines(keepends=True)
+        lines[len(lines) // 2] = b'{"type": "go", "seq": \n'
+        segment.write_bytes(b"".join(lines))
+        store = EventStore(tmp)
+        before = store.state.seq
+        store.append({"type": "go", "ma": store.state.queue[0], "period": "AM"})
+        store.close()
+        seqs = [event["seq"] for path in store.segments() for event in read_segment(path)]
+        if store.skipped != 1 or before != seqs[-2] or seqs != sorted(set(seqs)):
+            raise AssertionError(f"damaged line lost or reused sequence numbers: {seqs[-5:]}")
+        return len(statuses), applied, elapsed, retry_us
+
+
+def _click_worker(root, clicks, results):
+    """One worker process: every click is a GO for the head of the shared queue"""
+    store = EventStore(root, shared=True)
+    statuses = []
+    for _ in range(clicks):
+        store.refresh()
+        head = store.state.queue[0]
+        statuses.append(store.execute(store.state.command_token("go", head),
+                                      {"type": "go", "ma": head, "period": "AM"})[0])
+    store.close()
+    results.put((statuses, store.foreign, store.exclusive.waits))
+
+
+def _stress_processes(processes=4, clicks=500):
+    """Worker processes clicking GO on the same log; all must agree on every step"""
+    with tempfile.TemporaryDirectory() as tmp:
+        setup = EventStore(tmp, shared=True, snapshot_every=SNAPSHOT_EVERY)
+        setup.sync_roster([f"M{i:02d}" for i in range(7)])
+        setup.close()
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_click_worker, args=(tmp, clicks, results))
+                   for _ in range(processes)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        check = EventStore(tmp, shared=True)
+        events = list(check.iter_events())
+        check.close()
+        seqs = [event["seq"] for event in events]
+        commands = [event["command"] for event in events if "command" in event]
+        applied = sum(statuses.count("applied") for statuses, _, _ in outcomes)
+        if seqs != list(range(1, len(seqs) + 1)) or len(commands) != len(set(commands)):
+            raise AssertionError("shared log has gaps or a command executed twice")
+        if applied != len(commands) or check.state.assignments != applied:
+            raise AssertionError(f"{applied} applied commands, {len(commands)} in the log")
+        # Replaying the log from scratch gives the state every worker folded
+        replay = TriageState()
+        for event in events:
+            replay.apply(event)
+        if replay.queue != check.state.queue:
+            raise AssertionError("snapshot and log disagree on the queue")
+        foreign = sum(f for _, f, _ in outcomes)
+        waits = sum(w for _, _, w in outcomes)
+        return processes * clicks, applied, elapsed, foreign, waits
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="burst-click stress test")
+    parser.add_argument("--processes", type=int, default=4, help="worker processes sharing one log")
+    parser.add_argument("--clicks", type=int, default=500, help="clicks per worker process")
+    args = parser.parse_args()
+    clicks, applied, elapsed, retry_us = _stress()
+    print(f"{clicks} clicks -> {applied} assignments in {elapsed:.2f} s, "
+          f"duplicate retry {retry_us:.2f} us")
+    clicks, applied, elapsed, foreign, waits = _stress_processes(args.processes, args.clicks)
+    print(f"{args.processes} processes: {clicks} clicks -> {applied} assignments in {elapsed:.2f} s, "
+          f"{foreign} events caught up from other workers, {waits} lock waits")
+    sys.exit(0)
@@ -0,0 +1,135 @@
+"""
+Cross-day fairness ledger for the rotation.
+
+Every employee has a running credit: consults they were owed minus
+consults they received. When the first run of a new day closes the
+previous day, the consults of that day are split into expected shares by
+capacity, i.e. employment percentage times the half-days (AM/PM) the
+person was present, and each share minus what the person actually got is
+added to their credit. Nobody accrues credit for a day they were absent.
+
+The day's queue is then seeded by credit (most owed first, the previous
+queue order breaking ties), a single sort, O(n log n). The opening balance
+of someone new to the ledger is the `score` column of employees.csv.
+Within the day the rotation stays round robin; on a day where everybody
+gets the same number of consults the ordering cannot even things out, the
+credit then just carries over to the next quieter day.
+
+The ledger is folded from "ledger" events like the rest of the triage
+state and stored in snapshot.json, so loading it costs nothing extra.
+
+Simulation of 60 days plus seeding benchmark:
+    python -m triage.fairness
+"""
+
+import random
+import sys
+import time
+
+CREDIT_DIGITS = 3  # keeps snapshot.json compact
+PERIODS = ("AM", "PM")
+
+
+def ledger_inputs(roster):
+    """{MA: (employment %, available by default, opening score)} from the roster"""
+    inputs = {}
+    for row in roster:
+        percent = getattr(row, "anstellungs_prozent", None)
+        score = getattr(row, "score", None)
+        inputs[row.MA] = (
+            percent if isinstance(percent, (int, float)) else 100,
+            bool(getattr(row, "verfuegbar", True)),
+            score if isinstance(score, (int, float)) else 0,
+        )
+    return inputs
+
+
+def capacities(state, inputs, day):
+    """Share weight per MA on `day`: employment fraction times half-days present"""
+    return {ma: percent / 100 * sum(state.present(ma, period, default, day) for period in PERIODS) / 2
+            for ma, (percent, default, _) in inputs.items()}
+
+
+def settle(credits, counts, capacity):
+    """New credits after a day with `counts` consults per MA"""
+    credits = dict(credits)
+    total = sum(counts.values())
+    weight = sum(capacity.values())
+    for ma, cap in capacity.items():
+        expected = total * cap / weight if weight else 0
+        credits[ma] = round(credits.get(ma, 0) + expected - counts.get(ma, 0), CREDIT_DIGITS)
+    return credits
+
+
+def seed_queue(queue, credits):
+    """Queue ordered by credit, most owed first; ties keep their queue order"""
+    position = {ma: i for i, ma in enumerate(queue)}
+    return sorted(queue, key=lambda ma: (-credits.get(ma, 0), position[ma]))
+
+
+def day_event(state, inputs, day):
+    """The "ledger" event that closes the state's ledger day and opens `day`"""
+    credits = {ma: state.credits.get(ma, inputs[ma][2]) for ma in inputs}
+    if state.ledger_day is not None:
+        credits = settle(credits, state.day_counts, capacities(state, inputs, state.ledger_day))
+    members = [ma for ma in state.queue if ma in credits]
+    return {"type": "ledger", "day": day, "settled": state.ledger_day,
+            "credits": credits, "queue": seed_queue(members, credits)}
+
+
+def _simulate(days=60, consults_per_day=4, seed=1):
+    """Round robin within the day, ledger between days; returns share vs. capacity"""
+    from triage.events import TriageState
+
+    rng = random.Random(seed)
+    percents = {"BA": 80, "AN": 100, "JU": 60, "VE": 90, "CA": 100, "SA": 80}
+    inputs = {ma: (percent, True, 0) for ma, percent in percents.items()}
+    state = TriageState()
+    seq = 0
+
+    def apply(event):
+        nonlocal seq
+        seq += 1
+        state.apply(dict(event, seq=seq, ts=f"{event.get('day') or current}T08:00:00"))
+
+    current = "2026-01-01"
+    apply({"type": "roster", "members": list(percents)})
+    received = dict.fromkeys(percents, 0)
+    capacity_total = dict.fromkeys(percents, 0.0)
+    for d in range(days):
+        current = f"2026-{1 + d // 28:02d}-{1 + d % 28:02d}"
+        apply(day_event(state, inputs, current))
+        for ma in percents:
+            for period in PERIODS:
+                if rng.random() < 0.1:  # holidays, sick leave, courses
+                    apply({"type": "attendance", "ma": ma, "period": period, "present": False})
+        for period in PERIODS:
+            present = {ma for ma in percents if state.present(ma, period, True, current)}
+            for _ in range(consults_per_day // len(PERIODS) if present else 0):
+                head = next(ma for ma in state.queue if ma in present)
+                apply({"type": "go", "ma": head, "period": period})
+                received[head] += 1
+        for ma, cap in capacities(state, inputs, current).items():
+            capacity_total[ma] += cap
+    total = sum(received.values())
+    weight = sum(capacity_total.values())
+    return {ma: (received[ma], total * capacity_total[ma] / weight, state.credits.get(ma, 0))
+            for ma in percents}
+
+
+def _benchmark(n=10000, runs=20):
+    rng = random.Random(0)
+    queue = [f"M{i:05d}" for i in range(n)]
+    credits = {ma: round(rng.uniform(-5, 5), CREDIT_DIGITS) for ma in queue}
+    start = time.perf_counter()
+    for _ in range(runs):
+        seed_queue(queue, credits)
+    return (time.perf_counter() - start) / runs * 1000
+
+
+if __name__ == "__main__":
+    print("MA   received  fair share  credit")
+    for ma, (got, fair, credit) in _simulate().items():
+        print(f"{ma:<4} {got:8d}  {fair:10.1f}  {credit:6.2f}")
+    print(f"seed queue of 10000: {_benchmark():.2f} ms")
+    sys.exit(0)
@@ -0,0 +1,124 @@
+"""
+Build the self-hosted Orbitron subset used by the dashboard theme.
+
+Orbitron ships as a variable font with a weight axis of 400-900. The theme
+only uses weights 100-400, which all resolve to the lightest master, so a
+single static 400 instance covers every style we render.
+
+The subset (static/fonts/orbitron-subset.woff2, about 6 KB, OFL licence in
+static/fonts/OFL.txt) is committed and served by Streamlit's static
+handler under a content-hashed URL (?v=<sha256>), which tornado answers
+with a ten-year max-age, so a browser downloads it once per font version.
+The handler labels it text/plain; browsers load fonts regardless of the
+MIME type (nosniff only applies to scripts and stylesheets).
+
+Usage (needs fonttools and brotli, build time only):
+    python -m triage.fonts path/to/Orbitron[wght].ttf
+
+Offline check of what the theme's font needs (font size, references in the
+page CSS that would leave the host, characters without a glyph):
+    python -m triage.fonts --check
+"""
+
+import hashlib
+import re
+import sys
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent
+FONT_FILE = APP_DIR / "static" / "fonts" / "orbitron-subset.woff2"
+FONT_URL = "app/static/fonts/orbitron-subset.woff2"
+DASHBOARD = APP_DIR / "triage_dashboard.py"
+# Anything in the page CSS that would make the browser fetch from elsewhere
+EXTERNAL_REFERENCE = re.compile(r"@import|url\(\s*['\"]?(?:https?:)?//", re.IGNORECASE)
+
+# Basic Latin, Latin-1 (umlauts, ß, ·) and the typographic punctuation
+# used in the quiz texts (– — ‘ ’ ‚ “ ” „ • … € ≈ ≥)
+UNICODES = (
+    list(range(0x20, 0x7F))
+    + list(range(0xA0, 0x100))
+    + [0x2013, 0x2014, 0x2018, 0x2019, 0x201A, 0x201C, 0x201D, 0x201E,
+       0x2022, 0x2026, 0x20AC, 0x2248, 0x2265]
+)
+
+
+def font_version():
+    """Short content hash of the bundled font, or None if it is not built"""
+    if not FONT_FILE.exists():
+        return None
+    return hashlib.sha256(FONT_FILE.read_bytes()).hexdigest()[:12]
+
+
+def font_face_css():
+    """@font-face rule for the bundled subset (local fallback if missing)"""
+    version = font_version()
+    src = "local('Orbitron')"
+    if version:
+        # The ?v= query makes tornado serve the file with a long max-age
+        src += f", url('{FONT_URL}?v={version}') format('woff2')"
+    return (
+        "@font-face { font-family: 'Orbitron'; font-style: normal; "
+        f"font-weight: 100 400; font-display: swap; src: {src}; }}"
+    )
+
+
+def build_subset(source, target=FONT_FILE):
+    """Instance the variable font at wght=400 and subset it to WOFF2"""
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+    from fontTools.varLib import instancer
+
+    font = TTFont(source)
+    if "fvar" in font:
+        font = instancer.instantiateVariableFont(font, {"wght": 400})
+
+    options = subset.Options()
+    options.flavor = "woff2"
+    options.layout_features = ["kern", "liga"]
+    options.name_IDs = [0, 1, 2, 3, 4, 6]
+    options.notdef_outline = True
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=UNICODES)
+    subsetter.subset(font)
+
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    font.flavor = "woff2"
+    font.save(target)
+    return target
+
+
+def check():
+    """Font size, external references in the page CSS and glyph coverage (no network)"""
+    css = font_face_css()
+    page_css = DASHBOARD.read_text(encoding="utf-8") if DASHBOARD.exists() else ""
+    result = {
+        "font_bytes": FONT_FILE.stat().st_size if FONT_FILE.exists() else 0,
+        "version": font_version(),
+        "external_references": len(EXTERNAL_REFERENCE.findall(css + page_css)),
+        "missing": None,
+    }
+    try:
+        from fontTools.ttLib import TTFont
+    except ImportError:
+        return result  # glyph coverage needs fonttools
+    if result["font_bytes"]:
+        covered = TTFont(FONT_FILE).getBestCmap()
+        result["missing"] = "".join(chr(c) for c in UNICODES if c not in covered and chr(c).isprintable())
+    return result
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--check"]:
+        result = check()
+        if not result["font_bytes"]:
+            sys.exit(f"{FONT_FILE} is missing, the headline falls back to local('Orbitron')/monospace")
+        print(f"font {result['font_bytes']} bytes at {FONT_URL}?v={result['version']}, "
+              f"{result['external_references']} external references in the page CSS")
+        if result["missing"] is not None:
+            print(f"not in Orbitron (browser fallback): {result['missing'] or 'nothing'}")
+        sys.exit(1 if result["external_references"] else 0)
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    out = build_subset(sys.argv[1])
+    print(f"{out} ({out.stat().st_size} bytes, v={font_version()})")
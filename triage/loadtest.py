@@ -0,0 +1,330 @@
+"""
+Concurrent-user load test against a local Streamlit server.
+
+Starts `streamlit run triage_dashboard.py` on a free port with a throwaway
+state directory, then simulates N browser sessions over Streamlit's own
+websocket protocol (BackMsg/ForwardMsg protobufs on /_stcore/stream).
+Every session opens the page, then keeps performing GO, NO, attendance
+toggles and quiz answers with a random think time in between. Rerun
+latency is the time from sending the rerun until the server reports the
+script as finished.
+
+    python -m triage.loadtest --sessions 50 --duration 60
+    python -m triage.loadtest --sessions 200 --ramp 30 --csv load.csv
+
+Reports p50/p99 rerun latency per action and over time, together with the
+server's CPU and RSS (psutil if installed, /proc otherwise).
+
+With --workers the test runs once per worker count against that many
+shared-state processes (triage.workers), sessions spread round robin as a
+sticky reverse proxy would, and ends with reruns/s per worker count. After
+each run the shared event log is checked: sequence numbers without gaps
+and no command token executed twice.
+
+    python -m triage.loadtest --workers 1,2,4 --sessions 100 --no-think
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado.websocket import websocket_connect
+
+from triage.workers import free_port, start_server, start_workers, stop_workers
+
+ACTIONS = {"go": 0.25, "no": 0.15, "attendance": 0.3, "quiz": 0.3}
+THINK_SECONDS = (0.5, 3.0)
+RERUN_TIMEOUT = 60
+SAMPLE_SECONDS = 1.0
+EARLY_FOR_RERUN = ForwardMsg.ScriptFinishedStatus.Value("FINISHED_EARLY_FOR_RERUN")
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+class ProcessSampler:
+    """CPU (% of one core) and RSS of the server process"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        try:
+            import psutil
+            self._process = psutil.Process(pid)
+        except ImportError:
+            self._process = None
+        self._last = (time.monotonic(), self._cpu_seconds())
+
+    def _cpu_seconds(self):
+        if self._process is not None:
+            times = self._process.cpu_times()
+            return times.user + times.system
+        with open(f"/proc/{self.pid}/stat") as fh:
+            fields = fh.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def _rss_mb(self):
+        if self._process is not None:
+            return self._process.memory_info().rss / 2**20
+        with open(f"/proc/{self.pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return float("nan")
+
+    def sample(self):
+        now, cpu = time.monotonic(), self._cpu_seconds()
+        last_time, last_cpu = self._last
+        self._last = (now, cpu)
+        return 100 * (cpu - last_cpu) / max(now - last_time, 1e-6), self._rss_mb()
+
+
+class Session:
+    """One simulated browser tab"""
+
+    def __init__(self, url, query_string, rng):
+        self.url = url
+        self.query_string = query_string
+        self.rng = rng
+        self.widgets = {}   # user key -> widget id of the last run
+        self.values = {}    # widget id -> WidgetState we keep sending
+        self.cache = {}     # ForwardMsg hash -> message (for ref_hash replies)
+        self.conn = None
+
+    async def connect(self):
+        self.conn = await websocket_connect(self.url)
+
+    async def rerun(self, trigger=None):
+        """Send a rerun (optionally triggering a widget), return latency in s"""
+        msg = BackMsg()
+        msg.rerun_script.query_string = self.query_string
+        for widget_id, state in self.values.items():
+            if widget_id != getattr(trigger, "id", None):
+                msg.rerun_script.widget_states.widgets.append(state)
+        if trigger is not None:
+            msg.rerun_script.widget_states.widgets.append(trigger)
+        start = time.perf_counter()
+        await self.conn.write_message(msg.SerializeToString(), binary=True)
+        widgets = {}
+        while True:
+            payload = await asyncio.wait_for(self.conn.read_message(), RERUN_TIMEOUT)
+            if payload is None:
+                raise ConnectionError("server closed the websocket")
+            forward = ForwardMsg()
+            forward.ParseFromString(payload)
+            if forward.WhichOneof("type") == "ref_hash":
+                forward = self.cache[forward.ref_hash]
+            elif forward.metadata.cacheable:
+                self.cache[forward.hash] = forward
+            kind = forward.WhichOneof("type")
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                element = forward.delta.new_element
+                inner = getattr(element, element.WhichOneof("type") or "empty", None)
+                widget_id = getattr(inner, "id", "")
+                if widget_id.startswith("$$WIDGET_ID"):
+                    widgets[widget_id.split("-", 2)[2]] = widget_id
+            elif kind == "script_finished" and forward.script_finished != EARLY_FOR_RERUN:
+                self.widgets = widgets
+                return time.perf_counter() - start
+
+    def _trigger(self, key):
+        state = BackMsg().rerun_script.widget_states.widgets.add()
+        state.id = self.widgets[key]
+        state.trigger_value = True
+        return state
+
+    async def act(self, action):
+        """Perform one action; returns (action actually done, latency)"""
+        if action == "go" and "go" in self.widgets:
+            return action, await self.rerun(self._trigger("go"))
+        if action == "no" and "next" in self.widgets:
+            return action, await self.rerun(self._trigger("next"))
+        if action == "attendance":
+            keys = [k for k in self.widgets if k.endswith(("_AM", "_PM"))]
+            if keys:
+                widget_id = self.widgets[self.rng.choice(keys)]
+                state = self.values.get(widget_id)
+                if state is None:
+                    state = BackMsg().rerun_script.widget_states.widgets.add()
+                    state.id = widget_id
+                    state.bool_value = True
+                state.bool_value = not state.bool_value
+                self.values[widget_id] = state
+                return action, await self.rerun(state)
+        if action == "quiz":
+            keys = [k for k in self.widgets if k.startswith("q") and "_" in k]
+            if keys:
+                return action, await self.rerun(self._trigger(self.rng.choice(keys)))
+        return "reload", await self.rerun()
+
+
+class LoadTest:
+    def __init__(self, sessions, duration, ramp, team, seed, think=THINK_SECONDS):
+        self.sessions = sessions
+        self.duration = duration
+        self.ramp = ramp
+        self.team = team
+        self.think = think
+        self.rng = random.Random(seed)
+        self.samples = []   # (elapsed, action, latency)
+        self.errors = []
+        self.timeline = []  # (elapsed, connected, cpu %, rss MB)
+        self.connected = 0
+
+    async def run_session(self, url, delay, deadline):
+        await asyncio.sleep(delay)
+        session = Session(url, f"team={self.team}" if self.team else "",
+                          random.Random(self.rng.random()))
+        try:
+            await session.connect()
+            self.connected += 1
+            self.samples.append((time.monotonic() - self.start, "open", await session.rerun()))
+            while time.monotonic() < deadline:
+                await asyncio.sleep(session.rng.uniform(*self.think))
+                action = session.rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+                done, latency = await session.act(action)
+                self.samples.append((time.monotonic() - self.start, done, latency))
+        except Exception as exc:  # keep the other sessions running
+            self.errors.append(f"{type(exc).__name__}: {exc}")
+        finally:
+            if session.conn is not None:
+                session.conn.close()
+                self.connected -= 1
+
+    async def sample(self, samplers, deadline):
+        while time.monotonic() < deadline:
+            await asyncio.sleep(SAMPLE_SECONDS)
+            cpu, rss = (sum(values) for values in zip(*(sampler.sample() for sampler in samplers)))
+            self.timeline.append((time.monotonic() - self.start, self.connected, cpu, rss))
+
+    async def run(self, ports, pids):
+        """Sessions go round robin over the servers on `ports` (sticky, like ip_hash)"""
+        urls = [f"ws://127.0.0.1:{port}/_stcore/stream" for port in ports]
+        self.start = time.monotonic()
+        deadline = self.start + self.duration
+        tasks = [self.run_session(urls[i % len(urls)], self.ramp * i / max(self.sessions, 1), deadline)
+                 for i in range(self.sessions)]
+        await asyncio.gather(self.sample([ProcessSampler(pid) for pid in pids], deadline), *tasks)
+
+    def throughput(self):
+        """Reruns per second after the ramp-up"""
+        window = self.duration - self.ramp
+        reruns = sum(1 for t, _, _ in self.samples if t >= self.ramp)
+        return reruns / window if window > 0 else float("nan")
+
+    def report(self, csv_path=None):
+        latencies = [latency * 1000 for _, _, latency in self.samples]
+        lines = [f"{self.sessions} sessions, {len(latencies)} reruns, {len(self.errors)} errors, "
+                 f"{self.throughput():.1f} reruns/s after ramp-up",
+                 f"rerun latency p50 {percentile(latencies, 50):.0f} ms, "
+                 f"p99 {percentile(latencies, 99):.0f} ms"]
+        for action in sorted({a for _, a, _ in self.samples}):
+            values = [lat * 1000 for _, a, lat in self.samples if a == action]
+            lines.append(f"  {action:<10} n={len(values):<5} p50 {percentile(values, 50):6.0f} ms"
+                         f"  p99 {percentile(values, 99):6.0f} ms")
+        lines.append("   t/s  sessions  reruns   p50 ms   p99 ms   cpu %   rss MB")
+        rows = []
+        previous = 0.0
+        for elapsed, connected, cpu, rss in self.timeline:
+            window = [lat * 1000 for t, _, lat in self.samples if previous < t <= elapsed]
+            previous = elapsed
+            rows.append((elapsed, connected, len(window), percentile(window, 50),
+                         percentile(window, 99), cpu, rss))
+        step = max(1, len(rows) // 20)  # keep the console table short
+        for row in rows[::step]:
+            lines.append("{:6.0f}  {:8d}  {:6d}  {:7.0f}  {:7.0f}  {:6.0f}  {:7.0f}".format(*row))
+        for error in sorted(set(self.errors))[:5]:
+            lines.append(f"error: {error}")
+        if csv_path:
+            with open(csv_path, "w", encoding="utf-8") as fh:
+                fh.write("t_s,sessions,reruns,p50_ms,p99_ms,cpu_pct,rss_mb\n")
+                for row in rows:
+                    fh.write(",".join(f"{v:.1f}" if isinstance(v, float) else str(v) for v in row) + "\n")
+        return "\n".join(lines)
+
+
+def check_shared_log(state_dir):
+    """(events, gaps, commands executed twice) of every team's event log"""
+    from triage.events import TENANTS_STATE_DIR, read_segment
+
+    events = gaps = repeated = 0
+    tenants = Path(state_dir) / TENANTS_STATE_DIR.name
+    for team_dir in tenants.iterdir() if tenants.exists() else ():
+        seqs, commands = [], set()
+        for path in sorted((team_dir / "events").glob("events-*.jsonl")):
+            for event in read_segment(path):
+                seqs.append(event["seq"])
+                if "command" in event:
+                    repeated += event["command"] in commands
+                    commands.add(event["command"])
+        events += len(seqs)
+        gaps += sum(1 for a, b in zip(seqs, seqs[1:]) if b != a + 1)
+    return events, gaps, repeated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=50, help="concurrent sessions (10-200)")
+    parser.add_argument("--duration", type=float, default=60, help="test length in seconds")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds until all sessions are open")
+    parser.add_argument("--team", default="", help="?team= of the simulated sessions")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", help="write the per-second timeline to this file")
+    parser.add_argument("--state-dir", help="keep the server's TRIAGE_STATE_DIR here for inspection")
+    parser.add_argument("--workers", help="comma-separated worker counts, e.g. 1,2,4 (shared state)")
+    parser.add_argument("--no-think", action="store_true",
+                        help="no think time between actions (measures saturation throughput)")
+    args = parser.parse_args(argv)
+    think = (0, 0) if args.no_think else THINK_SECONDS
+
+    if not args.workers:
+        test = LoadTest(args.sessions, args.duration, args.ramp, args.team, args.seed, think)
+        with tempfile.TemporaryDirectory() as tmp:
+            state_dir = Path(args.state_dir).resolve() if args.state_dir else tmp
+            port = free_port()
+            server = start_server(port, {"TRIAGE_STATE_DIR": str(state_dir)})
+            try:
+                asyncio.run(test.run([port], [server.pid]))
+            finally:
+                stop_workers([server])
+        print(test.report(args.csv))
+        return 0 if test.samples and not test.errors else 1
+
+    scaling = []
+    failed = False
+    for workers in [int(n) for n in args.workers.split(",")]:
+        test = LoadTest(args.sessions, args.duration, args.ramp, args.team, args.seed, think)
+        with tempfile.TemporaryDirectory() as tmp:
+            ports = [free_port() for _ in range(workers)]
+            servers = start_workers(ports, {"TRIAGE_STATE_DIR": tmp})
+            try:
+                asyncio.run(test.run(ports, [server.pid for server in servers]))
+            finally:
+                stop_workers(servers)
+            events, gaps, repeated = check_shared_log(tmp)
+        print(f"== {workers} worker(s)\n{test.report()}\n"
+              f"shared log: {events} events, {gaps} gaps, {repeated} commands executed twice\n")
+        failed |= bool(not test.samples or test.errors or gaps or repeated)
+        latencies = [latency * 1000 for _, _, latency in test.samples]
+        scaling.append((workers, test.throughput(), percentile(latencies, 50), percentile(latencies, 99)))
+    base = scaling[0][1]
+    print("workers  reruns/s  speedup  p50 ms  p99 ms")
+    for workers, rate, p50, p99 in scaling:
+        print(f"{workers:7d}  {rate:8.1f}  {rate / base:6.2f}x  {p50:6.0f}  {p99:6.0f}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Constraint-aware consult-to-staff matching for batch assignment.
+
+Builds a cost matrix from consult attributes (ward, setting, language,
+urgency) and staff attributes (stationaer_anteil, anstellungs_prozent,
+current daily load) and solves it with a NumPy Hungarian algorithm.
+
+Staff can take several consults, so every person is expanded into slots
+whose cost grows with the load they would carry; filling a slot therefore
+gets more expensive the more consults someone already has relative to
+their employment percentage.
+
+Optional roster columns:
+    sprachen  - languages spoken, separated by ';' (e.g. "de;en;fr")
+    stationen - wards the person usually covers, separated by ';'
+
+Benchmark (50 consults x 100 staff):
+    python -m triage.matching
+"""
+
+import math
+import sys
+import time
+
+import numpy as np
+
+SETTING_WEIGHT = 1.0
+LOAD_WEIGHT = 1.0
+URGENT_LOAD_WEIGHT = 3.0
+WARD_BONUS = 0.5
+LANGUAGE_PENALTY = 10.0
+SETTING_ALIASES = {
+    "stationaer": "stationaer", "stationär": "stationaer", "stat": "stationaer",
+    "ambulant": "ambulant", "amb": "ambulant",
+}
+URGENT_WORDS = {"dringend", "urgent", "notfall"}
+LANGUAGES = {"de", "en", "fr", "it", "es", "pt", "tr", "sq", "sr", "hr", "ar", "fa", "ru", "uk"}
+
+
+def parse_consults(text):
+    """One consult per line: comma separated setting, ward, language, urgency.
+
+    Example line: "stationär, E3, fr, dringend". Every token is optional;
+    unknown tokens are taken as the ward.
+    """
+    consults = []
+    for line in text.splitlines():
+        tokens = [t.strip() for t in line.split(",") if t.strip()]
+        if not tokens:
+            continue
+        consult = {"setting": None, "ward": None, "language": None, "urgent": False}
+        for token in tokens:
+            lower = token.lower()
+            if lower in SETTING_ALIASES:
+                consult["setting"] = SETTING_ALIASES[lower]
+            elif lower in URGENT_WORDS:
+                consult["urgent"] = True
+            elif lower in LANGUAGES:
+                consult["language"] = lower
+            else:
+                consult["ward"] = token
+        consults.append(consult)
+    return consults
+
+
+def _split(value):
+    if not value or not isinstance(value, str):
+        return frozenset()
+    return frozenset(v.strip().lower() for v in value.split(";") if v.strip())
+
+
+def staff_table(roster, staff, daily_load):
+    """Column-wise staff attributes as NumPy arrays"""
+    records = [roster.get(ma) for ma in staff]
+    return {
+        "stationaer": np.array([float(getattr(r, "stationaer_anteil", 50) or 0) / 100 for r in records]),
+        "capacity": np.array([max(float(getattr(r, "anstellungs_prozent", 100) or 0), 10.0) / 100 for r in records]),
+        "load": np.array([float(daily_load.get(ma, 0)) for ma in staff]),
+        "languages": [_split(getattr(r, "sprachen", None)) for r in records],
+        "wards": [_split(getattr(r, "stationen", None)) for r in records],
+    }
+
+
+def cost_matrix(consults, table, slots):
+    """Cost of giving consult i to slot k of staff j, shape (n, m * slots)"""
+    n, m = len(consults), len(table["load"])
+    setting = np.array([{"stationaer": 1.0, "ambulant": -1.0}.get(c["setting"], 0.0) for c in consults])
+    urgent = np.array([c["urgent"] for c in consults])
+
+    # Setting fit: inpatient consults prefer high stationaer_anteil and vice versa
+    fit = np.where(setting[:, None] > 0, 1.0 - table["stationaer"][None, :],
+                   np.where(setting[:, None] < 0, table["stationaer"][None, :], 0.0))
+    base = SETTING_WEIGHT * fit
+
+    # Ward and language preferences (sparse, only where attributes are given)
+    for i, consult in enumerate(consults):
+        if consult["ward"]:
+            ward = consult["ward"].lower()
+            base[i] -= WARD_BONUS * np.array([ward in w for w in table["wards"]])
+        if consult["language"] and consult["language"] != "de":
+            spoken = np.array([consult["language"] in langs for langs in table["languages"]])
+            if spoken.any():
+                base[i] += LANGUAGE_PENALTY * ~spoken
+
+    # Slot k of staff j: relative load after taking k more consults
+    k = np.arange(slots)
+    relative_load = (table["load"][:, None] + k[None, :]) / table["capacity"][:, None]
+    load_weight = np.where(urgent, URGENT_LOAD_WEIGHT, LOAD_WEIGHT)
+    cost = base[:, :, None] + load_weight[:, None, None] * relative_load[None, :, :]
+    return cost.reshape(n, m * slots)
+
+
+def hungarian(cost):
+    """Minimum cost assignment of every row to a distinct column (rows <= cols).
+
+    Shortest augmenting path variant with row/column potentials; the inner
+    scans over columns are vectorized. Returns the column index per row.
+    """
+    n, m = cost.shape
+    if n > m:
+        raise ValueError("more rows than columns")
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=np.int64)  # row (1-based) holding column j, 0 = free
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        owner[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = owner[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[owner[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if owner[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            owner[j0] = owner[j1]
+            j0 = j1
+    assignment = np.empty(n, dtype=np.int64)
+    cols = np.nonzero(owner[1:])[0]
+    assignment[owner[1:][cols] - 1] = cols
+    return assignment
+
+
+def match_consults(consults, roster, staff, daily_load):
+    """Assign each consult to one of `staff`, returns list of (consult, MA)"""
+    if not consults or not staff:
+        return []
+    slots = math.ceil(len(consults) / len(staff)) + 1
+    table = staff_table(roster, staff, daily_load)
+    cols = hungarian(cost_matrix(consults, table, slots))
+    return [(consult, staff[col // slots]) for consult, col in zip(consults, cols)]
+
+
+def _benchmark(n_consults=50, n_staff=100, runs=5):
+    from triage.core import Roster
+
+    rng = np.random.default_rng(0)
+    roster = Roster([{
+        "MA": f"S{j:03d}",
+        "stationaer_anteil": int(rng.integers(0, 101)),
+        "anstellungs_prozent": int(rng.choice([40, 60, 80, 100])),
+        "sprachen": "de;en" if j % 3 else "de;fr",
+    } for j in range(n_staff)])
+    staff = roster.ma_codes()
+    consults = [{
+        "setting": rng.choice(["stationaer", "ambulant", None]),
+        "ward": None,
+        "language": "fr" if i % 7 == 0 else None,
+        "urgent": bool(i % 5 == 0),
+    } for i in range(n_consults)]
+    load = {ma: int(rng.integers(0, 4)) for ma in staff}
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        match_consults(consults, roster, staff, load)
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    best = _benchmark()
+    print(f"match 50 consults x 100 staff: {best:.1f} ms")
+    sys.exit(0)
@@ -0,0 +1,370 @@
+"""
+Background notification dispatcher for GO assignments and workflow steps.
+
+`notify()` only puts a message on a bounded in-memory queue and returns;
+a worker thread takes messages off the queue in batches (up to BATCH_SIZE,
+or whatever arrived within BATCH_WAIT seconds) and delivers each batch to
+every configured sink. Only the sinks that failed are retried, with
+exponential backoff, and results are counted per sink, so a webhook that is
+down does not resend the mail or hide that the mail went out. A rerun
+therefore never waits for the network.
+
+Sinks are configured through environment variables:
+    TRIAGE_NOTIFY_WEBHOOK   URL that receives {"messages": [...]} as JSON POST
+    TRIAGE_NOTIFY_SMTP      host:port of an SMTP server (one digest mail per batch)
+    TRIAGE_NOTIFY_FROM      sender address (default triage@localhost)
+    TRIAGE_NOTIFY_TO        comma separated recipients
+    TRIAGE_NOTIFY_SMTP_USER / TRIAGE_NOTIFY_SMTP_PASSWORD   optional login (STARTTLS)
+Without a sink, messages are counted and discarded.
+
+Self-test against local stand-in servers (a webhook that fails its first
+requests, and a minimal SMTP server):
+    python -m triage.notify
+"""
+
+import atexit
+import datetime
+import json
+import os
+import queue
+import smtplib
+import socketserver
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from collections import deque
+from email.message import EmailMessage
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_QUEUE = int(os.environ.get("TRIAGE_NOTIFY_QUEUE", "1000"))
+BATCH_SIZE = 20
+BATCH_WAIT = 0.2
+RETRIES = 5
+BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 30
+TIMEOUT_SECONDS = 5
+LATENCY_WINDOW = 200
+
+
+class WebhookSink:
+    """POSTs each batch as JSON to a URL"""
+
+    def __init__(self, url, timeout=TIMEOUT_SECONDS):
+        self.url = url
+        self.timeout = timeout
+        self.name = f"webhook {url}"
+
+    def send(self, messages):
+        body = json.dumps({"messages": messages}, ensure_ascii=False).encode()
+        request = urllib.request.Request(self.url, data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise OSError(f"webhook answered {response.status}")
+
+
+class SmtpSink:
+    """Sends one digest mail per batch"""
+
+    def __init__(self, host, port, sender, recipients, user=None, password=None,
+                 timeout=TIMEOUT_SECONDS):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.name = f"smtp {host}:{port}"
+
+    def send(self, messages):
+        mail = EmailMessage()
+        mail["From"] = self.sender
+        mail["To"] = ", ".join(self.recipients)
+        mail["Subject"] = (messages[0]["subject"] if len(messages) == 1
+                           else f"☂️ Triage: {len(messages)} Mitteilige")
+        mail.set_content("\n".join(f"[{m['time']}] {m['team']}: {m['text']}" for m in messages))
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.user:
+                smtp.starttls()
+                smtp.login(self.user, self.password or "")
+            smtp.send_message(mail)
+
+
+def sinks_from_env(env=os.environ):
+    sinks = []
+    if env.get("TRIAGE_NOTIFY_WEBHOOK"):
+        sinks.append(WebhookSink(env["TRIAGE_NOTIFY_WEBHOOK"]))
+    if env.get("TRIAGE_NOTIFY_SMTP") and env.get("TRIAGE_NOTIFY_TO"):
+        host, _, port = env["TRIAGE_NOTIFY_SMTP"].partition(":")
+        sinks.append(SmtpSink(host, int(port or 25), env.get("TRIAGE_NOTIFY_FROM", "triage@localhost"),
+                              [r.strip() for r in env["TRIAGE_NOTIFY_TO"].split(",") if r.strip()],
+                              env.get("TRIAGE_NOTIFY_SMTP_USER"), env.get("TRIAGE_NOTIFY_SMTP_PASSWORD")))
+    return sinks
+
+
+class Dispatcher:
+    """Bounded queue plus one worker thread delivering batches to all sinks"""
+
+    def __init__(self, sinks, max_queue=MAX_QUEUE, batch_size=BATCH_SIZE, batch_wait=BATCH_WAIT,
+                 retries=RETRIES, backoff=BACKOFF_SECONDS):
+        self.sinks = list(sinks)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.pending = 0  # queued or being delivered
+        self.sent = 0  # messages every sink delivered
+        self.partial = 0  # messages only some sinks delivered
+        self.failed = 0  # messages no sink delivered
+        self.per_sink = {sink.name: {"sent": 0, "failed": 0, "retries": 0} for sink in self.sinks}
+        self.dropped = 0
+        self.retried = 0
+        self.batches = 0
+        self.last_error = None
+        self._stopping = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="notify-dispatcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, kind, team, text, subject=None):
+        """Queue a message without blocking; returns False if it was dropped"""
+        message = {
+            "kind": kind,
+            "team": team,
+            "text": text,
+            "subject": subject or f"☂️ {text}",
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "_queued": time.monotonic(),
+        }
+        with self._lock:
+            self.pending += 1
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.pending -= 1
+                self.dropped += 1
+            return False
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return [m for m in batch if m is not None]
+
+    def _deliver(self, messages):
+        """Send to every sink, retrying only the failed ones; returns the sinks that gave up"""
+        remaining = list(self.sinks)
+        for attempt in range(self.retries + 1):
+            failed = []
+            for sink in remaining:
+                try:
+                    sink.send(messages)
+                except Exception as e:
+                    failed.append(sink)
+                    with self._lock:
+                        self.last_error = f"{sink.name}: {e}"
+                    continue
+                with self._lock:
+                    self.per_sink[sink.name]["sent"] += len(messages)
+            remaining = failed
+            if not remaining or attempt == self.retries or self._stopping.is_set():
+                break
+            with self._lock:
+                self.retried += len(remaining)
+                for sink in remaining:
+                    self.per_sink[sink.name]["retries"] += 1
+            time.sleep(min(self.backoff * 2 ** attempt, MAX_BACKOFF_SECONDS))
+        with self._lock:
+            for sink in remaining:
+                self.per_sink[sink.name]["failed"] += len(messages)
+        return remaining
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()  # None (the shutdown sentinel) is filtered out
+            if not batch:
+                continue
+            with self._lock:
+                self.in_flight = len(batch)
+            payload = [{k: v for k, v in m.items() if not k.startswith("_")} for m in batch]
+            gave_up = self._deliver(payload)
+            now = time.monotonic()
+            with self._lock:
+                self.in_flight = 0
+                self.pending -= len(batch)
+                self.batches += 1
+                if not gave_up:
+                    self.sent += len(batch)
+                    self._latencies.extend((now - m["_queued"]) * 1000 for m in batch)
+                elif len(gave_up) < len(self.sinks):
+                    self.partial += len(batch)
+                else:
+                    self.failed += len(batch)
+
+    def flush(self, timeout=10):
+        """Wait until the queue is drained (used by tests and at shutdown)"""
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self.pending
+
+    def close(self, timeout=10):
+        self._stopping.set()
+        self._queue.put(None)
+        self._worker.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                "sinks": [sink.name for sink in self.sinks],
+                "pending": self.pending,
+                "queue_depth": self._queue.qsize(),
+                "in_flight": self.in_flight,
+                "sent": self.sent,
+                "partial": self.partial,
+                "failed": self.failed,
+                "per_sink": {name: dict(counts) for name, counts in self.per_sink.items()},
+                "dropped": self.dropped,
+                "retries": self.retried,
+                "batches": self.batches,
+                "latency_ms_p50": round(statistics.median(latencies), 1) if latencies else None,
+                "latency_ms_max": round(latencies[-1], 1) if latencies else None,
+                "last_error": self.last_error,
+            }
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Process-wide dispatcher with the sinks from the environment"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = Dispatcher(sinks_from_env())
+            atexit.register(_dispatcher.close)
+        return _dispatcher
+
+
+def notify(kind, team, text, subject=None):
+    """Queue a notification; never blocks the caller"""
+    return get_dispatcher().submit(kind, team, text, subject)
+
+
+# ---- local stand-ins for testing ----
+class StandInWebhook(ThreadingHTTPServer):
+    """Collects posted batches; the first `fail_first` requests get a 503"""
+
+    def __init__(self, fail_first=0):
+        self.received = []
+        self.requests = 0
+        self.fail_first = fail_first
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                server.requests += 1
+                if server.requests <= server.fail_first:
+                    self.send_response(503)
+                else:
+                    server.received.extend(json.loads(body)["messages"])
+                    self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        super().__init__(("127.0.0.1", 0), Handler)
+
+
+class StandInSmtp(socketserver.ThreadingTCPServer):
+    """Just enough SMTP to accept mails; keeps the raw message bodies"""
+
+    allow_reuse_address = True
+
+    def __init__(self):
+        self.mails = []
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.wfile.write(b"220 stand-in ESMTP\r\n")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command = line.decode(errors="replace").strip().upper()
+                    if command.startswith(("EHLO", "HELO")):
+                        self.wfile.write(b"250 stand-in\r\n")
+                    elif command == "DATA":
+                        self.wfile.write(b"354 end with .\r\n")
+                        data = []
+                        for data_line in iter(self.rfile.readline, b".\r\n"):
+                            data.append(data_line)
+                        server.mails.append(b"".join(data).decode(errors="replace"))
+                        self.wfile.write(b"250 queued\r\n")
+                    elif command == "QUIT":
+                        self.wfile.write(b"221 bye\r\n")
+                        return
+                    else:  # MAIL FROM, RCPT TO, RSET, NOOP
+                        self.wfile.write(b"250 ok\r\n")
+
+        super().__init__(("127.0.0.1", 0), Handler)
+
+
+def _self_test(messages=50):
+    webhook, smtp = StandInWebhook(fail_first=2), StandInSmtp()
+    for server in (webhook, smtp):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    sinks = [WebhookSink(f"http://127.0.0.1:{webhook.server_address[1]}/hook"),
+             SmtpSink("127.0.0.1", smtp.server_address[1], "triage@localhost", ["team@localhost"])]
+    dispatcher = Dispatcher(sinks, backoff=0.05)
+    start = time.perf_counter()
+    for i in range(messages):
+        dispatcher.submit("go", "default", f"Konsil {i} zueteilt a BA")
+    submit_us = (time.perf_counter() - start) / messages * 1e6
+    dispatcher.flush()
+    stats = dispatcher.stats()
+    dispatcher.close()
+    if len(webhook.received) != messages or stats["sent"] != messages:
+        raise AssertionError(f"webhook got {len(webhook.received)} of {messages}: {stats}")
+    # Only the failing webhook is retried; the mail goes out once per batch
+    if len(smtp.mails) != stats["batches"] or stats["per_sink"][sinks[1].name]["retries"]:
+        raise AssertionError(f"{len(smtp.mails)} mails for {stats['batches']} batches: {stats}")
+    # A sink that stays down: the other one still counts as delivered
+    down = Dispatcher([sinks[1], WebhookSink("http://127.0.0.1:9/down", timeout=1)], retries=1, backoff=0.01)
+    mails = smtp_before = len(smtp.mails)
+    down.submit("go", "default", "Konsil zueteilt a BA")
+    down.flush()
+    down_stats = down.stats()
+    down.close()
+    if (down_stats["partial"], down_stats["failed"], len(smtp.mails) - smtp_before) != (1, 0, 1):
+        raise AssertionError(f"one sink down: {down_stats}")
+    webhook.shutdown()
+    smtp.shutdown()
+    return submit_us, mails, stats
+
+
+if __name__ == "__main__":
+    submit_us, mails, stats = _self_test()
+    print(f"submit {submit_us:.1f} us/message, {stats['batches']} batches, {mails} mails, "
+          f"{stats['retries']} retries, latency p50 {stats['latency_ms_p50']} ms")
+    sys.exit(0)
@@ -0,0 +1,418 @@
+"""
+Write-behind persistence with group commit.
+
+The script thread hands records to a GroupCommitWriter and returns at
+once; a single worker thread takes them off a bounded queue and commits
+them in groups: whatever arrived within COMMIT_MS of the first record, at
+most COMMIT_RECORDS per group, with one fsync per group instead of one
+per record. Records are committed strictly in submission order, so a
+record is never on disk before one submitted earlier. A full queue blocks
+the submitter (back pressure) instead of dropping state, a failing commit
+is retried with backoff, and close() flushes everything that is queued.
+A retried group is written again from its start, so the logs first cut
+what the failed attempt left behind (the log size before the group is
+kept for that), and a line that still cannot be parsed on reading is
+skipped instead of stopping the replay.
+
+What is not yet committed is lost if the machine goes down, i.e. at most
+the last COMMIT_MS of clicks; a clean shutdown (atexit) loses nothing.
+
+AggregateLog builds on it for append-only JSON-lines logs that are only
+read as running totals (quiz results, workflow timings): every record is
+folded into the totals in O(1), and every `snapshot_every` records the
+totals are written together with the log offset they cover, so loading
+replays only the tail.
+
+With TRIAGE_SHARED_STATE=1 several app worker processes share these files
+(see triage.workers). Every append then happens under an exclusive file
+lock (SharedLock): the process first folds whatever the other workers
+appended since it last looked, then writes its own line before releasing
+the lock, so the files stay one ordered log. Only the fsync is left to
+the group-commit worker. Readers pick up foreign appends with one stat()
+of the log file (refresh).
+
+    TRIAGE_COMMIT_MS        group window in milliseconds (default 5)
+    TRIAGE_COMMIT_RECORDS   maximum records per group (default 64)
+    TRIAGE_COMMIT_QUEUE     queue length before submitters block (default 4096)
+    TRIAGE_SHARED_STATE     1: state files are shared by several worker processes
+
+Click latency, synchronous fsync per event vs. group commit (use --dir to
+measure on the network-mounted data/ directory):
+    python -m triage.persist [--dir PATH] [--events N]
+"""
+
+import argparse
+import json
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from triage.core import deep_sizeof
+
+try:
+    import fcntl
+except ImportError:  # Windows: no shared state between processes
+    fcntl = None
+
+COMMIT_SECONDS = float(os.environ.get("TRIAGE_COMMIT_MS", "5")) / 1000
+COMMIT_RECORDS = int(os.environ.get("TRIAGE_COMMIT_RECORDS", "64"))
+MAX_QUEUE = int(os.environ.get("TRIAGE_COMMIT_QUEUE", "4096"))
+BACKOFF_SECONDS = 0.05
+MAX_BACKOFF_SECONDS = 2
+TIMING_WINDOW = 200
+SHARED_STATE = os.environ.get("TRIAGE_SHARED_STATE", "") == "1"
+
+
+class GroupCommitWriter:
+    """Bounded queue plus one worker that passes groups of records to `commit`.
+
+    `commit(records)` runs in the worker thread and must make the records
+    durable (write and fsync) before it returns.
+    """
+
+    def __init__(self, commit, name="group-commit", max_queue=MAX_QUEUE,
+                 max_records=COMMIT_RECORDS, interval=COMMIT_SECONDS):
+        self._commit = commit
+        self.max_records = max_records
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._submit_lock = threading.Lock()
+        self._durable_changed = threading.Condition()
+        self._commit_ms = deque(maxlen=TIMING_WINDOW)
+        self.submitted = 0
+        self.durable = 0
+        self.groups = 0
+        self.stalls = 0
+        self.retries = 0
+        self.last_error = None
+        self._stopping = threading.Event()
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, record):
+        """Queue a record, returns its ticket for wait(); blocks only if the queue is full"""
+        with self._submit_lock:  # tickets follow queue order
+            if self._stopping.is_set():
+                raise RuntimeError("writer is closed")
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.stalls += 1
+                self._queue.put(record)
+            self.submitted += 1
+            return self.submitted
+
+    def _next_group(self):
+        group = [self._queue.get()]
+        deadline = time.monotonic() + self.interval
+        while len(group) < self.max_records:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                group.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return [record for record in group if record is not None]
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            group = self._next_group()  # None (the shutdown sentinel) is filtered out
+            if not group:
+                continue
+            attempt = 0
+            while True:
+                start = time.perf_counter()
+                try:
+                    self._commit(group)
+                    break
+                except Exception as e:  # keep the group, the disk may come back
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    self.retries += 1
+                    time.sleep(min(BACKOFF_SECONDS * 2 ** attempt, MAX_BACKOFF_SECONDS))
+                    attempt += 1
+            self._commit_ms.append((time.perf_counter() - start) * 1000)
+            with self._durable_changed:
+                self.durable += len(group)
+                self.groups += 1
+                self._durable_changed.notify_all()
+
+    def wait(self, ticket=None, timeout=None):
+        """Block until `ticket` (default: everything submitted so far) is durable"""
+        ticket = self.submitted if ticket is None else ticket
+        with self._durable_changed:
+            return self._durable_changed.wait_for(lambda: self.durable >= ticket, timeout)
+
+    def flush(self, timeout=None):
+        return self.wait(timeout=timeout)
+
+    def close(self, timeout=10):
+        """Commit everything queued and stop the worker"""
+        with self._submit_lock:
+            if self._stopping.is_set():
+                return
+            self._stopping.set()
+        self._queue.put(None)
+        self._worker.join(timeout)
+
+    def stats(self):
+        timings = sorted(self._commit_ms)
+        return {
+            "queue_depth": self._queue.qsize(),
+            "submitted": self.submitted,
+            "durable": self.durable,
+            "groups": self.groups,
+            "records_per_group": round(self.durable / self.groups, 1) if self.groups else None,
+            "commit_ms_p50": round(statistics.median(timings), 2) if timings else None,
+            "commit_ms_max": round(timings[-1], 2) if timings else None,
+            "stalls": self.stalls,
+            "retries": self.retries,
+            "last_error": self.last_error,
+        }
+
+
+class ImmediateWriter:
+    """Same interface, but commits every record in the caller (fsync per record)"""
+
+    def __init__(self, commit, name=None):
+        self._commit = commit
+        self._lock = threading.Lock()
+        self.submitted = 0
+
+    def submit(self, record):
+        with self._lock:
+            self._commit([record])
+            self.submitted += 1
+            return self.submitted
+
+    def wait(self, ticket=None, timeout=None):
+        return True
+
+    def flush(self, timeout=None):
+        return True
+
+    def close(self, timeout=None):
+        pass
+
+    def stats(self):
+        return {"submitted": self.submitted, "durable": self.submitted}
+
+
+class SharedLock:
+    """A process's re-entrant lock plus, if `path` is given, an exclusive flock
+    on `path` that serializes the worker processes.
+
+    `on_acquire` runs whenever the outermost holder has just taken the file
+    lock, to catch up on what the other processes wrote in the meantime.
+    """
+
+    def __init__(self, lock, path=None, on_acquire=None):
+        if path is not None and fcntl is None:
+            raise RuntimeError("TRIAGE_SHARED_STATE needs fcntl (Linux/macOS)")
+        self.lock = lock
+        self.on_acquire = on_acquire
+        self._file = open(path, "a") if path is not None else None
+        self._depth = 0
+        self.waits = 0
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self._file is not None and self._depth == 0:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.waits += 1
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+            self._depth = 1
+            if self.on_acquire is not None:
+                self.on_acquire()
+        else:
+            self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._file is not None and self._depth == 0:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self.lock.release()
+
+
+class AggregateLog:
+    """Append-only JSON lines plus the running totals folded from them.
+
+    Subclasses implement fold(record), totals() (a JSON-able dict) and
+    restore(totals).
+    """
+
+    def __init__(self, root, log_name, snapshot_name, snapshot_every, shared=SHARED_STATE):
+        self.root = Path(root)
+        self.log_path = self.root / log_name
+        self.snapshot_path = self.root / snapshot_name
+        self.snapshot_every = snapshot_every
+        self.shared = shared
+        self.lock = threading.RLock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.exclusive = SharedLock(self.lock, self.log_path.with_suffix(".lock") if shared else None)
+        self.skipped = 0  # unreadable lines passed over by _fold_tail
+        self._retry, self._mark = None, 0  # writer thread: last group and the log size before it
+        with self.exclusive:
+            self.log_bytes = self._load_snapshot()
+            self.replayed = self._fold_tail(truncate=True)
+        self.exclusive.on_acquire = self.refresh
+        self.since_snapshot = self.replayed
+        self._size = (-1, 0)  # (log_bytes, bytes) of the last memory estimate
+        self.writer = GroupCommitWriter(self._commit, name=f"{self.log_path.stem}-{self.root.name}")
+
+    def fold(self, record):
+        raise NotImplementedError
+
+    def totals(self):
+        raise NotImplementedError
+
+    def restore(self, totals):
+        raise NotImplementedError
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, encoding="utf-8") as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return 0
+        self.restore(data)
+        return data["offset"]
+
+    def _fold_tail(self, truncate=False):
+        """Fold the records after offset log_bytes; on load a torn last line is cut"""
+        if not self.log_path.exists():
+            return 0
+        folded = 0
+        with open(self.log_path, "rb+" if truncate else "rb") as fh:
+            fh.seek(self.log_bytes)
+            for line in fh:
+                if not line.endswith(b"\n"):
+                    if truncate:
+                        fh.truncate(self.log_bytes)
+                    break  # otherwise another worker is still writing it
+                self.log_bytes += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn write followed by later appends, or an offset inside a line
+                    self.skipped += 1
+                    continue
+                self.fold(record)
+                folded += 1
+        return folded
+
+    def refresh(self):
+        """Shared state: fold what the other workers appended, one stat() if nothing"""
+        if not self.shared:
+            return 0
+        with self.lock:
+            try:
+                if os.stat(self.log_path).st_size == self.log_bytes:
+                    return 0
+            except FileNotFoundError:
+                return 0
+            return self._fold_tail()
+
+    def _commit(self, records):
+        """Writer thread: append lines, replace the snapshot in order"""
+        if not self.shared:  # shared state: the lines are in the log already, never cut it
+            if self._retry is records:
+                # Retry of a failed group: drop what it wrote, the snapshot offsets stay valid
+                os.truncate(self.log_path, self._mark)
+            else:
+                self._retry = records
+                try:
+                    self._mark = os.stat(self.log_path).st_size
+                except FileNotFoundError:
+                    self._mark = 0
+        with open(self.log_path, "ab") as fh:
+            for kind, data in records:
+                if kind == "snapshot":
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                    tmp = self.snapshot_path.with_suffix(f".{os.getpid()}.tmp")
+                    with open(tmp, "wb") as out:
+                        out.write(data)
+                        out.flush()
+                        os.fsync(out.fileno())
+                    os.replace(tmp, self.snapshot_path)
+                elif kind == "record":
+                    fh.write(data)
+                # "sync": shared state, the line is written already
+            fh.flush()
+            os.fsync(fh.fileno())
+        self._retry = None
+
+    def append(self, record):
+        """Fold a record into the totals and queue it for the log"""
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+        with self.exclusive:
+            self.fold(record)
+            self.log_bytes += len(line)
+            if self.shared:
+                # Visible to the other workers before the file lock is released
+                with open(self.log_path, "ab") as fh:
+                    fh.write(line)
+                self.writer.submit(("sync", None))
+            else:
+                self.writer.submit(("record", line))
+            self.since_snapshot += 1
+            if self.since_snapshot >= self.snapshot_every:
+                totals = dict(self.totals(), offset=self.log_bytes)
+                self.writer.submit(("snapshot", json.dumps(totals, separators=(",", ":")).encode()))
+                self.since_snapshot = 0
+
+    def memory_bytes(self):
+        """Size of the folded totals, re-measured only after new records"""
+        with self.lock:
+            if self._size[0] != self.log_bytes:
+                self._size = (self.log_bytes, deep_sizeof(self.totals()))
+            return self._size[1]
+
+    def close(self):
+        self.writer.close()
+
+
+def _benchmark(directory, events=500):
+    from triage.events import EventStore
+
+    results = {}
+    for mode in ("fsync per event", "group commit"):
+        with tempfile.TemporaryDirectory(dir=directory) as tmp:
+            store = EventStore(tmp, group_commit=mode == "group commit")
+            store.sync_roster([f"M{i:02d}" for i in range(7)])
+            latencies = []
+            start = time.perf_counter()
+            for i in range(events):
+                click = time.perf_counter()
+                store.append({"type": "go", "ma": store.state.queue[0], "period": "AM"})
+                latencies.append((time.perf_counter() - click) * 1000)
+            store.close()
+            elapsed = time.perf_counter() - start
+            # Everything is on disk, in order, after close()
+            seqs = [event["seq"] for event in store.iter_events()]
+            if seqs != list(range(1, events + 2)):
+                raise AssertionError(f"{mode}: log holds {len(seqs)} events out of order")
+            results[mode] = (statistics.median(latencies), max(latencies), events / elapsed,
+                             store.writer.stats())
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="group commit vs. fsync per event")
+    parser.add_argument("--dir", default=None, help="directory to benchmark (default: system temp)")
+    parser.add_argument("--events", type=int, default=500)
+    args = parser.parse_args()
+    for mode, (p50, worst, rate, stats) in _benchmark(args.dir, args.events).items():
+        groups = f", {stats['records_per_group']} events/fsync" if "groups" in stats else ""
+        print(f"{mode:<16} click p50 {p50:.3f} ms, max {worst:.2f} ms, {rate:,.0f} events/s{groups}")
+    sys.exit(0)
@@ -0,0 +1,128 @@
+"""
+Opt-in sampling profiler for single script runs.
+
+Switched on for every rerun with TRIAGE_PROFILE=1, or for one session with
+the hidden ?profile=1 URL parameter. While a run is profiled, a background
+thread samples the script thread's stack every TRIAGE_PROFILE_INTERVAL_MS
+(default 5 ms) and the counts are written as a collapsed-stack file
+("frame;frame;frame count" per line) that speedscope and flamegraph.pl open
+directly. When profiling is off nothing is started, the only cost is the
+check of the environment variable and the query parameter.
+
+Captures go to data/state/profiles/ and are rotated: at most
+TRIAGE_PROFILE_MAX_FILES files and TRIAGE_PROFILE_MAX_MB megabytes, oldest
+first.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from triage.tenancy import STATE_DIR
+
+PROFILES_DIR = STATE_DIR / "profiles"
+PROFILE_PARAM = "profile"
+PROFILE_ALWAYS = os.environ.get("TRIAGE_PROFILE") == "1"
+INTERVAL_SECONDS = float(os.environ.get("TRIAGE_PROFILE_INTERVAL_MS", "5")) / 1000
+MAX_FILES = int(os.environ.get("TRIAGE_PROFILE_MAX_FILES", "50"))
+MAX_BYTES = int(os.environ.get("TRIAGE_PROFILE_MAX_MB", "20")) * 1024 * 1024
+MAX_SECONDS = 60  # a run that never reaches stop() is cut off here
+SUFFIX = ".folded"
+
+
+def profiling_enabled(param_value):
+    """True if this run should be profiled (env var or ?profile=1)"""
+    return PROFILE_ALWAYS or param_value == "1"
+
+
+def frame_label(code):
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+
+class RerunProfiler:
+    """Samples the stack of the thread that created it"""
+
+    def __init__(self, root_file, interval=INTERVAL_SECONDS):
+        self.root_file = str(root_file)
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rerun-profiler", daemon=True)
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def _run(self):
+        deadline = time.monotonic() + MAX_SECONDS
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                # Frames above the script (Streamlit's runner) are the same every time
+                if frame.f_code.co_filename == self.root_file:
+                    break
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(frame_label(code) for code in reversed(stack))] += 1
+                self.samples += 1
+
+    def stop(self, label="run", root=PROFILES_DIR):
+        """Stop sampling and write the capture, returns its path (None if empty)"""
+        self._stop.set()
+        self._thread.join()
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        if not self.counts:
+            return None
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}"
+        path = root / f"{stamp}-{label}-{elapsed_ms:.0f}ms-{self.samples}s{SUFFIX}"
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in self.counts.most_common()),
+                        encoding="utf-8")
+        rotate(root)
+        return path
+
+
+def rotate(root=PROFILES_DIR, max_files=MAX_FILES, max_bytes=MAX_BYTES):
+    """Delete the oldest captures beyond the file and size limits"""
+    captures = sorted(Path(root).glob(f"*{SUFFIX}"), reverse=True)
+    total = 0
+    for index, path in enumerate(captures):
+        total += path.stat().st_size
+        if index >= max_files or total > max_bytes:
+            path.unlink(missing_ok=True)
+
+
+def self_time(path, top=10):
+    """(frame, samples) with the most samples at the top of the stack"""
+    counts = Counter()
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            counts[stack.rsplit(";", 1)[-1]] += int(count)
+    return counts.most_common(top)
+
+
+def recent_captures(limit=10, root=PROFILES_DIR):
+    """Newest captures as dicts (path, time, label, ms, samples)"""
+    captures = []
+    for path in sorted(Path(root).glob(f"*{SUFFIX}"), reverse=True)[:limit]:
+        parts = path.name[:-len(SUFFIX)].split("-")
+        captures.append({
+            "path": path,
+            "time": f"{parts[0][:4]}-{parts[0][4:6]}-{parts[0][6:]} "
+                    f"{parts[1][:2]}:{parts[1][2:4]}:{parts[1][4:]}",
+            "label": "-".join(parts[3:-2]),
+            "ms": int(parts[-2][:-2]),
+            "samples": int(parts[-1][:-1]),
+        })
+    return captures
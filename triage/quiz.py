@@ -0,0 +1,432 @@
+"""
+Spaced repetition (SM-2) for the Tagesquiz.
+
+Every user (the MA picked under "Wer bisch du?") has a schedule: for each
+question they have seen, the SM-2 repetition count, interval and easiness
+factor, the day it is due again and the result of the last answer. A
+correct answer counts as quality 4, a wrong one as quality 1 (back to a
+one-day interval).
+
+Schedules are kept in a min-heap of (due day, question id). The daily plan
+pops the due entries in O(log n) each (at most DAILY_MAX), and tops up
+with questions the user has never seen, in bank order, until there are
+DAILY_MIN. The plan is stored with the schedule, so the same 3-5
+questions stay on screen for the whole day. Rescheduling pushes a new heap
+entry; outdated entries are skipped when popped and the heap is rebuilt
+once they outnumber the live ones.
+
+On disk every user is one small binary file (data/state/quiz/<team>/<user>.bin):
+a header with the plan, then one fixed 19-byte record per seen question.
+Loaded schedules are kept in a per-team LRU of SCHEDULES_CACHED users.
+With TRIAGE_SHARED_STATE=1 every plan/answer runs under a file lock and
+first compares the cached schedule with its file (inode, mtime, size), so
+a worker never overwrites answers another worker saved meanwhile.
+
+Team results (QuizResults) count every answer into running totals per
+user, per level, per user and level, and per question, an O(1) update.
+The leaderboard and the per-question difficulty are read from those
+totals and never from the answers themselves. Answers are appended to
+answers.jsonl through an AggregateLog (triage.persist), and every
+RESULTS_SNAPSHOT_EVERY answers the totals are written to results.json
+together with the log offset they cover, so loading replays only the tail.
+
+Benchmark with thousands of questions and hundreds of users:
+    python -m triage.quiz
+"""
+
+import atexit
+import datetime
+import heapq
+import os
+import random
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from triage.persist import SHARED_STATE, AggregateLog, SharedLock
+from triage.tenancy import STATE_DIR
+
+QUIZ_STATE_DIR = STATE_DIR / "quiz"
+DAILY_MIN = 3
+DAILY_MAX = 5
+SCHEDULES_CACHED = int(os.environ.get("TRIAGE_QUIZ_USERS_CACHED", "128"))
+INITIAL_EF = 2.5
+MIN_EF = 1.3
+MAX_INTERVAL = 3650
+QUALITY_CORRECT = 4
+QUALITY_WRONG = 1
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<BIB")  # version, plan day (ordinal), plan length
+PLAN_ID = struct.Struct("<I")
+RECORD = struct.Struct("<IHHHIIB")  # id, reps, interval, ef*100, due, last day, last ok
+USER_NAME = re.compile(r"[^A-Za-z0-9_-]")
+RESULTS_SNAPSHOT_EVERY = int(os.environ.get("TRIAGE_QUIZ_SNAPSHOT_EVERY", "500"))
+LEADERBOARD_SIZE = 10
+# Memory estimate per schedule item: a list of six ints (due and last day are not
+# interned) keyed by its question id, plus one (due, qid) heap tuple
+ITEM_BYTES = sys.getsizeof([0] * 6) + 3 * sys.getsizeof(10 ** 6)
+HEAP_ENTRY_BYTES = sys.getsizeof((0, 0))
+
+
+def today():
+    return datetime.date.today().toordinal()
+
+
+def sm2(item, quality, day):
+    """Next [reps, interval, ef100, due, last, ok] after an answer of `quality` (0-5)"""
+    reps, interval, ef100 = item[0], item[1], item[2]
+    ef = ef100 / 100
+    if quality >= 3:
+        interval = 1 if reps == 0 else 6 if reps == 1 else round(interval * ef)
+        reps += 1
+    else:
+        reps, interval = 0, 1
+    ef = max(MIN_EF, ef + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    interval = min(interval, MAX_INTERVAL)
+    return [reps, interval, round(ef * 100), day + interval, day, int(quality >= 3)]
+
+
+class Schedule:
+    """SM-2 state of one user plus the heap of due days"""
+
+    def __init__(self, items=None, plan_day=0, plan=()):
+        self.items = items or {}  # question id -> [reps, interval, ef100, due, last, ok]
+        self.plan_day = plan_day
+        self.plan = list(plan)
+        self._heap = [(item[3], qid) for qid, item in self.items.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_due(self, day, limit):
+        """Up to `limit` question ids due on or before `day`, earliest first"""
+        due = []
+        while self._heap and len(due) < limit and self._heap[0][0] <= day:
+            entry = heapq.heappop(self._heap)
+            item = self.items.get(entry[1])
+            if item is not None and item[3] == entry[0]:  # skip outdated entries
+                due.append(entry)
+        for entry in due:  # still due until answered
+            heapq.heappush(self._heap, entry)
+        return [qid for _, qid in due]
+
+    def daily_plan(self, bank_ids, day):
+        """Today's questions: due ones first, new ones up to DAILY_MIN"""
+        known = set(bank_ids)
+        if self.plan_day == day and all(qid in known for qid in self.plan):
+            return self.plan, False
+        plan = [qid for qid in self._pop_due(day, DAILY_MAX) if qid in known]
+        for qid in bank_ids:
+            if len(plan) >= DAILY_MIN:
+                break
+            if qid not in self.items and qid not in plan:
+                plan.append(qid)
+        self.plan_day, self.plan = day, plan
+        return plan, True
+
+    def answer(self, qid, correct, day):
+        item = self.items.get(qid, [0, 0, round(INITIAL_EF * 100), day, 0, 0])
+        self.items[qid] = item = sm2(item, QUALITY_CORRECT if correct else QUALITY_WRONG, day)
+        heapq.heappush(self._heap, (item[3], qid))
+        if len(self._heap) > 2 * len(self.items) + 16:
+            self._heap = [(item[3], q) for q, item in self.items.items()]
+            heapq.heapify(self._heap)
+        return item
+
+    def answered_on(self, qid, day):
+        """True/False for the result of an answer given on `day`, None if not answered"""
+        item = self.items.get(qid)
+        if item is None or item[4] != day:
+            return None
+        return bool(item[5])
+
+    def memory_bytes(self):
+        return (sys.getsizeof(self.items) + len(self.items) * ITEM_BYTES
+                + sys.getsizeof(self._heap) + len(self._heap) * HEAP_ENTRY_BYTES + sys.getsizeof(self.plan))
+
+    # ---- storage ----
+    def to_bytes(self):
+        parts = [HEADER.pack(FORMAT_VERSION, self.plan_day, len(self.plan))]
+        parts += [PLAN_ID.pack(qid) for qid in self.plan]
+        parts += [RECORD.pack(qid, *item) for qid, item in self.items.items()]
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        version, plan_day, n_plan = HEADER.unpack_from(data)
+        if version != FORMAT_VERSION:
+            return cls()
+        offset = HEADER.size
+        plan = [PLAN_ID.unpack_from(data, offset + i * PLAN_ID.size)[0] for i in range(n_plan)]
+        offset += n_plan * PLAN_ID.size
+        items = {record[0]: list(record[1:]) for record in RECORD.iter_unpack(data[offset:])}
+        return cls(items, plan_day, plan)
+
+
+class QuizScheduler:
+    """Schedules of one team's users, loaded lazily and written on every answer"""
+
+    def __init__(self, root, cached=SCHEDULES_CACHED, shared=SHARED_STATE):
+        self.root = Path(root)
+        self.cached = cached
+        self.shared = shared
+        self.lock = threading.RLock()
+        if shared:
+            self.root.mkdir(parents=True, exist_ok=True)
+        # Shared state: every read-modify-write of a schedule holds the file lock
+        self.exclusive = SharedLock(self.lock, self.root / "schedules.lock" if shared else None)
+        self._schedules = OrderedDict()  # user -> (Schedule, file identity when it was read)
+        self.loads = 0
+        self.reloads = 0  # cached schedules another worker had saved meanwhile
+
+    def _path(self, user):
+        return self.root / f"{USER_NAME.sub('_', str(user))}.bin"
+
+    def _identity(self, user):
+        """Inode, mtime and size of the user's file (None when not shared or missing)"""
+        if not self.shared:
+            return None
+        try:
+            stat = self._path(user).stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _get(self, user):
+        entry = self._schedules.get(user)
+        if entry is not None and self.shared and entry[1] != self._identity(user):
+            entry = None  # another worker saved this user since we read it
+            self.reloads += 1
+        if entry is None:
+            try:
+                schedule = Schedule.from_bytes(self._path(user).read_bytes())
+            except (OSError, struct.error):
+                schedule = Schedule()
+            self.loads += 1
+            entry = self._schedules[user] = (schedule, self._identity(user))
+            while len(self._schedules) > self.cached:
+                self._schedules.popitem(last=False)
+        self._schedules.move_to_end(user)
+        return entry[0]
+
+    def _save(self, user, schedule):
+        path = self._path(user)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(schedule.to_bytes())
+        os.replace(tmp, path)
+        self._schedules[user] = (schedule, self._identity(user))
+
+    def plan(self, user, bank_ids, day=None):
+        """Question ids to show `user` today"""
+        day = day or today()
+        with self.exclusive:
+            schedule = self._get(user)
+            plan, changed = schedule.daily_plan(bank_ids, day)
+            if changed:
+                self._save(user, schedule)
+            return list(plan)
+
+    def answer(self, user, qid, correct, day=None):
+        """Record an answer, returns the question's next due day (ordinal)"""
+        day = day or today()
+        with self.exclusive:
+            schedule = self._get(user)
+            item = schedule.answer(qid, correct, day)
+            self._save(user, schedule)
+            return item[3]
+
+    def answered_on(self, user, qid, day=None):
+        with self.exclusive:
+            return self._get(user).answered_on(qid, day or today())
+
+    def memory_bytes(self):
+        with self.lock:
+            return sum(schedule.memory_bytes() for schedule, _ in self._schedules.values())
+
+    def stats(self):
+        return {"users_cached": len(self._schedules), "loads": self.loads, "reloads": self.reloads}
+
+
+def _add(totals, key, ok):
+    counts = totals.get(key)
+    if counts is None:
+        counts = totals[key] = [0, 0]
+    counts[0] += 1
+    counts[1] += ok
+
+
+class QuizResults(AggregateLog):
+    """Team-wide answer log with running totals ([answered, correct] per key)"""
+
+    def __init__(self, root, snapshot_every=RESULTS_SNAPSHOT_EVERY):
+        self.answers = 0
+        self.users = {}
+        self.levels = {}
+        self.user_levels = {}  # "user|level" (JSON keys are strings)
+        self.questions = {}
+        super().__init__(root, "answers.jsonl", "results.json", snapshot_every)
+
+    def fold(self, answer):
+        user, ok = answer["user"], answer["ok"]
+        self.answers += 1
+        if user:
+            _add(self.users, user, ok)
+            _add(self.user_levels, f"{user}|{answer['level']}", ok)
+        _add(self.levels, answer["level"], ok)
+        _add(self.questions, answer["qid"], ok)
+
+    def totals(self):
+        return {"answers": self.answers, "users": self.users, "levels": self.levels,
+                "user_levels": self.user_levels, "questions": self.questions}
+
+    def restore(self, totals):
+        self.answers = totals["answers"]
+        self.users = totals["users"]
+        self.levels = totals["levels"]
+        self.user_levels = totals["user_levels"]
+        self.questions = {int(qid): counts for qid, counts in totals["questions"].items()}
+
+    def record(self, user, level, qid, ok):
+        """Count one answer (user "" for anonymous sessions)"""
+        self.append({"ts": datetime.datetime.now().isoformat(timespec="seconds"), "user": user,
+                     "level": level, "qid": qid, "ok": int(bool(ok))})
+
+    def leaderboard(self, size=LEADERBOARD_SIZE):
+        """Top users by correct answers, then by success rate"""
+        self.refresh()  # appends of the other workers (shared state)
+        with self.lock:
+            top = heapq.nlargest(size, self.users.items(),
+                                 key=lambda item: (item[1][1], item[1][1] / item[1][0]))
+        return [{"user": user, "answered": answered, "correct": correct,
+                 "percent": round(100 * correct / answered, 1)}
+                for user, (answered, correct) in top]
+
+    def user_levels_of(self, user):
+        """{level: (answered, correct)} of one user"""
+        self.refresh()
+        with self.lock:
+            return {key.split("|", 1)[1]: tuple(counts) for key, counts in self.user_levels.items()
+                    if key.startswith(f"{user}|")}
+
+    def difficulty(self):
+        """{question id: (answered, percent correct)}"""
+        self.refresh()
+        with self.lock:
+            return {qid: (answered, round(100 * correct / answered, 1))
+                    for qid, (answered, correct) in self.questions.items()}
+
+    def stats(self):
+        return {"answers": self.answers, "replayed_on_load": self.replayed,
+                "skipped_lines": self.skipped, "users": len(self.users), "writer": self.writer.stats()}
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+_results = {}
+
+
+def open_scheduler(team):
+    """Process-wide QuizScheduler of a team"""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(team)
+        if scheduler is None:
+            scheduler = _schedulers[team] = QuizScheduler(QUIZ_STATE_DIR / team)
+        return scheduler
+
+
+def open_results(team):
+    """Process-wide QuizResults of a team"""
+    with _schedulers_lock:
+        results = _results.get(team)
+        if results is None:
+            results = _results[team] = QuizResults(QUIZ_STATE_DIR / team)
+            atexit.register(results.close)  # flush queued answers on shutdown
+        return results
+
+
+def team_memory_bytes(team):
+    """Memory of the team's open scheduler and results (0 if none are open)"""
+    with _schedulers_lock:
+        objects = [_schedulers.get(team), _results.get(team)]
+    return sum(obj.memory_bytes() for obj in objects if obj is not None)
+
+
+def release_team(team):
+    """Drop the team's scheduler and flush and drop its results; reopened on next use"""
+    with _schedulers_lock:
+        _schedulers.pop(team, None)
+        results = _results.pop(team, None)
+    if results is not None:
+        atexit.unregister(results.close)
+        results.close()
+
+
+def _benchmark(questions=5000, users=200, days=60, seed=0):
+    rng = random.Random(seed)
+    bank_ids = list(range(1, questions + 1))
+    with tempfile.TemporaryDirectory() as tmp:
+        scheduler = QuizScheduler(tmp, cached=64)  # smaller than the user count: exercises reloads
+        results = QuizResults(Path(tmp) / "results")
+        plan_times, answer_times, record_times = [], [], []
+        for day in range(1, days + 1):
+            for user in range(users):
+                start = time.perf_counter()
+                plan = scheduler.plan(f"U{user}", bank_ids, day)
+                plan_times.append(time.perf_counter() - start)
+                for qid in plan:
+                    ok = rng.random() < 0.8
+                    start = time.perf_counter()
+                    scheduler.answer(f"U{user}", qid, ok, day)
+                    answer_times.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    results.record(f"U{user}", f"L{qid % 3}", qid, ok)
+                    record_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        results.leaderboard()
+        results.difficulty()
+        board_ms = (time.perf_counter() - start) * 1000
+        results.close()
+        start = time.perf_counter()
+        reloaded = QuizResults(Path(tmp) / "results")
+        reload_ms = (time.perf_counter() - start) * 1000
+        if reloaded.users != results.users or reloaded.questions != results.questions:
+            raise AssertionError("reloaded quiz totals differ")
+        reloaded.close()
+        # Two workers answering for the same user must not overwrite each other
+        workers = [QuizScheduler(Path(tmp) / "shared", shared=True) for _ in range(2)]
+        for worker in workers:
+            worker.plan("S", bank_ids, 1)
+        for n, worker in enumerate(workers):
+            worker.answer("S", n + 1, True, 1)
+        if set(QuizScheduler(Path(tmp) / "shared")._get("S").items) != {1, 2}:
+            raise AssertionError("a worker overwrote another worker's answer")
+        files = list(Path(tmp).glob("*.bin"))
+        size = sum(path.stat().st_size for path in files) / len(files)
+        seen = sum(len(scheduler._get(f"U{u}").items) for u in range(users)) / users
+    plan_times.sort()
+    answer_times.sort()
+    record_times.sort()
+    return {
+        "answers": results.answers,
+        "record_us_p50": record_times[len(record_times) // 2] * 1e6,
+        "board_ms": board_ms,
+        "reload_ms": reload_ms,
+        "plan_us_p50": plan_times[len(plan_times) // 2] * 1e6,
+        "answer_us_p50": answer_times[len(answer_times) // 2] * 1e6,
+        "seen_per_user": seen,
+        "bytes_per_user": size,
+    }
+
+
+if __name__ == "__main__":
+    result = _benchmark()
+    print(f"5000 questions, 200 users, 60 days: plan {result['plan_us_p50']:.0f} us, "
+          f"answer {result['answer_us_p50']:.0f} us (p50), {result['seen_per_user']:.0f} "
+          f"questions seen, {result['bytes_per_user'] / 1024:.1f} KB per user")
+    print(f"team results: {result['answers']} answers, record {result['record_us_p50']:.1f} us (p50), "
+          f"leaderboard + difficulty {result['board_ms']:.2f} ms, reload {result['reload_ms']:.0f} ms")
+    sys.exit(0)
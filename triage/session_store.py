@@ -0,0 +1,130 @@
+"""
+Bounded per-session state with spill-to-disk.
+
+Quiz and workflow state that has not changed for a while is parked on disk
+under the session's spill directory once the session exceeds its memory
+limit, and restored the next time it is read. (The assignment log lives in
+the team's event store, which keeps only a bounded tail in memory.)
+"""
+
+import json
+import os
+import pickle
+import shutil
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from triage.core import deep_sizeof
+from triage.tenancy import STATE_DIR
+
+SESSIONS_DIR = STATE_DIR / "sessions"
+MEMORY_LIMIT_BYTES = int(os.environ.get("TRIAGE_SESSION_MEMORY_KB", "256")) * 1024
+IDLE_SECONDS = int(os.environ.get("TRIAGE_SESSION_IDLE_MINUTES", "30")) * 60
+STALE_SESSION_DAYS = int(os.environ.get("TRIAGE_SESSION_STALE_DAYS", "14"))
+SWEEP_SECONDS = int(os.environ.get("TRIAGE_SESSION_SWEEP_MINUTES", "60")) * 60
+
+_sweep_lock = threading.Lock()
+_next_sweep = 0.0
+
+
+class SessionStateManager:
+    """Enforces a memory limit on one session's state"""
+
+    def __init__(self, session_id=None, limit_bytes=MEMORY_LIMIT_BYTES,
+                 idle_seconds=IDLE_SECONDS, root=SESSIONS_DIR):
+        self.session_id = session_id or uuid.uuid4().hex
+        self.limit_bytes = limit_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_dir = Path(root) / self.session_id
+        self._touched = {}
+        self._fingerprints = {}
+        self._parked = set()
+        self.spill_events = 0
+
+    def touch(self, key):
+        """Mark a key as in use so it is not parked"""
+        self._touched[key] = time.monotonic()
+
+    def restore(self, state, key):
+        """Page a parked key back into session state, returns True if restored"""
+        if key not in self._parked:
+            return False
+        path = self.spill_dir / f"{key}.pkl"
+        with path.open("rb") as fh:
+            state[key] = pickle.load(fh)
+        path.unlink()
+        self._parked.discard(key)
+        self.touch(key)
+        return True
+
+    def is_parked(self, key):
+        return key in self._parked
+
+    def park(self, state, key):
+        """Write a key's value to disk and drop it from session state"""
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        # pickle keeps non-string dict keys (quiz answers are keyed by int id)
+        with (self.spill_dir / f"{key}.pkl").open("wb") as fh:
+            pickle.dump(state[key], fh, protocol=pickle.HIGHEST_PROTOCOL)
+        del state[key]
+        self._parked.add(key)
+        self.spill_events += 1
+
+    def usage(self, state):
+        """Memory per session-state key (bytes), largest first"""
+        sizes = {key: deep_sizeof(value) for key, value in state.items()
+                 if not str(key).startswith("$$")}
+        return dict(sorted(sizes.items(), key=lambda kv: kv[1], reverse=True))
+
+    def enforce(self, state, parkable=()):
+        """Park idle keys until the session fits its limit"""
+        # A parkable key counts as touched whenever its content changed
+        for key in parkable:
+            if key in state:
+                fingerprint = hash(json.dumps(state[key], sort_keys=True, default=str))
+                if self._fingerprints.get(key) != fingerprint:
+                    self._fingerprints[key] = fingerprint
+                    self.touch(key)
+        if sum(self.usage(state).values()) <= self.limit_bytes:
+            return
+        now = time.monotonic()
+        for key in parkable:
+            if key in state and now - self._touched.get(key, now) > self.idle_seconds:
+                self.park(state, key)
+
+    def spilled_bytes(self):
+        if not self.spill_dir.exists():
+            return 0
+        return sum(p.stat().st_size for p in self.spill_dir.iterdir())
+
+    def memory_bytes(self):
+        return sum(sys.getsizeof(d) for d in (self._touched, self._fingerprints, self._parked))
+
+
+def sweep_stale_sessions(root=SESSIONS_DIR, max_age_days=STALE_SESSION_DAYS):
+    """Delete spill directories of sessions that have been gone for a while"""
+    root = Path(root)
+    if not root.exists():
+        return 0
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    for path in root.iterdir():
+        if path.is_dir() and path.stat().st_mtime < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def maybe_sweep_stale_sessions(interval=SWEEP_SECONDS):
+    """Sweep stale spill directories if the last sweep is older than interval (cheap otherwise)"""
+    global _next_sweep
+    with _sweep_lock:
+        now = time.monotonic()
+        if now < _next_sweep:
+            return None
+        _next_sweep = now + interval
+    # Outside the lock: concurrent reruns skip instead of waiting for the disk walk
+    return sweep_stale_sessions()
@@ -0,0 +1,227 @@
+"""
+SOP catalog with sidecar metadata and an in-memory inverted index.
+
+Every SOP image may have a JSON sidecar with the same stem
+(SOP01.png -> SOP01.json):
+
+    {"title": "...", "tags": ["konsil"], "keywords": ["KISIM"], "version": "1.0"}
+
+All fields are optional; without a sidecar the title is "SOP <number>".
+
+Multi-page SOPs are either numbered page images (SOP02_p01.png,
+SOP02_p02.png, ...) or a multi-frame TIFF (SOP03.tif). Every entry lists
+its pages as (file, frame) pairs; pages are rendered one at a time, on
+demand, as downscaled WebP (a preview for reading, a small thumbnail for
+the page strip) and kept in a PageCache on disk, so each page is decoded
+at most once per source version.
+
+The catalog never decodes the images (multi-frame TIFFs are only opened
+to count their pages); it reads the sidecars and builds an
+inverted index (token -> SOP positions) once per tenant. A search
+intersects the postings of all query tokens (each token also matches as a
+prefix via a sorted vocabulary), so only the matching SOP images need to
+be loaded by the page.
+
+Search benchmark over 500 synthetic SOPs:
+    python -m triage.sops
+"""
+
+import bisect
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import unicodedata
+from pathlib import Path
+
+from triage.core import deep_sizeof
+
+SIDECAR_SUFFIX = ".json"
+SOP_FILE = re.compile(r"^SOP(?P<number>[^_.]+)(?:_p(?P<page>\d+))?\.(?P<ext>png|tiff?)$", re.IGNORECASE)
+SOP_SIZES = {"preview": 1200, "thumb": 160}  # max width in px per rendition
+FIELD_WEIGHTS = {"title": 3, "tags": 2, "keywords": 1, "filename": 1}
+TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text):
+    """Lowercase and strip accents, so "Patiënt" and "patient" match"""
+    text = unicodedata.normalize("NFKD", str(text).lower().replace("ß", "ss"))
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return TOKEN.findall(normalize(text))
+
+
+def read_sidecar(sidecar):
+    """Metadata of one SOP from its sidecar, {} if there is none or it is broken"""
+    try:
+        with open(sidecar, encoding="utf-8") as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+class SopCatalog:
+    """SOP entries of one data directory plus their search index"""
+
+    def __init__(self, data_dir):
+        data_dir = Path(data_dir)
+        groups = {}
+        for path in data_dir.iterdir():
+            # SOP number from the filename (e.g., SOP01.png -> 01, SOP02_p03.png -> 02)
+            match = SOP_FILE.match(path.name)
+            if match:
+                groups.setdefault(match["number"], []).append((int(match["page"] or 0), path))
+        self.entries = []
+        for number, files in groups.items():
+            pages = []
+            for _, path in sorted(files):
+                frames = frame_count(path) if path.suffix.lower() != ".png" else 1
+                pages += [(path.name, frame) for frame in range(frames)]
+            meta = read_sidecar(data_dir / f"SOP{number}{SIDECAR_SUFFIX}")
+            self.entries.append({
+                "filename": pages[0][0],
+                "pages": pages,
+                "number": number,
+                "title": meta.get("title") or f"SOP {number}",
+                "tags": list(meta.get("tags", [])),
+                "keywords": list(meta.get("keywords", [])),
+                "version": meta.get("version"),
+            })
+        self.entries.sort(key=lambda entry: entry["number"])
+        self._index = {}
+        for position, entry in enumerate(self.entries):
+            for field, weight in FIELD_WEIGHTS.items():
+                values = entry[field] if isinstance(entry[field], list) else [entry[field]]
+                for token in tokenize(" ".join(values)):
+                    postings = self._index.setdefault(token, {})
+                    postings[position] = max(postings.get(position, 0), weight)
+        self._vocabulary = sorted(self._index)
+        self._size = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def memory_bytes(self):
+        """Entries plus index (measured once, the catalog does not change)"""
+        if self._size is None:
+            self._size = deep_sizeof([self.entries, self._index, self._vocabulary])
+        return self._size
+
+    def _postings(self, token):
+        """{position: weight} of all index tokens starting with `token`"""
+        found = {}
+        start = bisect.bisect_left(self._vocabulary, token)
+        for word in self._vocabulary[start:]:
+            if not word.startswith(token):
+                break
+            for position, weight in self._index[word].items():
+                # An exact hit ranks above a prefix hit
+                score = weight * 2 if word == token else weight
+                found[position] = max(found.get(position, 0), score)
+        return found
+
+    def search(self, query):
+        """Entries matching every token of the query, best match first"""
+        tokens = tokenize(query)
+        if not tokens:
+            return list(self.entries)
+        scores = None
+        for token in tokens:
+            postings = self._postings(token)
+            if scores is None:
+                scores = postings
+            else:
+                scores = {p: scores[p] + s for p, s in postings.items() if p in scores}
+            if not scores:
+                return []
+        ranked = sorted(scores, key=lambda p: (-scores[p], self.entries[p]["number"]))
+        return [self.entries[p] for p in ranked]
+
+
+def frame_count(path):
+    """Number of frames of a (multi-frame) image; reads only the headers"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return getattr(image, "n_frames", 1)
+
+
+def render_page(path, frame=0, width=SOP_SIZES["preview"]):
+    """One page as WebP, downscaled to `width` (never upscaled)"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.seek(frame)
+        page = image.convert("RGBA")
+    if page.width > width:
+        page = page.resize((width, round(page.height * width / page.width)), Image.LANCZOS)
+    out = io.BytesIO()
+    page.save(out, "WEBP", quality=90 if width >= 600 else 75, method=6)
+    return out.getvalue()
+
+
+class PageCache:
+    """Rendered pages on disk, keyed by source name/size/mtime, frame and width"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.renders = 0
+
+    def path(self, source, frame, width):
+        stat = source.stat()
+        version = hashlib.sha1(f"{source.name}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+        return self.root / f"{source.stem}-{version}-{frame}-{width}.webp"
+
+    def get(self, source, frame, width):
+        source = Path(source)
+        cached = self.path(source, frame, width)
+        try:
+            return cached.read_bytes()
+        except FileNotFoundError:
+            pass
+        data = render_page(source, frame, width)
+        self.renders += 1
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cached.with_name(f".{cached.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, cached)  # other workers may render the same page
+        return data
+
+
+def _benchmark(n_sops=500, runs=200):
+    words = ["konsil", "delir", "suizidalitaet", "angehoerige", "palliativ", "kisim",
+             "sekretariat", "station", "ambulant", "notfall", "dolmetscher", "schmerz"]
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(n_sops):
+            (Path(tmp) / f"SOP{i:03d}.png").touch()
+            sidecar = {"title": f"{words[i % 12].title()} Ablauf {i}",
+                       "tags": [words[(i * 7) % 12]], "keywords": [words[(i * 5) % 12], f"k{i}"]}
+            (Path(tmp) / f"SOP{i:03d}.json").write_text(json.dumps(sidecar))
+        start = time.perf_counter()
+        catalog = SopCatalog(tmp)
+        build_ms = (time.perf_counter() - start) * 1000
+    timings = {}
+    for query in ("konsil", "kons", "delir ablauf", "k42", "nichts"):
+        start = time.perf_counter()
+        for _ in range(runs):
+            hits = catalog.search(query)
+        timings[query] = ((time.perf_counter() - start) / runs * 1000, len(hits))
+    return build_ms, timings
+
+
+if __name__ == "__main__":
+    build_ms, timings = _benchmark()
+    print(f"index 500 SOPs: {build_ms:.1f} ms")
+    for query, (ms, hits) in timings.items():
+        print(f"search {query!r}: {ms:.3f} ms, {hits} hits")
+    sys.exit(0)
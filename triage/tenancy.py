@@ -0,0 +1,269 @@
+"""
+Multi-team tenancy: one process serves several teams, each with its own data.
+
+The default team reads from data/ as before. Every other team lives in
+data/teams/<team>/ with the same layout (employees.csv, photos, SOP*.png)
+and is selected with the ?team=<team> URL parameter.
+
+Prebuilt assets (python -m triage_dashboard build-assets) are used where
+their manifest entry is still fresh; everything else is processed live.
+Photos and SOP pages are handed out as content-addressed static URLs
+(triage.assets.StaticImages), so only the URLs are cached here.
+
+Tenants are loaded on first access and kept in an LRU registry. When the
+estimated memory of all loaded tenants exceeds the cap, the least recently
+used ones are dropped; they are simply reloaded from disk on the next visit.
+The estimate includes the team's objects in the process-wide registries of
+triage.events, triage.quiz and triage.workflow (event store, quiz scheduler
+and results, workflow analytics); evicting a tenant flushes and closes them
+too. Tenants used within the last TRIAGE_TENANT_EVICT_GRACE_SECONDS (60)
+are kept, a rerun of that team may still be holding them. The estimate is
+only taken when a tenant was loaded, else at most every
+TRIAGE_TENANT_CAP_CHECK_SECONDS (30), never on every rerun.
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from triage.assets import BUILD_DIR, QUIZ_FILE, AssetManifest, StaticImages, mime_type, read_quiz_bank
+from triage.core import Roster, deep_sizeof, load_roster
+from triage.sops import SOP_SIZES, PageCache, SopCatalog
+
+DATA_DIR = Path("data")
+TEAMS_DIR = DATA_DIR / "teams"
+STATE_DIR = Path(os.environ.get("TRIAGE_STATE_DIR", DATA_DIR / "state"))
+DEFAULT_TEAM = "default"
+TEAM_PARAM = "team"
+TEAM_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+MEMORY_CAP_BYTES = int(os.environ.get("TRIAGE_TENANT_CACHE_MB", "200")) * 1024 * 1024
+EVICT_GRACE_SECONDS = int(os.environ.get("TRIAGE_TENANT_EVICT_GRACE_SECONDS", "60"))
+CAP_CHECK_SECONDS = int(os.environ.get("TRIAGE_TENANT_CAP_CHECK_SECONDS", "30"))
+# Modules with process-wide per-team objects, each offering
+# team_memory_bytes(team) and release_team(team)
+TEAM_STATE_MODULES = ("triage.events", "triage.quiz", "triage.workflow")
+
+PHOTO_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.PNG', '.JPG', '.JPEG']
+
+
+class UnknownTeamError(LookupError):
+    """Raised when a team key is invalid or has no data directory"""
+
+
+def team_data_dir(team):
+    """Return the data directory for a team key"""
+    if team == DEFAULT_TEAM:
+        return DATA_DIR
+    if not TEAM_PATTERN.match(team):
+        raise UnknownTeamError(team)
+    path = TEAMS_DIR / team
+    if not path.is_dir():
+        raise UnknownTeamError(team)
+    return path
+
+
+def team_state_modules():
+    """The state modules imported so far (the others cannot hold anything yet)"""
+    return [sys.modules[name] for name in TEAM_STATE_MODULES if name in sys.modules]
+
+
+def list_teams():
+    """All team keys that have a data directory"""
+    teams = [DEFAULT_TEAM]
+    if TEAMS_DIR.is_dir():
+        teams += sorted(p.name for p in TEAMS_DIR.iterdir()
+                        if p.is_dir() and TEAM_PATTERN.match(p.name))
+    return teams
+
+
+class Tenant:
+    """Lazily loaded roster, photos and SOPs of one team"""
+
+    def __init__(self, key, data_dir, assets=True):
+        self.key = key
+        self.data_dir = data_dir
+        self.assets = AssetManifest(BUILD_DIR / key if assets else None)
+        self.images = StaticImages()
+        rows = self.assets.load("roster", self.roster_source()) if self.roster_source() else None
+        if rows is not None:
+            self.roster, self.errors = Roster(rows), []
+        else:
+            self.roster, self.errors = load_roster(data_dir)
+        self._photos = {}
+        self._previews = {}
+        self._sop_catalog = None
+        self.page_cache = PageCache(STATE_DIR / "sop_pages" / key)  # renders stay on disk
+        self._quiz = None
+        self._quiz_bytes = 0
+        self._loaded_bytes = deep_sizeof(self.assets.entries)
+        if self.roster is not None:
+            self._loaded_bytes += self.roster.memory_bytes()
+        self.last_used = time.monotonic()
+
+    def roster_source(self):
+        """employees.csv, or employees.xlsx when there is no CSV"""
+        for name in ("employees.csv", "employees.xlsx"):
+            if (self.data_dir / name).exists():
+                return self.data_dir / name
+        return None
+
+    def photo_path(self, ma_code):
+        """Check if employee photo exists and return path or None"""
+        for extension in PHOTO_EXTENSIONS:
+            photo_path = self.data_dir / f"{ma_code}{extension}"
+            if photo_path.exists():
+                return photo_path
+        return None
+
+    def photo_uri(self, ma_code, kind="avatar"):
+        """URL of an employee photo ("avatar" or "mini"), None without photo"""
+        if (ma_code, kind) not in self._photos:
+            photo_path = self.photo_path(ma_code)
+            uri = None
+            if photo_path:
+                found = self.assets.read(f"{kind}:{ma_code}", photo_path)
+                data, mime = found or (photo_path.read_bytes(), mime_type(photo_path))
+                uri = self.images.url(data, mime)
+            self._photos[(ma_code, kind)] = uri
+        return self._photos[(ma_code, kind)]
+
+    def sop_catalog(self):
+        """Searchable SOP catalog (sidecar metadata only, images stay on disk)"""
+        if self._sop_catalog is None:
+            self._sop_catalog = SopCatalog(self.data_dir)
+        return self._sop_catalog
+
+    def sop_files(self):
+        """All SOP entries of the team, sorted by number"""
+        return self.sop_catalog().entries
+
+    def sop_page_uri(self, sop, page, kind="preview"):
+        """URL of one SOP page ("preview" or "thumb"), rendered on first use"""
+        filename, frame = sop["pages"][page]
+        key = (filename, frame, kind)
+        if key not in self._previews:
+            source = self.data_dir / filename
+            found = self.assets.read(f"{kind}:{filename}#{frame}", source)
+            if found is None:
+                try:
+                    found = (self.page_cache.get(source, frame, SOP_SIZES[kind]), "image/webp")
+                except FileNotFoundError:
+                    return None
+            self._previews[key] = self.images.url(*found)
+        return self._previews[key]
+
+    def quiz_source(self):
+        """The team's quiz_bank.json, else the shared one in data/"""
+        for path in (self.data_dir / QUIZ_FILE, DATA_DIR / QUIZ_FILE):
+            if path.exists():
+                return path
+        return None
+
+    def quiz_bank(self):
+        """Indexed quiz bank (levels, by_id, correct)"""
+        if self._quiz is None:
+            source = self.quiz_source()
+            if source is None:
+                self._quiz = {"levels": {}, "by_id": {}, "correct": {}}
+            else:
+                self._quiz = self.assets.load("quiz", source) or read_quiz_bank(source)
+            self._quiz_bytes = deep_sizeof(self._quiz)
+        return self._quiz
+
+    def sop_bytes(self, sop_file):
+        """Original SOP file for download (not cached, read per request)"""
+        try:
+            return (self.data_dir / sop_file).read_bytes()
+        except FileNotFoundError:
+            return b""
+
+    def workbooks(self):
+        """Summaries of the team's XLSX files (parsed once, then from snapshot)"""
+        from triage.workbooks import load_workbook
+        return [load_workbook(path).summary() for path in sorted(self.data_dir.glob("*.xlsx"))]
+
+    def memory_bytes(self):
+        """Rough estimate of the memory held by this tenant and its registry objects"""
+        size = self._loaded_bytes + self._quiz_bytes
+        if self._sop_catalog is not None:
+            size += self._sop_catalog.memory_bytes()
+        for cache in (self._photos, self._previews):
+            size += sum(sys.getsizeof(v) for v in list(cache.values()) if v)
+        for module in team_state_modules():
+            size += module.team_memory_bytes(self.key)
+        return size
+
+    def close(self):
+        """Flush and drop the team's objects in the process-wide registries"""
+        for module in team_state_modules():
+            module.release_team(self.key)
+
+
+class TenantRegistry:
+    """Thread-safe LRU of loaded tenants with a memory cap"""
+
+    def __init__(self, memory_cap=MEMORY_CAP_BYTES, grace_seconds=EVICT_GRACE_SECONDS,
+                 check_seconds=CAP_CHECK_SECONDS):
+        self.memory_cap = memory_cap
+        self.grace_seconds = grace_seconds
+        self.check_seconds = check_seconds
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_check = 0.0  # also reset by every load
+        self.loads = 0
+        self.evictions = 0
+        self.checks = 0
+
+    def get(self, team):
+        """Return the tenant for a team key, loading it on first use"""
+        with self._lock:
+            tenant = self._tenants.get(team)
+            if tenant is not None:
+                self._tenants.move_to_end(team)
+                tenant.last_used = time.monotonic()
+                return tenant
+        tenant = Tenant(team, team_data_dir(team))
+        with self._lock:
+            # Another session may have loaded it meanwhile; keep the first one
+            tenant = self._tenants.setdefault(team, tenant)
+            self._tenants.move_to_end(team)
+            self.loads += 1
+            self._next_check = 0.0
+        return tenant
+
+    def enforce_cap(self):
+        """Evict least recently used tenants until under the memory cap (cheap when not due)"""
+        with self._lock:
+            now = time.monotonic()
+            if len(self._tenants) < 2 or now < self._next_check:
+                return
+            self._next_check = now + self.check_seconds
+            self.checks += 1
+            size = self.memory_bytes()
+            for team, tenant in list(self._tenants.items())[:-1]:
+                if size <= self.memory_cap or now - tenant.last_used < self.grace_seconds:
+                    break  # LRU order: every later tenant was used even more recently
+                size -= tenant.memory_bytes()
+                del self._tenants[team]
+                # Under the lock, so a reload of the team cannot pick up the closing objects
+                tenant.close()
+                self.evictions += 1
+
+    def memory_bytes(self):
+        return sum(t.memory_bytes() for t in self._tenants.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": list(self._tenants),
+                "memory_bytes": self.memory_bytes(),
+                "memory_cap": self.memory_cap,
+                "evict_grace_s": self.grace_seconds,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "cap_checks": self.checks,
+            }
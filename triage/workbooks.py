@@ -0,0 +1,296 @@
+"""
+XLSX ingestion with cached binary snapshots.
+
+Workbooks are read once with a small stdlib reader (zipfile + ElementTree,
+cell values only; no openpyxl or pandas needed) and stored as a pickle
+snapshot under data/state/workbooks/, keyed by the resolved path of the
+source (every team has its own employees.xlsx) and its SHA-256. Loading a snapshot takes well under a millisecond; editing the
+workbook changes its hash and triggers one fresh parse. Each snapshot also
+records a schema hash of the reader, so a change to the parsing rules
+invalidates old snapshots instead of silently reusing them.
+
+The last few snapshots per workbook are kept, which is what `diff_tables`
+and `diff_previous` compare to show what changed between versions.
+
+Parse vs. snapshot timing for all workbooks in data/:
+    python -m triage.workbooks
+Diff two workbook files:
+    python -m triage.workbooks --diff old.xlsx new.xlsx
+"""
+
+import glob
+import hashlib
+import os
+import pickle
+import posixpath
+import re
+import sys
+import time
+import zipfile
+from pathlib import Path
+from xml.etree import ElementTree
+
+from triage.tenancy import STATE_DIR
+
+WORKBOOKS_DIR = STATE_DIR / "workbooks"
+KEEP_VERSIONS = int(os.environ.get("TRIAGE_WORKBOOK_VERSIONS", "5"))
+# Bump when the reader or the snapshot layout changes
+READER_VERSION = "1"
+SCHEMA_HASH = hashlib.sha256(
+    f"{READER_VERSION}:sheets{{name:{{columns,rows}}}}:media".encode()).hexdigest()[:16]
+
+NS = {
+    "m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+CELL_REF = re.compile(r"([A-Z]+)(\d+)")
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def column_index(letters):
+    index = 0
+    for char in letters:
+        index = index * 26 + ord(char) - 64
+    return index - 1
+
+
+def _text(element):
+    """Concatenated text of a string item, including rich-text runs"""
+    return "".join(t.text or "" for t in element.iter(f"{{{NS['m']}}}t"))
+
+
+def _number(value):
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+def _cell_value(cell, shared):
+    kind = cell.get("t", "n")
+    if kind == "inlineStr":
+        inline = cell.find("m:is", NS)
+        return _text(inline).strip() if inline is not None else None
+    raw = cell.find("m:v", NS)
+    if raw is None or raw.text is None:
+        return None
+    if kind == "s":
+        return shared[int(raw.text)]
+    if kind == "b":
+        return raw.text == "1"
+    if kind == "n":
+        return _number(raw.text)
+    return raw.text  # "str" (formula result) and "e" (error)
+
+
+def _sheet_paths(archive):
+    """(sheet name, zip member) in workbook order"""
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    targets = {rel.get("Id"): rel.get("Target") for rel in rels.findall("rel:Relationship", NS)}
+    sheets = []
+    for sheet in workbook.find("m:sheets", NS):
+        target = targets[sheet.get(f"{{{NS['r']}}}id")]
+        path = target.lstrip("/") if target.startswith("/") else posixpath.join("xl", target)
+        sheets.append((sheet.get("name"), posixpath.normpath(path)))
+    return sheets
+
+
+def _read_sheet(archive, member, shared):
+    rows = []
+    width = 0
+    for row in ElementTree.fromstring(archive.read(member)).iter(f"{{{NS['m']}}}row"):
+        values = {}
+        for cell in row.findall("m:c", NS):
+            value = _cell_value(cell, shared)
+            if value is not None and value != "":
+                values[column_index(CELL_REF.match(cell.get("r")).group(1))] = value
+        if values:
+            width = max(width, max(values) + 1)
+        rows.append(values)
+    return [tuple(values.get(i) for i in range(width)) for values in rows if values]
+
+
+def read_xlsx(path):
+    """Parse a workbook into {sheet name: {"columns": [...], "rows": [tuple, ...]}}.
+
+    The first non-empty row is taken as the header; unnamed columns are
+    called col_<n>. Embedded images are only counted (under "media").
+    """
+    with zipfile.ZipFile(path) as archive:
+        shared = []
+        if "xl/sharedStrings.xml" in archive.namelist():
+            root = ElementTree.fromstring(archive.read("xl/sharedStrings.xml"))
+            shared = [_text(item).strip() for item in root.findall("m:si", NS)]
+        sheets = {}
+        for name, member in _sheet_paths(archive):
+            rows = _read_sheet(archive, member, shared)
+            header = rows[0] if rows else ()
+            columns = [str(c) if c is not None else f"col_{i}" for i, c in enumerate(header)]
+            sheets[name] = {"columns": columns, "rows": rows[1:]}
+        media = sum(1 for n in archive.namelist() if n.startswith("xl/media/"))
+    return {"sheets": sheets, "media": media}
+
+
+class Workbook:
+    """Parsed workbook contents plus the hashes it was built from"""
+
+    def __init__(self, path, source_hash, data, from_snapshot, load_ms):
+        self.path = Path(path)
+        self.source_hash = source_hash
+        self.sheets = data["sheets"]
+        self.media = data["media"]
+        self.from_snapshot = from_snapshot
+        self.load_ms = load_ms
+
+    def sheet(self, name=None):
+        """A sheet by name, the first one by default"""
+        return self.sheets[name] if name else next(iter(self.sheets.values()))
+
+    def records(self, name=None):
+        """Rows of a sheet as dicts keyed by the header row"""
+        sheet = self.sheet(name)
+        return [dict(zip(sheet["columns"], row)) for row in sheet["rows"]]
+
+    def summary(self):
+        return {
+            "file": self.path.name,
+            "hash": self.source_hash[:12],
+            "sheets": {name: len(sheet["rows"]) for name, sheet in self.sheets.items()},
+            "media": self.media,
+            "from_snapshot": self.from_snapshot,
+            "load_ms": round(self.load_ms, 2),
+        }
+
+
+def _versions_prefix(path):
+    """Snapshot name prefix of one source file (same file name in another team differs)"""
+    location = hashlib.sha256(str(Path(path).resolve()).encode()).hexdigest()[:8]
+    return f"{Path(path).name}-{location}"
+
+
+def _versions(path, root):
+    """All snapshots of one source file, newest first"""
+    return sorted(Path(root).glob(f"{glob.escape(_versions_prefix(path))}-*.pkl"),
+                  key=lambda p: p.stat().st_mtime, reverse=True)
+
+
+def snapshot_path(path, source_hash, root=WORKBOOKS_DIR):
+    return Path(root) / f"{_versions_prefix(path)}-{source_hash[:16]}.pkl"
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, "rb") as fh:
+            snapshot = pickle.load(fh)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    return snapshot if snapshot.get("schema") == SCHEMA_HASH else None
+
+
+def _prune(path, root, keep):
+    for old in _versions(path, root)[keep:]:
+        old.unlink(missing_ok=True)
+
+
+def load_workbook(path, root=WORKBOOKS_DIR, keep=KEEP_VERSIONS):
+    """Workbook from its snapshot, parsing the XLSX only when its hash is new"""
+    start = time.perf_counter()
+    source_hash = file_hash(path)
+    cached = snapshot_path(path, source_hash, root)
+    snapshot = _read_snapshot(cached) if cached.exists() else None
+    if snapshot is not None:
+        return Workbook(path, source_hash, snapshot["data"], True,
+                        (time.perf_counter() - start) * 1000)
+    data = read_xlsx(path)
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cached.with_suffix(f".{os.getpid()}.tmp")  # other workers may parse the same file
+    with open(tmp, "wb") as fh:
+        pickle.dump({"schema": SCHEMA_HASH, "source_hash": source_hash, "source": str(path),
+                     "data": data}, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, cached)
+    _prune(path, root, keep)
+    return Workbook(path, source_hash, data, False, (time.perf_counter() - start) * 1000)
+
+
+def previous_version(path, root=WORKBOOKS_DIR):
+    """Newest snapshot of the same workbook with a different content hash"""
+    current = snapshot_path(path, file_hash(path), root)
+    for candidate in _versions(path, root):
+        if candidate != current:
+            snapshot = _read_snapshot(candidate)
+            if snapshot is not None:
+                return Workbook(snapshot["source"], snapshot["source_hash"], snapshot["data"], True, 0.0)
+    return None
+
+
+def diff_tables(old, new, key=None):
+    """What changed between two versions of a sheet.
+
+    Rows are matched on `key` (default: the first column). Returns a dict
+    with added/removed columns, added/removed row keys and, per changed
+    row, {column: (old, new)}.
+    """
+    key = key or (new["columns"][0] if new["columns"] else None)
+    old_rows = {r[key]: r for r in (dict(zip(old["columns"], row)) for row in old["rows"])}
+    new_rows = {r[key]: r for r in (dict(zip(new["columns"], row)) for row in new["rows"])}
+    changed = {}
+    for row_key in old_rows.keys() & new_rows.keys():
+        before, after = old_rows[row_key], new_rows[row_key]
+        cells = {c: (before.get(c), after.get(c)) for c in before.keys() | after.keys()
+                 if before.get(c) != after.get(c)}
+        if cells:
+            changed[row_key] = cells
+    return {
+        "columns_added": [c for c in new["columns"] if c not in old["columns"]],
+        "columns_removed": [c for c in old["columns"] if c not in new["columns"]],
+        "rows_added": [k for k in new_rows if k not in old_rows],
+        "rows_removed": [k for k in old_rows if k not in new_rows],
+        "rows_changed": changed,
+    }
+
+
+def diff_workbooks(old, new):
+    """diff_tables for every sheet, plus sheets that were added or removed"""
+    return {
+        "sheets_added": [s for s in new.sheets if s not in old.sheets],
+        "sheets_removed": [s for s in old.sheets if s not in new.sheets],
+        "sheets": {name: diff_tables(old.sheets[name], new.sheets[name])
+                   for name in new.sheets if name in old.sheets},
+    }
+
+
+def diff_previous(path, root=WORKBOOKS_DIR):
+    """Diff of the current workbook against its previous snapshot (or None)"""
+    current = load_workbook(path, root)
+    previous = previous_version(path, root)
+    return diff_workbooks(previous, current) if previous else None
+
+
+def _benchmark(data_dir="data", runs=20):
+    for path in sorted(Path(data_dir).glob("*.xlsx")):
+        start = time.perf_counter()
+        read_xlsx(path)
+        parse_ms = (time.perf_counter() - start) * 1000
+        load_workbook(path)
+        timings = []
+        for _ in range(runs):
+            timings.append(load_workbook(path).load_ms)
+        print(f"{path.name}: parse {parse_ms:.2f} ms, snapshot {min(timings):.2f} ms")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--diff"] and len(sys.argv) == 4:
+        import json
+
+        old, new = (Workbook(p, file_hash(p), read_xlsx(p), False, 0.0) for p in sys.argv[2:4])
+        print(json.dumps(diff_workbooks(old, new), ensure_ascii=False, indent=2, default=str))
+    else:
+        _benchmark()
+    sys.exit(0)
@@ -0,0 +1,119 @@
+"""
+Run several dashboard worker processes on one host.
+
+A single Streamlit process executes every session's reruns on one core.
+This starts N `streamlit run triage_dashboard.py` processes on consecutive
+ports with TRIAGE_SHARED_STATE=1, so they share the event logs under
+data/state/ (file lock + catch-up, see triage.events) and every worker
+recommends the same next MA. Put a local reverse proxy in front that keeps
+a browser on one worker, Streamlit's websocket session lives in the
+process that opened it:
+
+    upstream triage {
+        ip_hash;
+        server 127.0.0.1:8501;
+        server 127.0.0.1:8502;
+    }
+    server {
+        listen 80;
+        location / {
+            proxy_pass http://triage;
+            proxy_http_version 1.1;
+            proxy_set_header Upgrade $http_upgrade;
+            proxy_set_header Connection "upgrade";
+            proxy_read_timeout 86400;
+        }
+    }
+
+    python -m triage.workers --workers 4 [--base-port 8501]
+
+Throughput against the number of workers:
+    python -m triage.loadtest --workers 1,2,4 --sessions 100 --no-think
+"""
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+APP = Path(__file__).resolve().parent.parent / "triage_dashboard.py"
+DEFAULT_WORKERS = int(os.environ.get("TRIAGE_WORKERS", str(os.cpu_count() or 1)))
+DEFAULT_BASE_PORT = 8501
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, env=None, quiet=True):
+    """Start one dashboard process and wait until it answers the health check"""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", str(APP), "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        cwd=APP.parent, env=dict(os.environ, **(env or {})),
+        stdout=subprocess.DEVNULL if quiet else None, stderr=subprocess.DEVNULL if quiet else None)
+    for _ in range(300):
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1):
+                return server
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("streamlit server exited during startup")
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("streamlit server did not become healthy")
+
+
+def start_workers(ports, env=None, quiet=True):
+    """One shared-state dashboard process per port"""
+    env = dict(env or {}, TRIAGE_SHARED_STATE="1")
+    servers = []
+    try:
+        for port in ports:
+            servers.append(start_server(port, env, quiet))
+    except Exception:
+        stop_workers(servers)
+        raise
+    return servers
+
+
+def stop_workers(servers, timeout=10):
+    for server in servers:
+        server.terminate()
+    for server in servers:
+        try:
+            server.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="run dashboard workers with shared triage state")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--base-port", type=int, default=DEFAULT_BASE_PORT)
+    args = parser.parse_args(argv)
+
+    ports = [args.base_port + i for i in range(args.workers)]
+    servers = start_workers(ports, quiet=False)
+    print(f"{len(servers)} workers with shared state on ports {ports[0]}-{ports[-1]}", flush=True)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while all(server.poll() is None for server in servers):
+            time.sleep(1)
+        print("a worker exited, stopping the others", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        stop_workers(servers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
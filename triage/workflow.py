@@ -0,0 +1,252 @@
+"""
+Time-in-step analytics for the Konsil workflow (interactive flowchart).
+
+Every step a user clicks is recorded as a transition from the previous
+step of the same workflow, with the seconds that passed in between; when
+a workflow reaches one of its end points (abglehnt, vor Ort erledigt,
+Termin mit Team, Patient agrüeft) its total duration is recorded too.
+
+Transitions are folded into running per-edge aggregates ("eintrag_erstellt>
+patient_erreichbar": count, total and maximum seconds plus a histogram
+over fixed log-scale buckets), an O(1) update per transition. Medians and
+p90 are read from the histograms, so the bottleneck report costs the
+same for ten or ten thousand finished workflows. The transitions go to
+data/state/workflows/<team>/transitions.jsonl via an AggregateLog
+(triage.persist) with periodic snapshots of the aggregates.
+
+Benchmark over thousands of simulated workflows:
+    python -m triage.workflow
+"""
+
+import atexit
+import bisect
+import datetime
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from triage.persist import AggregateLog
+from triage.tenancy import STATE_DIR
+
+WORKFLOW_STATE_DIR = STATE_DIR / "workflows"
+SNAPSHOT_EVERY = int(os.environ.get("TRIAGE_WORKFLOW_SNAPSHOT_EVERY", "500"))
+# Upper bounds (seconds) of the histogram buckets, the last bucket is open
+BUCKETS = (60, 300, 900, 1800, 3600, 4 * 3600, 8 * 3600, 86400, 2 * 86400, 7 * 86400)
+BUCKET_LABELS = ("< 1 min", "1–5 min", "5–15 min", "15–30 min", "30–60 min", "1–4 h", "4–8 h",
+                 "8–24 h", "1–2 Täg", "2–7 Täg", "> 1 Wuche")
+STEP_LABELS = {
+    "start": "Start",
+    "konsil_angenommen": "Entscheidig agnoh/abglehnt",
+    "vor_ort_abgeschlossen": "Vor Ort abgschlosse?",
+    "eintrag_erstellt": "Iitrag erstellt",
+    "patient_erreichbar": "Patient erreichbar?",
+    "datum_eingetragen": "Datum iitreit",
+    "team_benachrichtigt": "Team benachrichtigt",
+    "sekretariat_benachrichtigt": "Sekretariat benachrichtigt",
+    "patient_angerufen": "Patient agrüeft",
+}
+# (step, value) -> outcome: the workflow ends there
+OUTCOMES = {
+    ("konsil_angenommen", False): "abglehnt",
+    ("vor_ort_abgeschlossen", True): "vor Ort erledigt",
+    ("team_benachrichtigt", True): "Termin mit Team",
+    ("patient_angerufen", True): "Patient agrüeft",
+}
+TOTAL = "total"
+
+
+def bucket(seconds):
+    return bisect.bisect_left(BUCKETS, seconds)
+
+
+def format_duration(seconds):
+    if seconds < 90:
+        return f"{seconds:.0f} s"
+    if seconds < 5400:
+        return f"{seconds / 60:.0f} min"
+    if seconds < 2 * 86400:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 86400:.1f} Täg"
+
+
+def edge_label(edge):
+    source, _, target = edge.partition(">")
+    return f"{STEP_LABELS.get(source, source)} → {STEP_LABELS.get(target, target)}"
+
+
+def histogram_percentile(histogram, q):
+    """Label of the bucket holding the q-quantile"""
+    target = q * sum(histogram)
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if count and seen >= target:
+            return BUCKET_LABELS[index]
+    return "–"
+
+
+class WorkflowAnalytics(AggregateLog):
+    """Per-edge duration aggregates of one team's workflows"""
+
+    def __init__(self, root, snapshot_every=SNAPSHOT_EVERY):
+        self.edges = {}  # "from>to" or TOTAL -> [count, total s, max s, histogram]
+        self.outcomes = {}
+        super().__init__(root, "transitions.jsonl", "aggregates.json", snapshot_every)
+
+    def fold(self, record):
+        self._add(f"{record['from']}>{record['to']}", record["seconds"])
+        if record.get("outcome"):
+            self.outcomes[record["outcome"]] = self.outcomes.get(record["outcome"], 0) + 1
+            self._add(TOTAL, record["total_seconds"])
+
+    def _add(self, key, seconds):
+        aggregate = self.edges.get(key)
+        if aggregate is None:
+            aggregate = self.edges[key] = [0, 0.0, 0.0, [0] * (len(BUCKETS) + 1)]
+        aggregate[0] += 1
+        aggregate[1] += seconds
+        aggregate[2] = max(aggregate[2], seconds)
+        aggregate[3][bucket(seconds)] += 1
+
+    def totals(self):
+        return {"edges": self.edges, "outcomes": self.outcomes}
+
+    def restore(self, totals):
+        self.edges = totals["edges"]
+        self.outcomes = totals["outcomes"]
+
+    def transition(self, workflow, source, target, value, seconds, total_seconds):
+        """Record one step click `seconds` after the previous step of `workflow`
+        (`total_seconds` after its start); returns the outcome if it ended there"""
+        record = {"ts": datetime.datetime.now().isoformat(timespec="seconds"), "wf": workflow,
+                  "from": source, "to": target, "value": value, "seconds": round(seconds, 1)}
+        outcome = OUTCOMES.get((target, value))
+        if outcome:
+            record["outcome"] = outcome
+            record["total_seconds"] = round(total_seconds, 1)
+        self.append(record)
+        return outcome
+
+    def summary(self):
+        """Finished workflows: count per outcome, mean and median total duration"""
+        self.refresh()  # appends of the other workers (shared state)
+        with self.lock:
+            outcomes = dict(self.outcomes)
+            count, total, _, histogram = self.edges.get(TOTAL, (0, 0.0, 0.0, []))
+            median = histogram_percentile(histogram, 0.5) if count else "–"
+        return {"completed": count, "outcomes": outcomes,
+                "mean": total / count if count else None, "p50": median}
+
+    def bottlenecks(self):
+        """Edges by total time spent in them, with mean, median, p90 and maximum"""
+        self.refresh()
+        with self.lock:
+            edges = [(key, list(aggregate[:3]), list(aggregate[3]))
+                     for key, aggregate in self.edges.items() if key != TOTAL]
+        spent = sum(total for _, (_, total, _), _ in edges) or 1
+        report = [{
+            "edge": key,
+            "count": count,
+            "mean": total / count,
+            "p50": histogram_percentile(histogram, 0.5),
+            "p90": histogram_percentile(histogram, 0.9),
+            "max": maximum,
+            "share": total / spent,
+        } for key, (count, total, maximum), histogram in edges]
+        report.sort(key=lambda row: row["share"], reverse=True)
+        return report
+
+    def histogram(self, key):
+        """[(bucket label, count)] of one edge (or TOTAL)"""
+        self.refresh()
+        with self.lock:
+            aggregate = self.edges.get(key)
+            counts = list(aggregate[3]) if aggregate else [0] * len(BUCKET_LABELS)
+        return list(zip(BUCKET_LABELS, counts))
+
+    def stats(self):
+        return {"completed": sum(self.outcomes.values()), "edges": len(self.edges),
+                "replayed_on_load": self.replayed, "skipped_lines": self.skipped,
+                "writer": self.writer.stats()}
+
+
+_analytics = {}
+_analytics_lock = threading.Lock()
+
+
+def open_analytics(team):
+    """Process-wide WorkflowAnalytics of a team"""
+    with _analytics_lock:
+        analytics = _analytics.get(team)
+        if analytics is None:
+            analytics = _analytics[team] = WorkflowAnalytics(WORKFLOW_STATE_DIR / team)
+            atexit.register(analytics.close)  # flush queued transitions on shutdown
+        return analytics
+
+
+def team_memory_bytes(team):
+    """Memory of the team's open WorkflowAnalytics (0 if none is open)"""
+    with _analytics_lock:
+        analytics = _analytics.get(team)
+    return analytics.memory_bytes() if analytics else 0
+
+
+def release_team(team):
+    """Flush and drop the team's WorkflowAnalytics; open_analytics() reloads it"""
+    with _analytics_lock:
+        analytics = _analytics.pop(team, None)
+    if analytics is not None:
+        atexit.unregister(analytics.close)
+        analytics.close()
+
+
+def _simulate(analytics, workflows, rng):
+    """Random walks through the flowchart with log-normal waiting times"""
+    for n in range(workflows):
+        path = [("start", True), ("konsil_angenommen", rng.random() < 0.9)]
+        if path[-1][1]:
+            path.append(("vor_ort_abgeschlossen", rng.random() < 0.4))
+            if not path[-1][1]:
+                path += [("eintrag_erstellt", True), ("patient_erreichbar", rng.random() < 0.7)]
+                if path[-1][1]:
+                    path += [("datum_eingetragen", True), ("team_benachrichtigt", True)]
+                else:
+                    path += [("sekretariat_benachrichtigt", True), ("patient_angerufen", True)]
+        total = 0.0
+        for (source, _), (target, value) in zip(path, path[1:]):
+            # Waiting for a date is the slow part of the real workflow
+            seconds = rng.lognormvariate(10 if target == "datum_eingetragen" else 6, 1)
+            total += seconds
+            analytics.transition(f"wf{n}", source, target, value, seconds, total)
+
+
+def _benchmark(workflows=5000, seed=0):
+    with tempfile.TemporaryDirectory() as tmp:
+        analytics = WorkflowAnalytics(tmp)
+        start = time.perf_counter()
+        _simulate(analytics, workflows, random.Random(seed))
+        record_us = (time.perf_counter() - start) / sum(a[0] for a in analytics.edges.values()) * 1e6
+        start = time.perf_counter()
+        report = analytics.bottlenecks()
+        report_ms = (time.perf_counter() - start) * 1000
+        analytics.close()
+        start = time.perf_counter()
+        reloaded = WorkflowAnalytics(tmp)
+        reload_ms = (time.perf_counter() - start) * 1000
+        if reloaded.edges != analytics.edges:
+            raise AssertionError("reloaded aggregates differ")
+        reloaded.close()
+    return record_us, report_ms, reload_ms, report
+
+
+if __name__ == "__main__":
+    record_us, report_ms, reload_ms, report = _benchmark()
+    print(f"5000 workflows: {record_us:.1f} us per transition, report {report_ms:.2f} ms, "
+          f"reload {reload_ms:.1f} ms")
+    for row in report[:3]:
+        print(f"  {edge_label(row['edge'])}: n={row['count']}, median {row['p50']}, "
+              f"p90 {row['p90']}, {row['share']:.0%} of the waiting time")
+    sys.exit(0)
@@ -1,7 +1,7 @@
 """
 Streamlit app for psycho-oncology triage dashboard (Triagist view).
 Author: Jan Schulze & AI assistant
-Dependencies: streamlit, pandas
+Dependencies: streamlit (pandas only for the log/overview tables)
 Place employees.csv in the data directory with columns: 
     kuerzel,name,anstellungs_prozent,stationaer_anteil,verfuegbar
 
@@ -15,17 +15,51 @@ Manual attendance table allows marking AM/PM presence.
 """
 
 import datetime
-import pandas as pd
+import os
+import sys
+import time
+import uuid
+
 import streamlit as st
-import json
-import base64
-from pathlib import Path
+import streamlit.components.v1 as components
+
+from triage.archive import read_index
+from triage.assets import mime_type
+from triage.core import OVERVIEW_COLUMNS, assign_batch, daily_load, rotation_queue
+from triage.events import open_store
+from triage.fairness import ledger_inputs
+from triage.fonts import font_face_css
+from triage.notify import get_dispatcher, notify
+from triage.profiler import PROFILE_PARAM, RerunProfiler, profiling_enabled, recent_captures, self_time
+from triage.quiz import open_results, open_scheduler
+from triage.session_store import SessionStateManager, maybe_sweep_stale_sessions
+from triage.tenancy import DEFAULT_TEAM, TEAM_PARAM, TenantRegistry, UnknownTeamError, list_teams
+from triage.workflow import edge_label, format_duration, open_analytics
+
+# python -m triage_dashboard build-assets [team ...]: precompile data/ and exit
+if __name__ == "__main__" and sys.argv[1:2] == ["build-assets"]:
+    from triage.assets import main
+    sys.exit(main(sys.argv[2:]))
+# python -m triage_dashboard compact [team ...]: archive old event segments and exit
+if __name__ == "__main__" and sys.argv[1:2] == ["compact"]:
+    from triage.archive import main
+    sys.exit(main(sys.argv[2:]))
 
 # ---------- CONFIGURATION ----------
 PRIMARY = "#000000"
 ACCENT = "#CCFF00"
 SECONDARY = "#39FF14"
 TERTIARY = "#FFFF00"
+LOG_VIEW_ROWS = 50
+DIAGNOSTICS_PARAM = "diag"
+SOP_RESULTS = 10
+PROFILE_CAPTURES = 10
+VIEW_PARAM = "view"
+QUIZ_USER_PARAM = "user"
+NO_QUIZ_USER = "—"
+WALLBOARD_VIEW = "wallboard"
+# The wallboard run waits for the next event; this often it yields to Streamlit
+WALLBOARD_HEARTBEAT_SECONDS = float(os.environ.get("TRIAGE_WALLBOARD_HEARTBEAT_S", "5"))
 
 # ---------- SCHWEIZER DEUTSCH ----------
 TEXTS = {
@@ -49,7 +83,16 @@ TEXTS = {
     "weather_rainy": "Räge",
     "weather_stormy": "Gwitter",
     "weather_cloudy": "Bewölkt",
-    "weather_mixed": "Wächselhaft"
+    "weather_mixed": "Wächselhaft",
+    "batch": "Batch-Zueteilig",
+    "batch_help": "Mehreri Konsil (z.B. Morgerunde) i eim Schritt verteile",
+    "batch_submit": "Batch zueteile",
+    "command_duplicate": "Scho erledigt – de Klick isch nur eimal zählt worde.",
+    "command_stale": "D'Warteschlange het sich inzwüsche gänderet – bitte nomal prüefe.",
+    "inpatient": "Stationär",
+    "outpatient": "Ambulant",
+    "unspecified": "Ohni Angab",
+    "setting": "Setting",
 }
 
 # ---------- PAGE CONFIG ----------
@@ -60,11 +103,19 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# ---------- PROFILER (TRIAGE_PROFILE=1 or ?profile=1) ----------
+if profiling_enabled(st.query_params.get(PROFILE_PARAM)):
+    # A run that ended in st.rerun()/st.stop() never reached the end; close it here
+    unfinished = st.session_state.pop("rerun_profiler", None)
+    if unfinished is not None:
+        unfinished.stop("interrupted")
+    st.session_state.rerun_profiler = RerunProfiler(__file__).start()
+
 # ---------- CYBERPUNK STYLING ----------
 st.markdown(
     f"""
     <style>
-         @import url('https://fonts.googleapis.com/css2?family=Orbitron:wght@100;200;300;400;500;600;700;800;900&display=swap');
+         {font_face_css()}
          
          /* GLOBAL RESET */
          * {{
@@ -238,147 +289,15 @@ st.markdown(
              }}
          }}
          
-         /* WEATHER EFFECTS */
-         .weather-container {{
+         /* WEATHER EFFECTS (drawn by the canvas component below) */
+         #weather-canvas {{
              position: fixed;
              top: 0;
              left: 0;
-             width: 100%;
-             height: 100%;
+             width: 100vw;
+             height: 100vh;
              pointer-events: none;
              z-index: 1;
-             overflow: hidden;
-         }}
-         
-         .rain {{
-             display: none;
-         }}
-         
-         .rain::before {{
-             content: '';
-             position: absolute;
-             top: 0;
-             left: 0;
-             width: 100%;
-             height: 100%;
-             background: linear-gradient(transparent, {ACCENT}20);
-             animation: rainFall 1s linear infinite;
-         }}
-         
-         @keyframes rainFall {{
-             0% {{ transform: translateY(-100vh); }}
-             100% {{ transform: translateY(100vh); }}
-         }}
-         
-         .lightning {{
-             display: none;
-             position: absolute;
-             width: 100%;
-             height: 100%;
-             opacity: 0;
-             animation: lightning 8s infinite;
-         }}
-         
-         .lightning::before {{
-             content: '';
-             position: absolute;
-             top: 10%;
-             left: 30%;
-             width: 3px;
-             height: 40%;
-             background: linear-gradient(to bottom, 
-                 {TERTIARY} 0%, 
-                 #ffffff 50%, 
-                 {ACCENT} 100%);
-             box-shadow: 0 0 20px {TERTIARY}, 0 0 40px {ACCENT};
-             animation: lightningBolt 0.1s ease-in-out;
-         }}
-         
-         .lightning::after {{
-             content: '';
-             position: absolute;
-             top: 20%;
-             right: 25%;
-             width: 2px;
-             height: 35%;
-             background: linear-gradient(to bottom, 
-                 {ACCENT} 0%, 
-                 #ffffff 30%, 
-                 {SECONDARY} 100%);
-             box-shadow: 0 0 15px {ACCENT}, 0 0 30px {SECONDARY};
-             animation: lightningBolt 0.15s ease-in-out 0.05s;
-         }}
-         
-         @keyframes lightning {{
-             0%, 95% {{ opacity: 0; }}
-             96%, 97% {{ opacity: 1; }}
-             98%, 100% {{ opacity: 0; }}
-         }}
-         
-         @keyframes lightningBolt {{
-             0% {{ opacity: 0; transform: scaleY(0); }}
-             50% {{ opacity: 1; transform: scaleY(1); }}
-             100% {{ opacity: 0; transform: scaleY(0); }}
-         }}
-         
-         .sunrays {{
-             display: none;
-             position: absolute;
-             top: 50%;
-             left: 50%;
-             width: 200px;
-             height: 200px;
-             background: radial-gradient(circle, {TERTIARY}20, transparent);
-             transform: translate(-50%, -50%);
-             animation: rotate 20s linear infinite;
-         }}
-         
-         @keyframes rotate {{
-             0% {{ transform: translate(-50%, -50%) rotate(0deg); }}
-             100% {{ transform: translate(-50%, -50%) rotate(360deg); }}
-         }}
-         
-         .clouds {{
-             display: none;
-         }}
-         
-         .clouds::before {{
-             content: '';
-             position: absolute;
-             top: 20%;
-             left: -10%;
-             width: 120%;
-             height: 30%;
-             background: linear-gradient(to right, transparent, {SECONDARY}10, transparent);
-             animation: cloudMove 30s linear infinite;
-         }}
-         
-         @keyframes cloudMove {{
-             0% {{ transform: translateX(-100%); }}
-             100% {{ transform: translateX(100%); }}
-         }}
-         
-         .weather-particles {{
-             position: absolute;
-             width: 100%;
-             height: 100%;
-         }}
-         
-         .raindrop {{
-             position: absolute;
-             background: linear-gradient(to bottom, transparent, {ACCENT}80);
-             animation: rainDrop 2s linear infinite;
-         }}
-         
-         @keyframes rainDrop {{
-             0% {{ 
-                 transform: translateY(-100vh) rotate(10deg);
-                 opacity: 1;
-             }}
-             100% {{ 
-                 transform: translateY(100vh) rotate(360deg);
-                 opacity: 0;
-             }}
          }}
          
          /* STREAMLIT ELEMENT STYLING */
@@ -506,53 +425,42 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
-# Add fixed header and weather container
+# Add fixed header
 st.markdown('''
 <div class="fixed-header">
     <div class="usz-logo">☂️ Regenschirm<br/>freund:innen</div>
 </div>
-<div class="weather-container">
-    <div class="clouds"></div>
-    <div class="rain"></div>
-    <div class="lightning"></div>
-    <div class="sunrays"></div>
-    <div class="weather-particles"></div>
-</div>
 ''', unsafe_allow_html=True)
 
-# ---------- HELPER FUNCTIONS ----------
-def get_employee_photo_path(ma_code):
-    """Check if employee photo exists and return path or None"""
-    data_dir = Path("data")
-    for extension in ['.png', '.jpg', '.jpeg', '.PNG', '.JPG', '.JPEG']:
-        photo_path = data_dir / f"{ma_code}{extension}"
-        if photo_path.exists():
-            return photo_path
-    return None
+# ---------- TEAM (TENANT) ----------
+@st.cache_resource
+def get_tenant_registry():
+    """Process-wide registry of lazily loaded teams"""
+    return TenantRegistry()
 
+tenant_registry = get_tenant_registry()
+team = st.query_params.get(TEAM_PARAM, DEFAULT_TEAM).lower()
+try:
+    tenant = tenant_registry.get(team)
+except UnknownTeamError:
+    st.error(f"❌ Team '{team}' nöd gfunde. Verfüegbar: {', '.join(list_teams())}")
+    st.stop()
+
+# ---------- HELPER FUNCTIONS ----------
 def display_employee_avatar(ma_code):
     """Display employee photo or fallback to MA code"""
-    photo_path = get_employee_photo_path(ma_code)
+    img_src = tenant.photo_uri(ma_code)
     
     # Get employee name if available
-    employee_name = ""
-    try:
-        employee_row = df_emp[df_emp["MA"] == ma_code]
-        if not employee_row.empty and 'name' in df_emp.columns:
-            employee_name = employee_row.iloc[0]['name']
-    except:
-        pass
+    employee = roster.get(ma_code)
+    employee_name = getattr(employee, "name", "") if employee else ""
     
-    if photo_path:
-        # Convert to base64 for embedding
-        with open(photo_path, "rb") as img_file:
-            img_data = base64.b64encode(img_file.read()).decode()
-        
+    if img_src:
         name_display = f"<div style='text-align: center; margin-top: 1rem; color: {SECONDARY}; font-weight: 300; text-shadow: 0 0 10px {SECONDARY};'>{employee_name}</div>" if employee_name else ""
         
         return f'''
         <div class="photo-container">
-            <img src="data:image/png;base64,{img_data}" 
+            <img src="{img_src}" 
                  class="employee-photo" 
                  alt="{ma_code}"
                  title="{ma_code}">
@@ -568,128 +476,329 @@ def display_employee_avatar(ma_code):
 
 def get_mini_employee_avatar(ma_code):
     """Get mini employee photo for priority list"""
-    photo_path = get_employee_photo_path(ma_code)
-    if photo_path:
-        with open(photo_path, "rb") as img_file:
-            img_data = base64.b64encode(img_file.read()).decode()
-        return f'<img src="data:image/png;base64,{img_data}" class="mini-employee-photo" alt="{ma_code}" title="{ma_code}">'
+    img_src = tenant.photo_uri(ma_code, "mini")
+    if img_src:
+        return f'<img src="{img_src}" class="mini-employee-photo" alt="{ma_code}" title="{ma_code}">'
     else:
         return ""
 
+def render_recommendation(next_ma):
+    """Heading plus avatar (or fallback) of the next person"""
+    st.markdown(f"<h2 class='tertiary'>{TEXTS['next_recommendation']}</h2>", unsafe_allow_html=True)
+
+    # Display employee photo or MA code with special effects
+    if next_ma != "—":
+        employee_avatar = display_employee_avatar(next_ma)
+        st.markdown(employee_avatar, unsafe_allow_html=True)
+        st.markdown(f"<h3 class='accent' style='text-align: center; margin: 1rem 0;'>Nächschti Person: <strong>{next_ma}</strong></h3>", unsafe_allow_html=True)
+    else:
+        st.markdown("<h1 class='accent' style='font-size: 4rem; text-align: center; margin: 1rem 0;'>Kei verfüegbari Persone</h1>", unsafe_allow_html=True)
+
+def render_priority_list(queue):
+    st.markdown(f"<h3 class='secondary'>{TEXTS['priority_list']}</h3>", unsafe_allow_html=True)
+    for idx, ma in enumerate(queue[:8], start=1):
+        mini_photo = get_mini_employee_avatar(ma)
+        if mini_photo:
+            st.markdown(f"""
+            <div class='priority-item-with-photo'>
+                {mini_photo}
+                <span>{idx}. <strong>{ma}</strong></span>
+            </div>
+            """, unsafe_allow_html=True)
+        else:
+            st.markdown(f"<div class='priority-item'>{idx}. <strong>{ma}</strong></div>", unsafe_allow_html=True)
+
 # ---------- LOAD DATA ----------
-EMP_FILE = Path("data/employees.csv")
-if not EMP_FILE.exists():
-    st.error("❌ data/employees.csv nöd gfunde – bitte Datei hinzuefüege.")
-    st.warning("⚠️ Demo-Modus: App startet ohni Mitarbeiterdaten. Upload de CSV für volli Funktionalität.")
-    # Create empty dataframe with required columns for demo mode
-    df_emp = pd.DataFrame({
-        "name": ["DEMO"],
-        "kuerzel": ["DEMO"], 
-        "anstellungs_prozent": [100],
-        "stationaer_anteil": [50],
-        "verfuegbar": [True]
-    })
-else:
-    try:
-        df_emp = pd.read_csv(EMP_FILE)
-    except Exception as e:
-        st.error(f"❌ Fehler bim Lade vo employees.csv: {e}")
-        st.warning("⚠️ Demo-Modus aktiviert")
-        df_emp = pd.DataFrame({
-            "name": ["DEMO"],
-            "kuerzel": ["DEMO"], 
-            "anstellungs_prozent": [100],
-            "stationaer_anteil": [50],
-            "verfuegbar": [True]
-        })
-# Use 'name' column as the MA identifier (contains the actual abbreviations like CA, BA, etc.)
-if 'name' in df_emp.columns:
-    df_emp["MA"] = df_emp["name"]
-elif 'kuerzel' in df_emp.columns:
-    df_emp["MA"] = df_emp["kuerzel"]
-else:
-    st.error("CSV-Datei muess entweder 'name' oder 'kuerzel' Spalte ha")
+for message in tenant.errors:
+    if message.startswith("⚠️"):
+        st.warning(message)
+    else:
+        st.error(message)
+if tenant.roster is None:
     st.stop()
+roster = tenant.roster
 
 # ---------- SESSION STATE ----------
-if "queue" not in st.session_state:
-    # Initialize queue sorted alphabetically
-    st.session_state.queue = df_emp["MA"].tolist()
-if "log" not in st.session_state:
-    st.session_state.log = []
+maybe_sweep_stale_sessions()
+if "state_manager" not in st.session_state:
+    st.session_state.state_manager = SessionStateManager()
+state_manager = st.session_state.state_manager
+
+# ---------- TRIAGE STATE (EVENT LOG) ----------
+# Queue, attendance and log are shared by all sessions of a team and derived
+# from its persisted event log; a restart replays only the last snapshot's tail
+store = open_store(team)
+store.refresh()  # events of the other worker processes (TRIAGE_SHARED_STATE)
+store.sync_roster(roster.ma_codes())
+# First run of the day: settle yesterday's fairness credits and seed today's queue
+store.open_day(ledger_inputs(roster))
+triage_state = store.state
+
+# ---------- WALLBOARD (?view=wallboard) ----------
+# Read-only team-room screen: recommendation and priority list only. The run
+# blocks until the event log moves on (or the day/period flips) and only then
+# reruns, so an idle board costs a sleeping thread and no redraws.
+if st.query_params.get(VIEW_PARAM) == WALLBOARD_VIEW:
+    def wallboard_period():
+        now = datetime.datetime.now()
+        return now.date(), "AM" if now.hour < 12 else "PM"
+
+    board_seq = triage_state.seq
+    board_period = wallboard_period()
+    # Status widget and toolbar would show the long-running run as "Running"
+    st.markdown("<style>[data-testid='stStatusWidget'], [data-testid='stToolbar'] "
+                "{ display: none; }</style>", unsafe_allow_html=True)
+    available = [row.MA for row in roster
+                 if triage_state.present(row.MA, board_period[1], bool(getattr(row, 'verfuegbar', True)))]
+    queue = rotation_queue(triage_state.queue, available)
+    render_recommendation(queue[0] if queue else "—")
+    st.markdown("---")
+    render_priority_list(queue)
+    team_label = f" · Team {team}" if team != DEFAULT_TEAM else ""
+    st.caption(f"Stand {datetime.datetime.now().strftime('%H:%M')}{team_label}")
+
+    rerun_profiler = st.session_state.pop("rerun_profiler", None)
+    if rerun_profiler is not None:
+        rerun_profiler.stop(f"{team}-wallboard")
+    heartbeat = st.empty()
+    while not store.wait_for_change(board_seq, WALLBOARD_HEARTBEAT_SECONDS):
+        if wallboard_period() != board_period:
+            break
+        # A tiny delta gives Streamlit the chance to end the run once the tab is closed
+        heartbeat.empty()
+    st.rerun()
+
+# Weather animation: one persistent canvas component with a single loop.
+# components.html keeps the same iframe across reruns as long as its markup
+# does not change, and the controller on the parent window makes sure that a
+# remounted iframe takes over the running loop instead of starting a second one.
+WEATHER_MAX_PARTICLES = 120
 
-# Add weather JavaScript (fixed version)
 weather_js = f"""
 <script>
-const t = {json.dumps(TEXTS)};
+(function() {{
+const host = window.parent;
+const doc = host.document;
+const MAX_PARTICLES = {WEATHER_MAX_PARTICLES};
+const COLORS = {{ accent: '{ACCENT}', secondary: '{SECONDARY}', tertiary: '{TERTIARY}' }};
 
 const weatherPatterns = [
-    {{ icon: '☀️', textKey: 'weather_sunny', duration: 8000, effects: ['sunrays'] }},
-    {{ icon: '🌧️', textKey: 'weather_rainy', duration: 12000, effects: ['rain', 'clouds'] }},
-    {{ icon: '⛈️', textKey: 'weather_stormy', duration: 6000, effects: ['rain', 'lightning', 'clouds'] }},
-    {{ icon: '☁️', textKey: 'weather_cloudy', duration: 10000, effects: ['clouds'] }},
-    {{ icon: '🌦️', textKey: 'weather_mixed', duration: 15000, effects: ['rain', 'sunrays', 'clouds'] }}
+    {{ textKey: 'weather_sunny', duration: 8000, effects: ['sunrays'], drops: 0 }},
+    {{ textKey: 'weather_rainy', duration: 12000, effects: ['rain', 'clouds'], drops: 1.0 }},
+    {{ textKey: 'weather_stormy', duration: 6000, effects: ['rain', 'lightning', 'clouds'], drops: 1.0 }},
+    {{ textKey: 'weather_cloudy', duration: 10000, effects: ['clouds'], drops: 0 }},
+    {{ textKey: 'weather_mixed', duration: 15000, effects: ['rain', 'sunrays', 'clouds'], drops: 0.5 }}
 ];
 
-let currentWeatherIndex = 0;
+// A remounted iframe stops the previous controller and reuses its canvas
+if (host.__regenschirmWeather) {{
+    host.__regenschirmWeather.stop();
+}}
 
-function updateWeather() {{
-    const weather = weatherPatterns[currentWeatherIndex];
-    const container = document.querySelector('.weather-container');
-    
-    if (container) {{
-        // Reset all effects
-        container.querySelectorAll('.rain, .lightning, .sunrays, .clouds').forEach(el => {{
-            el.style.display = 'none';
-        }});
-        
-        // Activate current weather effects
-        weather.effects.forEach(effect => {{
-            const element = container.querySelector('.' + effect);
-            if (element) {{
-                element.style.display = 'block';
+let canvas = doc.getElementById('weather-canvas');
+if (!canvas) {{
+    canvas = doc.createElement('canvas');
+    canvas.id = 'weather-canvas';
+    doc.body.appendChild(canvas);
+}}
+const ctx = canvas.getContext('2d');
+
+// Particle pool: fixed typed arrays, particles are recycled, never reallocated
+const px = new Float32Array(MAX_PARTICLES);
+const py = new Float32Array(MAX_PARTICLES);
+const pv = new Float32Array(MAX_PARTICLES);
+const pl = new Float32Array(MAX_PARTICLES);
+const pw = new Uint8Array(MAX_PARTICLES);  // stroke width 1-3 px, drawn as one path per width
+const WIDTHS = [1, 2, 3];
+
+let width = 0, height = 0;
+let frame = null;
+let lastTick = 0;
+let patternIndex = 0;
+let patternStart = 0;
+let flashUntil = 0;
+let lowPower = false;
+let battery = null;
+let stopped = false;
+
+const reducedMotion = host.matchMedia('(prefers-reduced-motion: reduce)');
+
+function resize() {{
+    width = canvas.width = host.innerWidth;
+    height = canvas.height = host.innerHeight;
+}}
+
+function resetParticle(i, anywhere) {{
+    px[i] = Math.random() * width;
+    py[i] = anywhere ? Math.random() * height : -Math.random() * height * 0.2;
+    pv[i] = (Math.random() * 0.6 + 0.4) * height / 1000;
+    pl[i] = Math.random() * 20 + 10;
+    pw[i] = WIDTHS[Math.floor(Math.random() * WIDTHS.length)];
+}}
+
+function seedParticles() {{
+    for (let i = 0; i < MAX_PARTICLES; i++) resetParticle(i, true);
+}}
+
+function draw(now, dt) {{
+    const weather = weatherPatterns[patternIndex];
+    ctx.clearRect(0, 0, width, height);
+
+    if (weather.effects.includes('sunrays')) {{
+        const angle = (now / 20000) * Math.PI * 2;
+        ctx.save();
+        ctx.translate(width / 2, height / 2);
+        ctx.rotate(angle);
+        const sun = ctx.createRadialGradient(0, 0, 0, 0, 0, 100);
+        sun.addColorStop(0, COLORS.tertiary + '20');
+        sun.addColorStop(1, 'transparent');
+        ctx.fillStyle = sun;
+        ctx.fillRect(-100, -100, 200, 200);
+        ctx.restore();
+    }}
+
+    if (weather.effects.includes('clouds')) {{
+        const offset = ((now % 30000) / 30000) * 2 - 1;
+        const band = ctx.createLinearGradient(0, 0, width, 0);
+        band.addColorStop(0, 'transparent');
+        band.addColorStop(0.5, COLORS.secondary + '10');
+        band.addColorStop(1, 'transparent');
+        ctx.fillStyle = band;
+        ctx.fillRect(offset * width, height * 0.2, width * 1.2, height * 0.3);
+    }}
+
+    if (weather.effects.includes('rain')) {{
+        const scale = lowPower ? 0.3 : 1.0;
+        const count = Math.floor(MAX_PARTICLES * weather.drops * scale);
+        for (let i = 0; i < count; i++) {{
+            py[i] += pv[i] * dt;
+            if (py[i] > height) resetParticle(i, false);
+        }}
+        // lineWidth applies to a whole path when it is stroked: one path per width
+        ctx.strokeStyle = COLORS.accent + '80';
+        for (const lineWidth of WIDTHS) {{
+            ctx.lineWidth = lineWidth;
+            ctx.beginPath();
+            for (let i = 0; i < count; i++) {{
+                if (pw[i] !== lineWidth) continue;
+                ctx.moveTo(px[i], py[i]);
+                ctx.lineTo(px[i] + 2, py[i] + pl[i]);
             }}
-        }});
-        
-        // Create dynamic raindrops for rain effects
-        if (weather.effects.includes('rain')) {{
-            createRaindrops();
+            ctx.stroke();
+        }}
+    }}
+
+    if (weather.effects.includes('lightning')) {{
+        if (now > flashUntil && Math.random() < dt / 8000) flashUntil = now + 120;
+        if (now < flashUntil) {{
+            ctx.fillStyle = COLORS.tertiary + '30';
+            ctx.fillRect(0, 0, width, height);
         }}
     }}
-    
-    currentWeatherIndex = (currentWeatherIndex + 1) % weatherPatterns.length;
-    setTimeout(updateWeather, weather.duration);
 }}
 
-function createRaindrops() {{
-    const particles = document.querySelector('.weather-particles');
-    if (!particles) return;
-    
-    // Clear existing raindrops
-    particles.innerHTML = '';
-    
-    for (let i = 0; i < 50; i++) {{
-        const drop = document.createElement('div');
-        drop.className = 'raindrop';
-        drop.style.left = Math.random() * 100 + '%';
-        drop.style.width = Math.random() * 3 + 1 + 'px';
-        drop.style.height = Math.random() * 20 + 10 + 'px';
-        drop.style.animationDuration = Math.random() * 2 + 1 + 's';
-        drop.style.animationDelay = Math.random() * 2 + 's';
-        particles.appendChild(drop);
+function advancePattern(now) {{
+    if (now - patternStart >= weatherPatterns[patternIndex].duration) {{
+        patternIndex = (patternIndex + 1) % weatherPatterns.length;
+        patternStart = now;
+    }}
+}}
+
+function tick(now) {{
+    frame = null;
+    const minInterval = lowPower ? 1000 / 15 : 1000 / 30;
+    const dt = Math.min(now - lastTick, 100);
+    if (dt >= minInterval) {{
+        lastTick = now;
+        advancePattern(now);
+        draw(now, dt);
+    }}
+    schedule();
+}}
+
+function animating() {{
+    return !reducedMotion.matches && doc.visibilityState === 'visible';
+}}
+
+function schedule() {{
+    if (frame === null && animating()) frame = host.requestAnimationFrame(tick);
+}}
+
+function pause() {{
+    if (frame !== null) {{
+        host.cancelAnimationFrame(frame);
+        frame = null;
+    }}
+}}
+
+function refresh() {{
+    if (animating()) {{
+        lastTick = host.performance.now();
+        schedule();
+    }} else {{
+        pause();
+        // Reduced motion: one static frame of the current weather, no loop
+        if (reducedMotion.matches) draw(host.performance.now(), 0);
     }}
 }}
 
-// Start weather simulation
-setTimeout(updateWeather, 1000);
+function onResize() {{
+    resize();
+    seedParticles();
+    refresh();
+}}
+
+function updatePower() {{
+    lowPower = !battery.charging && battery.level < 0.2;
+}}
+
+if (host.navigator.getBattery) {{
+    host.navigator.getBattery().then(manager => {{
+        if (stopped) return;  // remounted before the promise resolved
+        battery = manager;
+        updatePower();
+        battery.addEventListener('chargingchange', updatePower);
+        battery.addEventListener('levelchange', updatePower);
+    }}).catch(() => {{}});
+}}
+
+doc.addEventListener('visibilitychange', refresh);
+reducedMotion.addEventListener('change', refresh);
+host.addEventListener('resize', onResize);
+
+host.__regenschirmWeather = {{
+    stop() {{
+        stopped = true;
+        pause();
+        if (battery) {{
+            battery.removeEventListener('chargingchange', updatePower);
+            battery.removeEventListener('levelchange', updatePower);
+        }}
+        doc.removeEventListener('visibilitychange', refresh);
+        reducedMotion.removeEventListener('change', refresh);
+        host.removeEventListener('resize', onResize);
+    }}
+}};
+
+resize();
+seedParticles();
+patternStart = host.performance.now();
+refresh();
+}})();
 </script>
 """
 
-st.markdown(weather_js, unsafe_allow_html=True)
+components.html(weather_js, height=0)
 
 # ---------- HEADER ----------
 now = datetime.datetime.now()
-st.caption(f"{now.strftime('%A, %d %B %Y – %H:%M')}")
+team_label = f" · Team {team}" if team != DEFAULT_TEAM else ""
+st.caption(f"{now.strftime('%A, %d %B %Y – %H:%M')}{team_label}")
+
+def record_attendance(ma, period, key):
+    """Checkbox callback: persist an attendance toggle as an event"""
+    store.append({"type": "attendance", "ma": ma, "period": period,
+                  "present": st.session_state[key]})
 
 # ---------- MOBILE-OPTIMIZED ATTENDANCE INPUT ----------
 with st.expander(TEXTS["attendance_today"]):
@@ -702,275 +811,245 @@ with st.expander(TEXTS["attendance_today"]):
     cols[1].markdown(f"**{TEXTS['morning']}**")
     cols[2].markdown(f"**{TEXTS['afternoon']}**")
     
-    for i, row in df_emp.iterrows():
+    attendance = {}
+    for row in roster:
         c1, c2, c3 = st.columns([1,1,1])
         c1.write(row.MA)
-        key_am = f"{row.MA}_AM"
-        key_pm = f"{row.MA}_PM"
         # Use existing verfuegbar column as default if available
-        default_avail = row.get('verfuegbar', True) if 'verfuegbar' in df_emp.columns else True
-        avail_am = c2.checkbox(f"{row.MA} {TEXTS['morning']}", key=key_am, value=default_avail, label_visibility="collapsed")
-        avail_pm = c3.checkbox(f"{row.MA} {TEXTS['afternoon']}", key=key_pm, value=default_avail, label_visibility="collapsed")
-        # Convert boolean to string to avoid pandas dtype warning
-        df_emp.loc[i, "AM"] = str(avail_am)
-        df_emp.loc[i, "PM"] = str(avail_pm)
+        default_avail = bool(getattr(row, 'verfuegbar', True))
+        attendance[row.MA] = {}
+        for column, period, label in ((c2, "AM", TEXTS['morning']), (c3, "PM", TEXTS['afternoon'])):
+            key = f"{row.MA}_{period}"
+            present = triage_state.present(row.MA, period, default_avail)
+            # Show toggles made in other sessions as well
+            if st.session_state.get(key) != present:
+                st.session_state[key] = present
+            attendance[row.MA][period] = column.checkbox(
+                f"{row.MA} {label}", key=key, label_visibility="collapsed",
+                on_change=record_attendance, args=(row.MA, period, key))
     
     st.markdown('</div>', unsafe_allow_html=True)
 
 # ---------- PRIORITY CALC ----------
 current_period = "AM" if now.hour < 12 else "PM"
-available = df_emp[(df_emp[current_period] == "True")]
-# Simple round-robin: keep session queue and pop next available
-queue = [ma for ma in st.session_state.queue if ma in available.MA.values]
-if not queue:
-    queue = available.MA.tolist()
-    st.session_state.queue = queue  # reset
+available = [ma for ma in roster.ma_codes() if attendance[ma][current_period]]
+# Simple round-robin: team queue restricted to who is available right now
+queue = rotation_queue(triage_state.queue, available)
 
 next_ma = queue[0] if queue else "—"
 
 # ---------- DASHBOARD ----------
-st.markdown(f"<h2 class='tertiary'>{TEXTS['next_recommendation']}</h2>", unsafe_allow_html=True)
+render_recommendation(next_ma)
+
+col_go, col_next = st.columns(2)
+
+def submit_command(token, kind, ma, period):
+    """Button callback: run a GO/NO command once per rendered recommendation"""
+    event = {"type": kind, "ma": ma}
+    if kind == "go":
+        event["period"] = period
+    status, _ = store.execute(token, event)
+    if status == "applied" and kind == "go":
+        notify("go", team, f"Neus Konsil zueteilt a {ma} ({period})")
+    st.session_state.last_command = {"status": status, "type": kind, "ma": ma}
 
-# Display employee photo or MA code with special effects
+# Tokens are tied to the queue version this recommendation was rendered from,
+# so a double tap or a delayed rerun cannot assign or rotate twice; with the
+# session in it, a second tablet pressing GO on the same screen gets "stale"
+# (its consult still needs assigning) instead of "duplicate"
 if next_ma != "—":
-    employee_avatar = display_employee_avatar(next_ma)
-    st.markdown(employee_avatar, unsafe_allow_html=True)
-    st.markdown(f"<h3 class='accent' style='text-align: center; margin: 1rem 0;'>Nächschti Person: <strong>{next_ma}</strong></h3>", unsafe_allow_html=True)
+    command_subject = f"{next_ma}:{state_manager.session_id}"
+    col_go.button("GO", key="go", help="Fall zueteile", on_click=submit_command,
+                  args=(triage_state.command_token("go", command_subject), "go", next_ma, current_period))
+    col_next.button("NO", key="next", help="Nächschti Person", on_click=submit_command,
+                    args=(triage_state.command_token("skip", command_subject), "skip", next_ma,
+                          current_period))
 else:
-    st.markdown(f"<h1 class='accent' style='font-size: 4rem; text-align: center; margin: 1rem 0;'>Kei verfüegbari Persone</h1>", unsafe_allow_html=True)
+    col_go.button("GO", key="go", help="Fall zueteile", disabled=True)
+    col_next.button("NO", key="next", help="Nächschti Person", disabled=True)
 
-col_go, col_next = st.columns(2)
+last_command = st.session_state.pop("last_command", None)
+if last_command:
+    if last_command["status"] == "applied" and last_command["type"] == "go":
+        st.success(f"Fall zueteilt a: **{last_command['ma']}**")
+    elif last_command["status"] == "applied":
+        st.info(f"Übersprunge: **{last_command['ma']}**")
+    elif last_command["status"] == "duplicate":
+        st.info(TEXTS["command_duplicate"])
+    else:
+        st.warning(TEXTS["command_stale"])
+
+# ---------- BATCH ASSIGNMENT ----------
+BATCH_SETTINGS = {"stationaer": TEXTS["inpatient"], "ambulant": TEXTS["outpatient"], None: ""}
 
-go = col_go.button("GO", key="go", help="Fall zueteile")
-next_btn = col_next.button("NO", key="next", help="Nächschti Person")
+BATCH_MODES = {"round_robin": "Reihum (Prioritätelischte)", "matching": "Optimal (Setting, Station, Sprach, Uuslastig)"}
 
-if go and next_ma != "—":
-    # Log assignment
-    st.session_state.log.append({
-        "Zeit": now.strftime("%Y-%m-%d %H:%M"),
-        "MA": next_ma,
-        "Period": current_period,
+def commit_batch():
+    """Form callback: distribute all consults and log them as one transaction"""
+    counts = {setting: st.session_state.get(f"batch_n_{setting}", 0) for setting in BATCH_SETTINGS}
+    consults = [{"setting": setting, "ward": None, "language": None, "urgent": False}
+                for setting, n in counts.items() for _ in range(n)]
+    stamp = datetime.datetime.now()
+    rendered_queue = st.session_state.rendered_queue
+    if st.session_state.get("batch_mode") == BATCH_MODES["matching"]:
+        # NumPy is only needed here, keep it off the startup path
+        from triage.matching import match_consults, parse_consults
+        consults += parse_consults(st.session_state.get("batch_lines", ""))
+        load = daily_load(store.state.recent, stamp.strftime("%Y-%m-%d"))
+        assignments = match_consults(consults, roster, rendered_queue, load)
+    else:
+        assignments = assign_batch(rendered_queue, consults)
+    if not assignments:
+        return
+    batch_id = stamp.strftime("%Y%m%d-%H%M%S")
+    # One event for the whole batch: logged and rotated as a single transaction.
+    # A second submit of the same form is a no-op (same queue version token).
+    status, _ = store.execute(st.session_state.rendered_batch_token, {
+        "type": "batch",
+        "batch": batch_id,
+        "period": st.session_state.rendered_period,
+        "assignments": [{"ma": ma, "setting": BATCH_SETTINGS[consult["setting"]]}
+                        for consult, ma in assignments],
     })
-    # Move assigned person to end of queue
-    assigned_person = queue.pop(0)
-    queue.append(assigned_person)
-    st.session_state.queue = queue
-    st.success(f"Fall zueteilt a: **{next_ma}**")
-    st.rerun()
-elif next_btn:
-    # Skip to next person
-    if queue:
-        queue.append(queue.pop(0))
-        st.session_state.queue = queue
-        st.info(f"Übersprunge: **{next_ma}**")
-    st.rerun()
+    if status != "applied":
+        st.session_state.last_command = {"status": status, "type": "batch", "ma": ""}
+        return
+    st.session_state.last_batch = {"id": batch_id, "assignments": [ma for _, ma in assignments]}
+    notify("batch", team, f"Batch {batch_id}: {len(assignments)} Konsil zueteilt "
+                          f"({', '.join(sorted(set(ma for _, ma in assignments)))})")
+
+# The callback runs before the next script run, so it works on what was shown
+st.session_state.rendered_queue = list(queue)
+st.session_state.rendered_period = current_period
+# Per session: two tablets submitting different batches must not collide
+st.session_state.rendered_batch_token = triage_state.command_token("batch", state_manager.session_id)
+
+with st.expander(f"📦 {TEXTS['batch']}"):
+    st.caption(TEXTS["batch_help"])
+    # A form submits all counts together and the callback commits before the
+    # rerun, so a whole morning batch costs a single script run
+    with st.form("batch_form", clear_on_submit=True):
+        for column, (setting, label) in zip(st.columns(3), BATCH_SETTINGS.items()):
+            column.number_input(label or TEXTS["unspecified"], min_value=0, max_value=50,
+                                step=1, key=f"batch_n_{setting}")
+        st.radio("Verteilig", list(BATCH_MODES.values()), key="batch_mode", horizontal=True)
+        st.text_area("Konsil-Lischte (nur bi Optimal, eis pro Ziile)", key="batch_lines",
+                     placeholder="stationär, E3, fr, dringend\nambulant, it")
+        st.form_submit_button(TEXTS["batch_submit"], on_click=commit_batch)
+
+    last_batch = st.session_state.get("last_batch")
+    if last_batch:
+        st.success(f"Batch {last_batch['id']}: {len(last_batch['assignments'])} Konsil zueteilt")
+        per_ma = {}
+        for ma in last_batch["assignments"]:
+            per_ma[ma] = per_ma.get(ma, 0) + 1
+        st.markdown(" · ".join(f"**{ma}**: {count}" for ma, count in per_ma.items()))
 
 # ---------- PRIORITY LIST ----------
 st.markdown("---")
-st.markdown(f"<h3 class='secondary'>{TEXTS['priority_list']}</h3>", unsafe_allow_html=True)
-for idx, ma in enumerate(queue[:8], start=1):
-    mini_photo = get_mini_employee_avatar(ma)
-    if mini_photo:
-        st.markdown(f"""
-        <div class='priority-item-with-photo'>
-            {mini_photo}
-            <span>{idx}. <strong>{ma}</strong></span>
-        </div>
-        """, unsafe_allow_html=True)
-    else:
-        st.markdown(f"<div class='priority-item'>{idx}. <strong>{ma}</strong></div>", unsafe_allow_html=True)
+render_priority_list(queue)
 
 # ---------- LOG VIEW ----------
+# Tables are behind toggles: pandas is only imported once one is switched on
 with st.expander(TEXTS["assignment_log"]):
-    if st.session_state.log:
-        # Create translated column headers for the log
-        log_df = pd.DataFrame(st.session_state.log)
-        if not log_df.empty:
-            log_df = log_df.rename(columns={
-                "Zeit": TEXTS["time"],
-                "MA": TEXTS["ma"],
-                "Period": TEXTS["period"]
-            })
-        st.table(log_df)
+    if triage_state.assignments:
+        total = triage_state.assignments
+        if st.toggle(f"{TEXTS['assignment_log']} zeige ({total})", key="log_show"):
+            import pandas as pd
+            show_all = False
+            if total > LOG_VIEW_ROWS:
+                show_all = st.checkbox(f"Alli {total} Iiträg zeige", key="log_show_all")
+            # The state keeps a bounded tail in memory; the full history is read from disk
+            entries = store.full_log() if show_all else list(triage_state.recent)[-LOG_VIEW_ROWS:]
+            if show_all:
+                # Segments older than TRIAGE_HOT_DAYS only survive as daily totals
+                archived = read_index(store.root)
+                if archived["totals"]:
+                    st.caption(f"Archiviert ({archived['first_day']} – {archived['last_day']}): " + " · ".join(
+                        f"{ma} {count}" for ma, count in sorted(archived["totals"].items(), key=lambda item: -item[1])))
+            # Create translated column headers for the log
+            log_df = pd.DataFrame(entries)
+            if not log_df.empty:
+                log_df = log_df.rename(columns={
+                    "Zeit": TEXTS["time"],
+                    "MA": TEXTS["ma"],
+                    "Period": TEXTS["period"],
+                    "Setting": TEXTS["setting"],
+                })
+            st.table(log_df)
     else:
         st.info(TEXTS["no_assignments"])
 
 # ---------- EMPLOYEE INFO ----------
 with st.expander(TEXTS["employee_overview"]):
-    st.dataframe(df_emp[['MA', 'name', 'anstellungs_prozent', 'stationaer_anteil', 'verfuegbar']] if 'name' in df_emp.columns else df_emp) 
+    if st.toggle(f"{TEXTS['employee_overview']} zeige", key="employees_show"):
+        import pandas as pd
+        rows = roster.as_dicts(OVERVIEW_COLUMNS if 'name' in roster.columns else None)
+        for row in rows:
+            # Running fairness credit; the CSV score is only its opening balance
+            row["score"] = triage_state.credits.get(row["MA"], row.get("score"))
+        st.dataframe(pd.DataFrame(rows))
 
 # ---------- TAGESQUIZ ----------
 st.markdown("---")
 st.markdown(f"<h2 class='secondary' style='text-align: center; margin: 2rem 0;'>📚 Tagesquestions</h2>", unsafe_allow_html=True)
 
-# Quiz data
-QUIZ_DATA = {
-    "regenwurm": {
-        "title": "Regenwurm (liecht)",
-        "emoji": "🪱",
-        "questions": [
-            {
-                "id": 1,
-                "question": "Welches Akronym beschreibt ein verbreitetes 6-Stufen-Vorgehen zum Überbringen schlechter Nachrichten in der Onkologie?",
-                "options": ["a) SCORE", "b) SPIKES", "c) POPPI", "d) CARES"],
-                "correct": "b",
-                "answer": "b) SPIKES"
-            },
-            {
-                "id": 2,
-                "question": "Wofür steht die Abkürzung HADS, die in vielen onkologischen Studien eingesetzt wird?",
-                "options": ["a) Hospital Anxiety and Depression Scale", "b) Health Assessment of Distress Symptoms", "c) Holistic Adaptation & Development Survey", "d) Human Anxiety Diagnostic Score"],
-                "correct": "a",
-                "answer": "a) Hospital Anxiety and Depression Scale"
-            },
-            {
-                "id": 3,
-                "question": "In den meisten Untersuchungen berichten Patient*innen als häufigste Informationslücke:",
-                "options": ["a) Ernährungsempfehlungen", "b) Familiäres Coping", "c) Nebenwirkungen der Therapie", "d) Anfahrtsweg zur Klinik"],
-                "correct": "c",
-                "answer": "c) Nebenwirkungen der Therapie"
-            },
-            {
-                "id": 4,
-                "question": "Zu welchem Zweck wurde die EORTC QLQ-C30 entwickelt?",
-                "options": ["a) Erfassung von Arztzufriedenheit", "b) Erfassung der gesundheitsbezogenen Lebensqualität bei Krebs", "c) Bestimmung der Tumorgröße", "d) Screening kognitiver Defizite"],
-                "correct": "b",
-                "answer": "b) Erfassung der gesundheitsbezogenen Lebensqualität bei Krebs"
-            },
-            {
-                "id": 5,
-                "question": "Welcher Kommunikationsstil wird im Review am stärksten mit höherer Patientenzufriedenheit assoziiert?",
-                "options": ["a) Arztzentriert", "b) Belehrend", "c) Patientenzentriert", "d) Technikorientiert"],
-                "correct": "c",
-                "answer": "c) Patientenzentriert"
-            }
-        ]
-    },
-    "spatz": {
-        "title": "Spatz (mittel)",
-        "emoji": "🐦",
-        "questions": [
-            {
-                "id": 6,
-                "question": "Welche drei übergeordneten Bedarfs-Domänen identifizierte die Supportive-Care-Needs-Survey (SCNS) als am häufigsten unerfüllt?",
-                "options": ["a) Finanzen · Ernährung · Sport", "b) Psychologie · Information/Gesundheitssystem · Körper/Alltag", "c) Spiritualität · Sexualität · Pflege", "d) Freizeit · Familie · Schlaf"],
-                "correct": "b",
-                "answer": "b) Psychologie · Information/Gesundheitssystem · Körper/Alltag"
-            },
-            {
-                "id": 7,
-                "question": "Welche Patient*innengruppe zeigt laut Review tendenziell das geringste Bedürfnis nach detaillierter Prognose-Information?",
-                "options": ["a) Jüngere Frauen", "b) Männer < 50 J", "c) Ältere Patient*innen (> 70 J)", "d) Metastasiertes Stadium"],
-                "correct": "c",
-                "answer": "c) Ältere Patient*innen (> 70 J)"
-            },
-            {
-                "id": 8,
-                "question": "Welche Aussage trifft nicht auf die Meta-Analyse von Gysels et al. (2004/05) zu Kommunikationstrainings zu?",
-                "options": ["a) Viele Studien wiesen methodische Schwächen auf.", "b) Es bestehen inkonsistente Effekte auf psychische Endpunkte.", "c) Trainings reduzierten eindeutig die Burn-out-Rate der Ärzt*innen.", "d) Eine einheitliche Definition von \"Kommunikationsfertigkeit\" fehlte häufig."],
-                "correct": "c",
-                "answer": "c) Trainings reduzierten eindeutig die Burn-out-Rate der Ärzt*innen."
-            },
-            {
-                "id": 9,
-                "question": "Welches Messinstrument erfasst Selbstwirksamkeit in der Krankheitsbewältigung speziell bei onkologischen Patient*innen?",
-                "options": ["a) CBI", "b) BDI-II", "c) RIAS", "d) LOT-R"],
-                "correct": "a",
-                "answer": "a) CBI"
-            },
-            {
-                "id": 10,
-                "question": "In Fallowfield et al. (2002) zeigte sich nach einem Kommunikationsworkshop primär eine Zunahme von …",
-                "options": ["a) offenen Fragen und empathischen Äußerungen", "b) Gesprächsdauer um 40 %", "c) Nutzung von PowerPoint-Grafiken", "d) Verordnung palliativ-medizinischer Medikamente"],
-                "correct": "a",
-                "answer": "a) offenen Fragen und empathischen Äußerungen"
-            },
-            {
-                "id": 11,
-                "question": "Welche Variable moderiert laut dem im Review vorgestellten Modell den Zusammenhang zwischen Kommunikation und Inanspruchnahme psychosozialer Dienste besonders stark?",
-                "options": ["a) Tumorart", "b) Subjektive Zufriedenheit mit der Interaktion", "c) Wohnort (Stadt/Land)", "d) Anzahl der Chemotherapiezyklen"],
-                "correct": "b",
-                "answer": "b) Subjektive Zufriedenheit mit der Interaktion"
-            },
-            {
-                "id": 12,
-                "question": "Welches Trainingsformat wies in Randomized-Controlled-Trials (RCT) die nachhaltigste Verbesserung ärztlicher Fertigkeiten (12-Monats-Follow-up) auf?",
-                "options": ["a) Einmaliger 90-Min-Vortrag", "b) Mehrtägiges Basistraining + Konsolidierungsworkshop", "c) E-Learning-Modul ohne Präsenz", "d) Peer-Supervision via Telefon"],
-                "correct": "b",
-                "answer": "b) Mehrtägiges Basistraining + Konsolidierungsworkshop"
-            },
-            {
-                "id": 13,
-                "question": "Welcher Fragebogen misst vorrangig Informations- und Entscheidungspräferenzen bei Krebs?",
-                "options": ["a) MPP", "b) GHQ-12", "c) POMS", "d) MBSS"],
-                "correct": "a",
-                "answer": "a) MPP"
-            }
-        ]
-    },
-    "pinguin": {
-        "title": "Pinguin (schwer)",
-        "emoji": "🐧",
-        "questions": [
-            {
-                "id": 14,
-                "question": "Welcher k-Wert (Cohen) wurde in Söllner et al. (2001) für die Übereinstimmung zwischen ärztlicher Distress-Einschätzung und Patient*innenselbstauskunft berichtet?",
-                "options": ["a) 0,65", "b) 0,42", "c) 0,25", "d) 0,05"],
-                "correct": "d",
-                "answer": "d) 0,05"
-            },
-            {
-                "id": 15,
-                "question": "In McLachlan et al. (2001) profitierten Patient*innen mit welchem Depressions-Cut-off (BDI-SF) am stärksten von der Interventionsgruppe?",
-                "options": ["a) ≥ 4", "b) ≥ 8", "c) ≥ 12", "d) ≥ 16"],
-                "correct": "c",
-                "answer": "c) ≥ 12"
-            },
-            {
-                "id": 16,
-                "question": "Welche der folgenden fünf Faktoren des Measure of Patients' Preferences (MPP) zeigten in der japanischen Validierung (Fujimori et al., 2007) die höchste Faktorladung?",
-                "options": ["a) Setting", "b) Emotionale Unterstützung", "c) Medizinische Information", "d) Ermutigung zur Fragenstellung"],
-                "correct": "c",
-                "answer": "c) Medizinische Information"
-            },
-            {
-                "id": 17,
-                "question": "Die Studie von Hagerty et al. (2004) ergab, dass > 70 % palliativ behandelter Patient*innen quantitative Überlebensdaten wünschten; welche Erhebungsform wurde verwendet?",
-                "options": ["a) Videovignetten", "b) Fiktives Fallbeispiel im Fragebogen", "c) Standardisiertes Klinisches Interview", "d) Experience-Sampling-Methode"],
-                "correct": "b",
-                "answer": "b) Fiktives Fallbeispiel im Fragebogen"
-            },
-            {
-                "id": 18,
-                "question": "Beim RIAS-Kodiersystem repräsentiert die Kategorie \"Back-channel responses\" hauptsächlich …",
-                "options": ["a) erklärende Metaphern der Ärztinnen", "b) nonverbale Zustimmungssignale der Patientinnen", "c) organisatorische Gesprächsabschlüsse", "d) Therapieentscheidungen"],
-                "correct": "b",
-                "answer": "b) nonverbale Zustimmungssignale der Patientinnen"
-            },
-            {
-                "id": 19,
-                "question": "Welcher Anteil der Ärzt*innen berichtete laut Baile et al. (2002) monatlich durchschnittlich ≥ 13 Erstdiagnosen mit schlechter Prognose überbringen zu müssen?",
-                "options": ["a) < 10 %", "b) 25 %", "c) ≈ 50 %", "d) > 75 %"],
-                "correct": "c",
-                "answer": "c) ≈ 50 %"
-            },
-            {
-                "id": 20,
-                "question": "Die kombinierte Interventionsbedingung \"mündliche Information + Broschüre + Video\" (de Lorenzo et al., 2004) führte zu einer signifikanten Verbesserung welcher POMS-Subskala?",
-                "options": ["a) Verwirrtheit", "b) Vitalität", "c) Feindseligkeit", "d) Depression"],
-                "correct": "b",
-                "answer": "b) Vitalität"
-            }
-        ]
-    }
-}
+# Quiz data (data/quiz_bank.json, prebuilt index if available)
+quiz_bank = tenant.quiz_bank()
+QUIZ_DATA = quiz_bank["levels"]
 
-# Initialize quiz session state
+# Initialize quiz session state (paged back in if it was spilled to disk)
+state_manager.restore(st.session_state, "quiz_answers")
 if "quiz_answers" not in st.session_state:
     st.session_state.quiz_answers = {}
 
+# Spaced repetition: a known user only gets today's 3-5 due questions
+quiz_scheduler = open_scheduler(team)
+quiz_results = open_results(team)
+quiz_users = [NO_QUIZ_USER] + roster.ma_codes()
+if "quiz_user" not in st.session_state:
+    remembered = st.query_params.get(QUIZ_USER_PARAM)
+    st.session_state.quiz_user = remembered if remembered in quiz_users else NO_QUIZ_USER
+
+def remember_quiz_user():
+    if st.session_state.quiz_user == NO_QUIZ_USER:
+        st.query_params.pop(QUIZ_USER_PARAM, None)
+    else:
+        st.query_params[QUIZ_USER_PARAM] = st.session_state.quiz_user
+
+def answer_due_question(user, qid, choice):
+    """Button callback: score the answer and reschedule the question (SM-2)"""
+    # Callbacks run before the script body, so the answers may still be parked on disk
+    state_manager.restore(st.session_state, "quiz_answers")
+    st.session_state.setdefault("quiz_answers", {})[qid] = choice
+    correct = choice == quiz_bank["correct"][qid]
+    quiz_scheduler.answer(user, qid, correct)
+    quiz_results.record(user, quiz_bank["by_id"][qid][0], qid, correct)
+
+quiz_user = st.selectbox("Wer bisch du?", quiz_users, key="quiz_user", on_change=remember_quiz_user,
+                         help="Mit Name: jede Tag nur di fällige Frage (Spaced Repetition)")
+show_all_questions = quiz_user == NO_QUIZ_USER
+if not show_all_questions:
+    st.markdown(f"<h3 class='accent'>🗓️ Hüt fällig</h3>", unsafe_allow_html=True)
+    for qid in quiz_scheduler.plan(quiz_user, list(quiz_bank["by_id"])):
+        level_key, position = quiz_bank["by_id"][qid]
+        q = QUIZ_DATA[level_key]["questions"][position]
+        st.markdown(f"**{QUIZ_DATA[level_key]['emoji']} Frag {q['id']}:** {q['question']}")
+        result = quiz_scheduler.answered_on(quiz_user, qid)
+        if result is None:
+            cols = st.columns(len(q['options']))
+            for i, option in enumerate(q['options']):
+                cols[i].button(option, key=f"due{q['id']}_{i}", on_click=answer_due_question,
+                               args=(quiz_user, qid, option[0]))
+        elif result:
+            st.success(f"✅ Richtig! {q['answer']}")
+        else:
+            st.error(f"❌ Falsch! Richtig wär: {q['answer']}")
+        st.markdown("---")
+    show_all_questions = st.toggle("Ganze Fragekatalog zeige", key="quiz_show_all")
+
 # Quiz sections
-for level_key, level_data in QUIZ_DATA.items():
+for level_key, level_data in (QUIZ_DATA.items() if show_all_questions else ()):
     with st.expander(f"{level_data['emoji']} {level_data['title']}"):
         for q in level_data['questions']:
             st.markdown(f"**Frag {q['id']}:** {q['question']}")
@@ -979,6 +1058,10 @@ for level_key, level_data in QUIZ_DATA.items():
             cols = st.columns(len(q['options']))
             for i, option in enumerate(q['options']):
                 if cols[i].button(option, key=f"q{q['id']}_{i}", help=f"Frag {q['id']} Option {option[0]}"):
+                    # Only the first answer of a session counts for the team results
+                    if q['id'] not in st.session_state.quiz_answers:
+                        quiz_results.record("" if quiz_user == NO_QUIZ_USER else quiz_user,
+                                            level_key, q['id'], option[0] == q['correct'])
                     # Store answer and show result immediately
                     st.session_state.quiz_answers[q['id']] = option[0]
                     
@@ -1003,10 +1086,8 @@ for level_key, level_data in QUIZ_DATA.items():
 # Quiz statistics
 total_questions = sum(len(level_data['questions']) for level_data in QUIZ_DATA.values())
 answered_questions = len(st.session_state.quiz_answers)
-correct_answers = sum(1 for q_id, user_answer in st.session_state.quiz_answers.items() 
-                     for level_data in QUIZ_DATA.values() 
-                     for q in level_data['questions'] 
-                     if q['id'] == q_id and user_answer == q['correct'])
+correct_answers = sum(1 for q_id, user_answer in st.session_state.quiz_answers.items()
+                      if quiz_bank["correct"].get(q_id) == user_answer)
 
 if answered_questions > 0:
     st.markdown("---")
@@ -1018,6 +1099,33 @@ if answered_questions > 0:
         percentage = round((correct_answers / answered_questions) * 100, 1)
         col3.metric("Erfolgsquote", f"{percentage}%")
 
+# Team results come from running totals, no answer history is read here
+with st.expander("🏆 Team-Rangliste"):
+    leaderboard = quiz_results.leaderboard()
+    if leaderboard:
+        # Markdown instead of st.table: the expander body always runs, pandas must not
+        st.markdown("| Rang | Name | Gantwortet | Richtig | Quote |\n|---|---|---|---|---|\n" + "\n".join(
+            f"| {rank} | {row['user']} | {row['answered']} | {row['correct']} | {row['percent']}% |"
+            for rank, row in enumerate(leaderboard, start=1)))
+    else:
+        st.info("No kei Antworte im Team.")
+    if quiz_user != NO_QUIZ_USER:
+        per_level = quiz_results.user_levels_of(quiz_user)
+        cols = st.columns(len(QUIZ_DATA) or 1)
+        for col, (level_key, level_data) in zip(cols, QUIZ_DATA.items()):
+            answered, correct = per_level.get(level_key, (0, 0))
+            col.metric(f"{level_data['emoji']} {quiz_user}", f"{correct}/{answered}")
+    if st.toggle("Schwierigkeit pro Frag", key="quiz_difficulty"):
+        difficulty = quiz_results.difficulty()
+        ranked = []
+        for qid, (level_key, position) in quiz_bank["by_id"].items():
+            if qid in difficulty:
+                answered, percent = difficulty[qid]
+                ranked.append((percent, {"Frag": qid, "Stufe": QUIZ_DATA[level_key]["emoji"],
+                                         "Antworte": answered, "Richtig": f"{percent}%"}))
+        ranked.sort(key=lambda item: item[0])  # hardest first
+        st.table([row for _, row in ranked])
+
 st.markdown(f"""
 <div style='text-align: center; margin-top: 2rem; font-size: 0.8rem; color: #666;'>
     Alli Frage basiere uf Befund und Instrument, wo im Literatur-Review vo Lehmann et al. (2009, Psychother Psych Med 59:e3-e27) zämmegfasst sind.
@@ -1028,46 +1136,15 @@ st.markdown(f"""
 st.markdown("---")
 st.markdown(f"<h2 class='secondary' style='text-align: center; margin: 2rem 0;'>📋 SOPs - Standard Operating Procedures</h2>", unsafe_allow_html=True)
 
-# Function to get SOP image as base64
-def get_sop_image_base64(sop_file):
-    """Convert SOP image to base64 for embedding"""
-    try:
-        with open(f"data/{sop_file}", "rb") as img_file:
-            import base64
-            return base64.b64encode(img_file.read()).decode()
-    except FileNotFoundError:
-        return None
-
-# Function to find all SOP files
-def get_all_sop_files():
-    """Find all SOP files in data directory"""
-    import os
-    import glob
-    sop_files = []
-    if os.path.exists("data"):
-        sop_pattern = os.path.join("data", "SOP*.png")
-        found_files = glob.glob(sop_pattern)
-        for file_path in found_files:
-            filename = os.path.basename(file_path)
-            # Extract SOP number from filename (e.g., SOP01.png -> 01)
-            sop_number = filename.replace("SOP", "").replace(".png", "")
-            sop_files.append({
-                "filename": filename,
-                "number": sop_number,
-                "title": f"SOP {sop_number}"
-            })
-    # Sort by SOP number
-    sop_files.sort(key=lambda x: x['number'])
-    return sop_files
-
-# Get all available SOPs
-available_sops = get_all_sop_files()
+# SOP catalog: sidecar metadata and search index, no images loaded yet
+sop_catalog = tenant.sop_catalog()
 
 # ---------- INTERACTIVE FLOWCHART ----------
 st.markdown("---")
 st.markdown(f"<h3 class='accent' style='text-align: center; margin: 1.5rem 0;'>🔄 Interaktivs Flowchart - Konsil-Workflow</h3>", unsafe_allow_html=True)
 
-# Initialize flowchart session state
+# Initialize flowchart session state (paged back in if it was spilled to disk)
+state_manager.restore(st.session_state, "flowchart_steps")
 if "flowchart_steps" not in st.session_state:
     st.session_state.flowchart_steps = {
         "start": False,
@@ -1080,6 +1157,23 @@ if "flowchart_steps" not in st.session_state:
         "patient_angerufen": False,
         "team_benachrichtigt": False
     }
+state_manager.restore(st.session_state, "flowchart_clock")
+workflow_analytics = open_analytics(team)
+
+
+def record_step(step, value):
+    """Set a flowchart step and log the time since the previous step"""
+    st.session_state.flowchart_steps[step] = value
+    now = time.time()
+    clock = st.session_state.get("flowchart_clock")
+    if step == "start" or clock is None:
+        st.session_state.flowchart_clock = {"wf": uuid.uuid4().hex[:12], "started": now,
+                                            "step": step, "at": now}
+        return
+    workflow_analytics.transition(clock["wf"], clock["step"], step, value, now - clock["at"],
+                                  now - clock["started"])
+    clock.update(step=step, at=now)
+
 
 # CSS for flowchart cards and arrows
 flowchart_css = """
@@ -1157,6 +1251,7 @@ if any(v for v in st.session_state.flowchart_steps.values() if v):
     with col_reset:
         if st.button("🔄 Reset", key="reset_workflow", help="Workflow neu starte"):
             st.session_state.flowchart_steps = {key: False if isinstance(val, bool) else None for key, val in st.session_state.flowchart_steps.items()}
+            st.session_state.pop("flowchart_clock", None)  # an abandoned workflow is not counted
             st.rerun()
 
 # Step 1: Start
@@ -1172,7 +1267,7 @@ if not st.session_state.flowchart_steps["start"]:
     col1, col2, col3 = st.columns([1, 1, 1])
     with col2:
         if st.button("✅ Start", key="step_start", help="Workflow starte"):
-            st.session_state.flowchart_steps["start"] = True
+            record_step("start", True)
             st.rerun()
 else:
     st.markdown('<div class="flowchart-arrow">⬇️</div>', unsafe_allow_html=True)
@@ -1192,11 +1287,11 @@ else:
             subcol1, subcol2 = st.columns(2)
             with subcol1:
                 if st.button("✅ Agnoh", key="konsil_ja", help="Konsil agnoh"):
-                    st.session_state.flowchart_steps["konsil_angenommen"] = True
+                    record_step("konsil_angenommen", True)
                     st.rerun()
             with subcol2:
                 if st.button("❌ Abglehnt", key="konsil_nein", help="Konsil abglehnt"):
-                    st.session_state.flowchart_steps["konsil_angenommen"] = False
+                    record_step("konsil_angenommen", False)
                     st.rerun()
     
     # Show result of konsil decision
@@ -1227,11 +1322,11 @@ else:
                 subcol1, subcol2 = st.columns(2)
                 with subcol1:
                     if st.button("✅ Ja", key="vor_ort_ja", help="Vor Ort erledigt"):
-                        st.session_state.flowchart_steps["vor_ort_abgeschlossen"] = True
+                        record_step("vor_ort_abgeschlossen", True)
                         st.rerun()
                 with subcol2:
                     if st.button("❌ Nei", key="vor_ort_nein", help="Nöd vor Ort erledigt"):
-                        st.session_state.flowchart_steps["vor_ort_abgeschlossen"] = False
+                        record_step("vor_ort_abgeschlossen", False)
                         st.rerun()
         
         # Branch A: Vor Ort abgeschlossen
@@ -1261,7 +1356,7 @@ else:
                 col1, col2, col3 = st.columns([1, 1, 1])
                 with col2:
                     if st.button("✅ Erstellt", key="eintrag_erstellt", help="Iitrag erstellt"):
-                        st.session_state.flowchart_steps["eintrag_erstellt"] = True
+                        record_step("eintrag_erstellt", True)
                         st.rerun()
             else:
                 st.markdown('<div class="flowchart-arrow">⬇️</div>', unsafe_allow_html=True)
@@ -1281,11 +1376,11 @@ else:
                         subcol1, subcol2 = st.columns(2)
                         with subcol1:
                             if st.button("✅ Erreichbar", key="patient_ja", help="Patient erreichbar"):
-                                st.session_state.flowchart_steps["patient_erreichbar"] = True
+                                record_step("patient_erreichbar", True)
                                 st.rerun()
                         with subcol2:
                             if st.button("❌ Nöd erreichbar", key="patient_nein", help="Patient nöd erreichbar"):
-                                st.session_state.flowchart_steps["patient_erreichbar"] = False
+                                record_step("patient_erreichbar", False)
                                 st.rerun()
                 
                 # Patient erreichbar - Path A
@@ -1305,7 +1400,7 @@ else:
                         col1, col2, col3 = st.columns([1, 1, 1])
                         with col2:
                             if st.button("✅ Iitrage", key="datum_eingetragen", help="Datum iitrage"):
-                                st.session_state.flowchart_steps["datum_eingetragen"] = True
+                                record_step("datum_eingetragen", True)
                                 st.rerun()
                     else:
                         st.markdown('<div class="flowchart-arrow">⬇️</div>', unsafe_allow_html=True)
@@ -1323,7 +1418,8 @@ else:
                             col1, col2, col3 = st.columns([1, 1, 1])
                             with col2:
                                 if st.button("✅ Benachrichtigt", key="team_benachrichtigt", help="Team informiert"):
-                                    st.session_state.flowchart_steps["team_benachrichtigt"] = True
+                                    record_step("team_benachrichtigt", True)
+                                    notify("team_benachrichtigt", team, "Konsil sichtbar – vorlüüfigs Besuchsdatum iitreit")
                                     st.rerun()
                         else:
                             st.markdown('<div class="flowchart-arrow">⬇️</div>', unsafe_allow_html=True)
@@ -1351,7 +1447,9 @@ else:
                         col1, col2, col3 = st.columns([1, 1, 1])
                         with col2:
                             if st.button("✅ Benachrichtigt", key="sek_benachrichtigt", help="Sekretariat informiert"):
-                                st.session_state.flowchart_steps["sekretariat_benachrichtigt"] = True
+                                record_step("sekretariat_benachrichtigt", True)
+                                notify("sekretariat_benachrichtigt", team,
+                                       "Patient am planete Tag nöd erreichbar – bitte Status in KISIM aktualisiere und Patient aalüüte")
                                 st.rerun()
                     else:
                         st.markdown('<div class="flowchart-arrow">⬇️</div>', unsafe_allow_html=True)
@@ -1369,7 +1467,8 @@ else:
                             col1, col2, col3 = st.columns([1, 1, 1])
                             with col2:
                                 if st.button("✅ Agrueffe", key="patient_angerufen", help="Patient kontaktiert"):
-                                    st.session_state.flowchart_steps["patient_angerufen"] = True
+                                    record_step("patient_angerufen", True)
+                                    notify("patient_angerufen", team, "Patient agrüeft – PO-Bedarf in KISIM dokumentiert")
                                     st.rerun()
                         else:
                             st.markdown('<div class="flowchart-arrow">⬇️</div>', unsafe_allow_html=True)
@@ -1432,48 +1531,145 @@ if st.session_state.flowchart_steps["start"]:
         progress = completed_steps / total_steps
         st.progress(progress, text=f"Fortschritt: {completed_steps}/{total_steps} Schritt abgschlosse")
 
+with st.expander("⏱️ Workflow-Analyse"):
+    # Running aggregates only: the panel costs the same for 10 or 10 000 workflows
+    summary = workflow_analytics.summary()
+    bottlenecks = workflow_analytics.bottlenecks()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Abgschlossni Workflows", summary["completed"])
+    col2.metric("Median Gsamtdauer", summary["p50"],
+                help=f"Durchschnitt {format_duration(summary['mean'])}" if summary["mean"] else None)
+    col3.metric("Grösste Engpass", edge_label(bottlenecks[0]["edge"]) if bottlenecks else "–")
+    if bottlenecks:
+        st.markdown("| Schritt | Anzahl | Median | p90 | Durchschnitt | Max | Aateil Ziit |\n|---|---|---|---|---|---|---|\n"
+                    + "\n".join(f"| {edge_label(row['edge'])} | {row['count']} | {row['p50']} | {row['p90']} "
+                                f"| {format_duration(row['mean'])} | {format_duration(row['max'])} | {row['share']:.0%} |"
+                                for row in bottlenecks))
+        labels = {edge_label(row["edge"]): row["edge"] for row in bottlenecks}
+        selected = st.selectbox("Verteilig vom Schritt", list(labels), key="workflow_histogram")
+        histogram = dict(workflow_analytics.histogram(labels[selected]))
+        peak = max(histogram.values()) or 1
+        st.markdown("\n".join(f"`{label:>10}` {'█' * round(20 * count / peak)} {count}  "
+                              for label, count in histogram.items() if count))
+        if summary["outcomes"]:
+            st.caption(" · ".join(f"{outcome}: {count}" for outcome, count in summary["outcomes"].items()))
+    else:
+        st.info("No kei Workflow-Schritt ufzeichnet.")
+
 st.markdown("---")
 
 # ---------- STATIC SOPs ----------
+def prepare_sop_download(filename):
+    """Button callback: offer this SOP file for download on the next run"""
+    st.session_state.sop_download = filename
+
 st.markdown("---")
 st.markdown(f"<h3 class='accent' style='text-align: center; margin: 1.5rem 0;'>📋 Statischi SOP-Dokument</h3>", unsafe_allow_html=True)
 
-if available_sops:
-    st.markdown(f"<p style='text-align: center; color: #CCFF00;'>Verfüegbari SOPs: {len(available_sops)} Dokument</p>", unsafe_allow_html=True)
+if len(sop_catalog):
+    st.markdown(f"<p style='text-align: center; color: #CCFF00;'>Verfüegbari SOPs: {len(sop_catalog)} Dokument</p>", unsafe_allow_html=True)
+    sop_query = st.text_input("🔍 SOP sueche", key="sop_query",
+                              placeholder="Titel, Tag oder Stichwort, z.B. KISIM")
+    matching_sops = sop_catalog.search(sop_query)
+    if sop_query or len(matching_sops) > SOP_RESULTS:
+        st.caption(f"{min(len(matching_sops), SOP_RESULTS)} vo {len(matching_sops)} Träffer")
+    if not matching_sops:
+        st.info(f"Kei SOP zu «{sop_query}» gfunde.")
     
-    # Display SOPs in expandable sections
-    for sop in available_sops:
+    # Expander bodies run even when collapsed, so only the shown results load their image
+    for sop in matching_sops[:SOP_RESULTS]:
         with st.expander(f"📄 {sop['title']} - Standard Operating Procedure"):
-            # Get image as base64
-            sop_base64 = get_sop_image_base64(sop['filename'])
+            details = [f"Version {sop['version']}"] if sop['version'] else []
+            details += [f"#{tag}" for tag in sop['tags']]
+            if details:
+                st.caption(" · ".join(details))
+            # Only the selected page is shipped as a downscaled preview;
+            # further pages are rendered when they are selected
+            page_count = len(sop['pages'])
+            page = 0
+            if page_count > 1:
+                page_labels = [f"{i + 1} / {page_count}" for i in range(page_count)]
+                page = page_labels.index(st.select_slider("Siite", options=page_labels,
+                                                          key=f"sop_page_{sop['number']}"))
+                thumbs = "".join(
+                    f"<img src='{tenant.sop_page_uri(sop, i, 'thumb')}' alt='{i + 1}' title='Siite {i + 1}' "
+                    f"style='height: 80px; margin: 0 4px; border: 2px solid {ACCENT if i == page else '#333'}; border-radius: 4px;'/>"
+                    for i in range(page_count))
+                st.markdown(f"<div style='overflow-x: auto; white-space: nowrap; text-align: center;'>{thumbs}</div>",
+                            unsafe_allow_html=True)
+            sop_preview = tenant.sop_page_uri(sop, page)
             
-            if sop_base64:
-                # Display the SOP image
+            if sop_preview:
+                # Display the SOP page
                 st.markdown(f"""
                 <div style='text-align: center; margin: 1rem 0;'>
-                    <img src="data:image/png;base64,{sop_base64}" 
+                    <img src="{sop_preview}" 
                          style='max-width: 100%; height: auto; border: 2px solid #CCFF00; border-radius: 8px; box-shadow: 0 0 20px rgba(204, 255, 0, 0.3);' 
                          alt="{sop['title']}"/>
                 </div>
                 """, unsafe_allow_html=True)
                 
-                # Add download link
-                st.markdown(f"""
-                <div style='text-align: center; margin: 1rem 0;'>
-                    <a href="data:image/png;base64,{sop_base64}" download="{sop['filename']}" 
-                       style='background: linear-gradient(45deg, #000000, #1a1a1a); 
-                              color: #CCFF00; 
-                              border: 2px solid #CCFF00; 
-                              padding: 0.5rem 1rem; 
-                              text-decoration: none; 
-                              border-radius: 5px;
-                              box-shadow: 0 0 15px rgba(204, 255, 0, 0.3);
-                              font-weight: bold;'>
-                        💾 {sop['title']} Download
-                    </a>
-                </div>
-                """, unsafe_allow_html=True)
+                # The original (possibly a whole multi-page TIFF) is only read
+                # for the one SOP whose download was asked for
+                page_file = sop['pages'][page][0]
+                if st.session_state.get("sop_download") == page_file:
+                    st.download_button(f"💾 {sop['title']} Download", tenant.sop_bytes(page_file),
+                                       file_name=page_file, mime=mime_type(page_file),
+                                       key=f"sop_download_{sop['number']}")
+                else:
+                    st.button(f"💾 {sop['title']} Download vorbereite", key=f"sop_prepare_{sop['number']}",
+                              on_click=prepare_sop_download, args=(page_file,))
             else:
                 st.error(f"SOP-Datei {sop['filename']} nöd gfunde")
 else:
-    st.info("🔍 Momentan sind kei SOPs verfüegbar. Dateie im 'data' Ordner als SOP01.png, SOP02.png, etc. speichere.") 
\ No newline at end of file
+    st.info(f"🔍 Momentan sind kei SOPs verfüegbar. Dateie im '{tenant.data_dir}' Ordner als SOP01.png, SOP02.png, etc. (mehrsiitig: SOP03_p01.png, SOP03_p02.png oder SOP04.tif) speichere.")
+
+# Drop least recently used teams once this run has loaded its assets
+tenant_registry.enforce_cap()
+
+# Keep this session within its memory budget between reruns
+state_manager.enforce(
+    st.session_state,
+    parkable=["quiz_answers", "flowchart_steps", "flowchart_clock"],
+)
+
+# The capture ends here, so the diagnostics panel below can already list it
+rerun_profiler = st.session_state.pop("rerun_profiler", None)
+if rerun_profiler is not None:
+    rerun_profiler.stop(team)
+
+# ---------- DIAGNOSTICS (?diag=1) ----------
+if st.query_params.get(DIAGNOSTICS_PARAM) == "1":
+    st.markdown("---")
+    with st.expander("🛠️ Diagnose", expanded=True):
+        usage = state_manager.usage(st.session_state)
+        session_total = sum(usage.values())
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Session-Spiicher", f"{session_total / 1024:.1f} KB",
+                    help=f"Limit {state_manager.limit_bytes / 1024:.0f} KB")
+        col2.metric("Uf Disk uuslagered", f"{state_manager.spilled_bytes() / 1024:.1f} KB")
+        col3.metric("Log-Iiträg (RAM / total)", f"{len(triage_state.recent)} / {triage_state.assignments}")
+        st.table([{"Key": str(key), "Bytes": size} for key, size in usage.items()])
+        notify_stats = get_dispatcher().stats()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Mitteilige i de Warteschlange", notify_stats["pending"])
+        col2.metric("Zuestellzyt (Median)", f"{notify_stats['latency_ms_p50'] or 0:.0f} ms")
+        col3.metric("Gschickt / Fehler", f"{notify_stats['sent']} / {notify_stats['failed']}")
+        st.json({"tenants": tenant_registry.stats(), "event_store": store.stats(),
+                 "notifications": notify_stats,
+                 "quiz": {"schedules": quiz_scheduler.stats(), "results": quiz_results.stats()},
+                 "workflows": workflow_analytics.stats(),
+                 "assets": tenant.assets.stats(),
+                 "images": tenant.images.stats(),
+                 "workbooks": tenant.workbooks()})
+
+        captures = recent_captures(PROFILE_CAPTURES)
+        if captures:
+            st.markdown("**Profil-Ufnahme** (collapsed stacks, z.B. mit speedscope.app öffne)")
+            st.table([{"Zyt": c["time"], "Team": c["label"], "ms": c["ms"], "Samples": c["samples"]}
+                      for c in captures])
+            chosen = st.selectbox("Ufnahm", [c["path"].name for c in captures], key="profile_capture")
+            chosen_path = next(c["path"] for c in captures if c["path"].name == chosen)
+            st.table([{"Funktion": frame, "Samples": count} for frame, count in self_time(chosen_path)])
+            st.download_button("💾 Ufnahm abelade", chosen_path.read_bytes(), file_name=chosen,
+                               mime="text/plain", key="profile_download")